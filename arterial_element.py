@@ -8,6 +8,16 @@ Outputs: Po, Fi
 """
 
 import bdsim
+
+from inflow import InflowSource, tabulated
+
+def build_log(settings, message):
+    """
+    Print a model build message unless settings['simulation']['quiet'] is set.
+    """
+    if settings is None or not settings['simulation'].get('quiet', False):
+        print(message)
+
 class ArterialElement():
     """
     Simple arterial element model
@@ -46,7 +56,7 @@ class ArterialElement():
         output_names = ['Po', 'Fi'] if self.index != 1 else ['Po']  # Naming inputs, just Po for first segment
 
         if debugger_enabled and debug_this_index:
-            print(f"Debugging enabled for arterial element {self.index}, adding extra ports to output.")
+            build_log(self.settings, f"Debugging enabled for arterial element {self.index}, adding extra ports to output.")
             debugger_ports = len(self.debug_port_list)
             output_names += self.debug_port_list
         else:
@@ -158,29 +168,47 @@ def arterial_elements_from_params(sim: bdsim.BDSim, model_params, settings):
         if rp is None:
             cls_art = ArterialElement(sim, rs, l, c, index, settings)
             arterial_elements['BD'][index] = cls_art.arterial_element
-            print(f"Created arterial element for segment {name} with index {index}")
+            build_log(settings, f"Created arterial element for segment {name} with index {index}")
         else:
             cls_art = ArterialElement(sim, rs, l, c, index, settings, rp)
             arterial_elements['BD'][index] = cls_art.arterial_element
-            print(f"Created arterial element for segment {name} "
-                  f"with index {index} and peripheral resistance Rp={rp}")
-    print("All arterial elements created.")
+            build_log(settings, f"Created arterial element for segment {name} "
+                                f"with index {index} and peripheral resistance Rp={rp}")
+    build_log(settings, "All arterial elements created.")
     return arterial_elements
 
-def to_subsystem(model: bdsim.BlockDiagram, arterial_elements):
+def to_subsystem(model: bdsim.BlockDiagram, arterial_elements, settings=None):
     """
     Convert all arterial elements to subsystems and store in 'SS' dictionary
     Args:
         model (bdsim.BlockDiagram): Main block diagram to add subsystems to.
         arterial_elements (dict): Dictionary containing arterial elements.
+        settings (dict, optional): Settings, only used for settings['simulation']['quiet'].
     """
     arterial_elements['SS'] = {}
     for arterial_element in arterial_elements['BD'].values():
         arterial_elements['SS'][str(arterial_element.name)] = model.SUBSYSTEM(arterial_element)
 
-    print("All arterial elements converted to subsystems.")
+    build_log(settings, "All arterial elements converted to subsystems.")
     return arterial_elements
 
+class RootSine():
+    """
+    Root of the sine generator scaled to the input pressure, used by the 'Waveform' FUNCTION block.
+    A class instead of a lambda so the block keeps a handle on its parameters: amplitude and baseline are
+    attributes, so no settings lookup happens per step, and a compiled diagram reused within the process
+    (main.compiled_model) passes a changed input_signal to update().
+    """
+    def __init__(self, settings):
+        self.update(settings['input_signal'])
+
+    def update(self, signal):
+        self.amplitude = signal['amplitude']
+        self.baseline = signal['baseline']
+
+    def __call__(self, u1):
+        return (u1**(1/2))*self.amplitude + self.baseline
+
 def connect_segments(model, arterial_elements, model_params, settings):
     """
     Connect arterial segments based on model parameters.
@@ -194,12 +222,24 @@ def connect_segments(model, arterial_elements, model_params, settings):
     # Create a flow plug for the outer ends of the model.
     fo_plug = model.CONSTANT(0)  # Outflow plug
 
-    # Flow generator (ROOTSINE for now)
-    generator = model.WAVEFORM(wave = 'sine', freq=settings['input_signal']['frequency'])
-    wave = model.FUNCTION(lambda u1: ((u1**(1/2))*settings['input_signal']['amplitude'] + settings['input_signal']['baseline']), name='Waveform')
+    # Flow generator: ROOTSINE by default, other shapes and measured waveforms from a table (see inflow.py)
+    if tabulated(settings['input_signal']):
+        source = InflowSource(settings)
+        generator = source   # freq and phase like the WAVEFORM block
+        wave = model.FUNCTION(source, name='Waveform')
+        model.connect(model.TIME(), wave)
+    else:
+        generator = model.WAVEFORM(wave = 'sine', freq=settings['input_signal']['frequency'])
+        source = RootSine(settings)
+        wave = model.FUNCTION(source, name='Waveform')
+        model.connect(generator, wave)
+
+    # Keep handles on the generator and the waveform function so a compiled model can be rerun with another
+    # input signal
+    arterial_elements['generator'] = generator
+    arterial_elements['source'] = source
 
     # Seperately handle connections of the 1st segment
-    model.connect(generator, wave)
     model.connect(wave, arterial_elements['SS']['1'][0])
 
     # Segments have 2 inputs: [0] = Pi, [1] = Fo
@@ -213,7 +253,7 @@ def connect_segments(model, arterial_elements, model_params, settings):
         debugger_enabled = settings['debugger']['enabled']
 
         if debugger_enabled and debug_for_index:
-            print(f"Debugging enabled for segment {index}, connecting ports to dataports.")
+            build_log(settings, f"Debugging enabled for segment {index}, connecting ports to dataports.")
             output_ports = 2 if index != 1 else 1  # Fi is clipped for the 1st segment to mimic aortic valve behavior
 
             for i, port_name in enumerate(settings['debugger']['debugger_port_list']):
@@ -225,13 +265,13 @@ def connect_segments(model, arterial_elements, model_params, settings):
 
         match connections:
             case []: ## NO CONNECTIONS ---------------------------------------------------------------------------
-                print(f"Segment {index} has no connections.")
+                build_log(settings, f"Segment {index} has no connections.")
                 # Plugging Fo with outflow plug
                 model.connect(fo_plug, arterial_elements['SS'][str(index)][1])
 
             case [a, *rest]:
                 if not rest: ## ONE CONNECTION -------------------------------------------------------------------
-                    print(f"Segment {index} has one connection to segment {a}, now connecting.")
+                    build_log(settings, f"Segment {index} has one connection to segment {a}, now connecting.")
 
                     # Connecting Pi of current segment to Po of connected segment
                     arterial_elements['SS'][str(a)][0] = -1 * arterial_elements['SS'][str(index)][0]
@@ -242,7 +282,7 @@ def connect_segments(model, arterial_elements, model_params, settings):
                     # model.connect(arterial_elements['SS'][str(a)][1], arterial_elements['SS'][str(index)][1])
 
                 else: ## MULTIPLE CONNECTIONS --------------------------------------------------------------------
-                    print(f"Segment {index} has multiple connections {connections}, now connecting {[a, *rest]}.")
+                    build_log(settings, f"Segment {index} has multiple connections {connections}, now connecting {[a, *rest]}.")
                     n = len([a, *rest])
                     sumb = model.SUM('+' * n, name=f"Sum: {connections} to {index}")   # Create a appropriately sized sum block to combine outputs
                     for i, conn in enumerate([a, *rest]):
@@ -254,7 +294,7 @@ def connect_segments(model, arterial_elements, model_params, settings):
                         # Connect Fi of connected segment to sum block
                         sumb[i] = -1 * arterial_elements['SS'][str(conn)][1]
                         # model.connect(arterial_elements['SS'][str(conn)][1], sumb[i])
-                        print(f"Connected segment {index} to {conn} with sum block of {n} inputs.")
+                        build_log(settings, f"Connected segment {index} to {conn} with sum block of {n} inputs.")
 
                     # Connect Fi of combined segments back into Fo of current segment
                     model.connect(sumb, arterial_elements['SS'][str(index)][1])
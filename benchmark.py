@@ -0,0 +1,291 @@
+"""
+Scaling benchmark on synthetic arterial trees
+- Network sizes from 10 to 10,000 segments generated by synthetic.py
+- Per size and engine: build time, compile time, run time per simulated second, peak memory, output size
+- Cost of one right-hand-side evaluation: bdsim block diagram, sparse A·x product and fused kernel (kernel.py)
+- Results written as 'benchmark_XXX.json' with the git commit, so runs can be compared between commits
+
+Peak memory is measured with tracemalloc (Python and NumPy allocations) so it works on every platform.
+The bdsim engine is only benchmarked up to max_bdsim_segments, its run time grows too fast beyond that.
+Small distal segments make large trees stiff (time constants well below a millisecond), so the
+state-space engine runs with an implicit solver by default; RK45 goes unstable from a few thousand segments.
+
+The decomposition benchmark times decompose.run_decomposed against the monolithic state-space run for a range
+of worker counts, with the speedup and the largest state difference relative to the peak state. Every worker
+count integrates the same subtrees, so the speedup measures the parallel scaling; it needs a multi-core machine,
+run_decomposed raises on one CPU.
+
+Usage:
+    python benchmark.py                      # default sizes and engines
+    python benchmark.py 10 100 1000          # selected sizes
+    python benchmark.py --decompose 1000 3000   # subtree decomposition speedup per worker count
+"""
+
+import contextlib
+import copy
+import io
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import bdsim
+import numpy as np
+import scipy
+
+from arterial_element import arterial_elements_from_params, connect_segments, to_subsystem
+from decompose import SUBTREE_SEGMENTS, run_decomposed
+from filer import claim_output_name
+from kernel import NetworkKernel
+from state_space import StateSpaceModel, run_state_space
+from synthetic import generate_tree
+
+SIZES = [10, 30, 100, 300, 1000, 3000, 10000]
+ENGINES = ('bdsim', 'state_space')
+RHS_CALLS = 200   # evaluations per right-hand-side timing
+BENCHMARK_DEFAULTS = {'simulation_time': 0.1, 'max_bdsim_segments': 100, 'state_space_solver': 'Radau',
+                      'branching': 2, 'seed': 0}
+DECOMPOSE_SIZES = [1000, 3000, 10000]
+DECOMPOSE_WORKERS = [1, 2, 4, 8]
+
+
+def benchmark_settings(settings, simulation_time):
+    """
+    Copy of settings for a benchmark run: no debug outputs, no saving, quiet build.
+    """
+    settings = copy.deepcopy(settings)
+    settings['debugger']['enabled'] = False
+    settings['output']['save_results'] = False
+    settings['simulation'].update({'simulation_time': simulation_time, 'quiet': True})
+    return settings
+
+
+@contextlib.contextmanager
+def phase(result, name):
+    """
+    Time a block into result[name + '_time'] (seconds).
+    """
+    t0 = time.perf_counter()
+    yield
+    result[f'{name}_time'] = time.perf_counter() - t0
+
+
+def bench_bdsim(settings, model_params):
+    """
+    Build, compile and run the block diagram, timing every phase.
+    """
+    result = {}
+    sim = bdsim.BDSim(banner=False, graphics=False, progress=False, quiet=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        with phase(result, 'build'):
+            arterial_elements = arterial_elements_from_params(sim, model_params, settings)
+            model = sim.blockdiagram(name='Arterial Network Model')
+            arterial_elements = to_subsystem(model, arterial_elements, settings)
+            connect_segments(model, arterial_elements, model_params, settings)
+        with phase(result, 'compile'):
+            model.compile(verbose=False)
+        with phase(result, 'run'):
+            out = sim.run(model, dt=settings['simulation']['time_step'],
+                          T=settings['simulation']['simulation_time'], block=False)
+    result['n_blocks'] = len(model.blocklist)
+    result['rhs_us'] = 1e6 * sim.simstate.bdtime / max(sim.simstate.count, 1)
+    return result, out
+
+
+def bench_state_space(settings, model_params, solver):
+    """
+    Build and integrate the state-space model. The sparse system is assembled in one build step, there is no
+    separate compile phase (compile_time None).
+    """
+    settings = {**settings, 'simulation': {**settings['simulation'], 'engine': 'state_space', 'solver': solver}}
+    result = {'compile_time': None, 'solver': solver}
+    with phase(result, 'build'):
+        model = StateSpaceModel(model_params, settings)
+    with phase(result, 'run'), contextlib.redirect_stdout(io.StringIO()):
+        out = run_state_space(settings, model_params, model=model)
+    result['nnz'] = int(model.A.nnz)
+    result.update(bench_rhs(model))
+    return result, out
+
+
+def bench_rhs(model):
+    """
+    Time per right-hand-side evaluation of the sparse A·x product and of the fused kernel.
+    """
+    kernel = NetworkKernel(model)
+    x = model.x0 + 1.0
+    out = np.empty(model.n_states)
+    kernel.derivative(0.1, x, out)   # compile outside the timing
+    timings = {}
+    candidates = {'rhs_sparse_us': lambda: model.rhs(0.1, x), 'rhs_fused_us': lambda: kernel.derivative(0.1, x, out)}
+    for name, rhs in candidates.items():
+        t0 = time.perf_counter()
+        for _ in range(RHS_CALLS):
+            rhs()
+        timings[name] = 1e6 * (time.perf_counter() - t0) / RHS_CALLS
+    timings['kernel'] = 'numba' if kernel.compiled else 'numpy'
+    return timings
+
+
+def bench_case(engine, n_segments, settings, options):
+    """
+    One benchmark case: generate the tree, run the engine and collect all metrics.
+    """
+    model_params = generate_tree(n_segments, branching=options['branching'], seed=options['seed'])
+    tracemalloc.start()
+    try:
+        match engine:
+            case 'bdsim':
+                result, out = bench_bdsim(settings, model_params)
+            case 'state_space':
+                result, out = bench_state_space(settings, model_params, options['state_space_solver'])
+            case _:
+                raise ValueError(f"Unknown engine: {engine}, available options: {list(ENGINES)}")
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result.update({
+        'engine': engine,
+        'n_segments': n_segments,
+        'run_time_per_simulated_second': result['run_time'] / settings['simulation']['simulation_time'],
+        'peak_memory_mb': peak / 2**20,
+        'output_size_mb': len(pickle.dumps(out, protocol=pickle.HIGHEST_PROTOCOL)) / 2**20,
+        'n_samples': len(out.t),
+        'max_abs_state': float(np.abs(out.x).max()),
+    })
+    return result
+
+
+def git_commit():
+    """
+    Current git commit of the repository, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(settings, sizes=SIZES, engines=ENGINES, output_dir='Output', **options):
+    """
+    Run all benchmark cases and write them to 'benchmark_XXX.json'.
+    Args:
+        settings (dict): Base settings, debugger and output are overridden.
+        sizes (list): Network sizes in segments.
+        engines (tuple): Engines to benchmark, 'bdsim' and/or 'state_space'.
+        output_dir (str): Directory for the JSON file.
+        **options: simulation_time, max_bdsim_segments, state_space_solver, branching and seed,
+            see BENCHMARK_DEFAULTS.
+    Returns:
+        report (dict): Environment and one result dict per case.
+        path (str): Path of the written JSON file.
+    """
+    options = {**BENCHMARK_DEFAULTS, **options}
+    settings = benchmark_settings(settings, options['simulation_time'])
+
+    cases = []
+    for n_segments in sizes:
+        for engine in engines:
+            if engine == 'bdsim' and n_segments > options['max_bdsim_segments']:
+                continue
+            result = bench_case(engine, n_segments, settings, options)
+            compile_time = '-' if result['compile_time'] is None else f"{result['compile_time']:.3f} s"
+            print(f"{engine:>11} {n_segments:>6} segments: build {result['build_time']:.3f} s, "
+                  f"compile {compile_time}, run {result['run_time_per_simulated_second']:.3f} s/s, "
+                  f"peak {result['peak_memory_mb']:.1f} MB, output {result['output_size_mb']:.2f} MB")
+            cases.append(result)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'numpy': np.__version__, 'scipy': scipy.__version__, 'bdsim': bdsim.__version__},
+        'options': options,
+        'settings': settings,
+        'cases': cases,
+    }
+    _, path = claim_output_name('benchmark', ext='.json', output_dir=output_dir)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+    print(f"Benchmark of {len(cases)} cases saved to '{path}'.")
+    return report, path
+
+
+def run_decomposition_benchmark(settings, sizes=DECOMPOSE_SIZES, workers=DECOMPOSE_WORKERS, output_dir='Output',
+                                decompose=None, **options):
+    """
+    Speedup of the subtree decomposition over the monolithic state-space run, written to 'benchmark_XXX.json'.
+    Args:
+        settings (dict): Base settings, debugger and output are overridden.
+        sizes (list): Network sizes in segments.
+        workers (list): Worker counts; the tree is split into subtrees of about SUBTREE_SEGMENTS segments, at least
+            max(workers), the same for every worker count.
+        output_dir (str): Directory for the JSON file.
+        decompose (dict, optional): Further 'decompose' settings (coupling, window, substeps, tolerance).
+        **options: simulation_time, state_space_solver, branching and seed, see BENCHMARK_DEFAULTS.
+    Returns:
+        report (dict): Environment and one result dict per (size, worker count).
+        path (str): Path of the written JSON file.
+    """
+    options = {**BENCHMARK_DEFAULTS, **options}
+    settings = benchmark_settings(settings, options['simulation_time'])
+    settings['simulation'].update({'engine': 'state_space', 'solver': options['state_space_solver']})
+
+    cases = []
+    for n_segments in sizes:
+        model_params = generate_tree(n_segments, branching=options['branching'], seed=options['seed'])
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            reference = run_state_space(settings, model_params)
+            monolithic = time.perf_counter() - t0
+        for n_workers in workers:
+            subtrees = max(max(workers), round(n_segments / SUBTREE_SEGMENTS))
+            case_settings = {**settings, 'decompose': {'subtrees': subtrees, **(decompose or {}), 'workers': n_workers}}
+            with contextlib.redirect_stdout(io.StringIO()):
+                t0 = time.perf_counter()
+                out = run_decomposed(case_settings, model_params)
+                run_time = time.perf_counter() - t0
+            result = {
+                'n_segments': n_segments,
+                'workers': n_workers,
+                'n_subtrees': out.n_subtrees,
+                'monolithic_time': monolithic,
+                'run_time': run_time,
+                'speedup': monolithic / run_time,
+                'mean_iterations': float(out.iterations.mean()),
+                'max_rel_error': float(np.abs(out.x - reference.x).max() / np.abs(reference.x).max()),
+            }
+            print(f"{n_segments:>6} segments, {n_workers:>2} workers: run {run_time:.3f} s "
+                  f"(monolithic {monolithic:.3f} s, speedup {result['speedup']:.2f}), "
+                  f"max rel. error {result['max_rel_error']:.2e}")
+            cases.append(result)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpu_count': os.cpu_count(), 'numpy': np.__version__, 'scipy': scipy.__version__},
+        'options': {**options, 'decompose': decompose},
+        'settings': settings,
+        'cases': cases,
+    }
+    _, path = claim_output_name('benchmark', ext='.json', output_dir=output_dir)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+    print(f"Decomposition benchmark of {len(cases)} cases saved to '{path}'.")
+    return report, path
+
+
+if __name__ == "__main__":
+    with open(os.path.join('Data', 'settings.json'), encoding='utf-8') as file:
+        base_settings = json.load(file)
+    if sys.argv[1:2] == ['--decompose']:
+        run_decomposition_benchmark(base_settings, sizes=[int(n) for n in sys.argv[2:]] or DECOMPOSE_SIZES)
+    else:
+        run_benchmark(base_settings, sizes=[int(n) for n in sys.argv[1:]] or SIZES)
@@ -0,0 +1,189 @@
+"""
+Content-addressed cache of simulation results
+- Key: canonical hash of settings + model_params + engine version
+- On disk: one entry per key in the cache directory, evicted least-recently-used above a size limit
+- In process: a small memo of recent outputs for repeated calls within a sweep
+- Hit/miss counters in ResultCache.stats
+
+Entries are stored in the output format of the run: a pickle, or a columnar run directory
+(see store.py) that is returned as a memory-mapped RunReader on a hit.
+
+Settings (optional 'cache' section):
+    "cache": {"enabled": true, "directory": "Output/cache", "max_size_mb": 1024, "memo_size": 16}
+"""
+
+import copy
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from collections import OrderedDict
+
+import bdsim
+
+from checkpoint import start_digest
+from inflow import file_digest
+from store import RunReader, output_format, write_run
+
+CACHE_DEFAULTS = {'enabled': False, 'directory': os.path.join('Output', 'cache'), 'max_size_mb': 1024,
+                  'memo_size': 16}
+
+# Bump when a change to the engines alters results for the same settings
+ENGINE_VERSION = 1
+
+# Settings sections that do not change the simulated result
+IGNORED_SECTIONS = ('output', 'cache')
+
+# One cache per directory, so the memo and counters persist between init_and_run calls
+_CACHES = {}
+
+
+def cache_key(settings, model_params):
+    """
+    Canonical hash of everything that determines a result, including the content of a measured inflow file
+    and of the checkpoint a run resumes or warm-starts from.
+    """
+    settings = {k: v for k, v in settings.items() if k not in IGNORED_SECTIONS}
+    path = settings['input_signal'].get('file')
+    if path is not None:
+        settings['input_signal'] = {**settings['input_signal'], 'file_digest': file_digest(path)}
+    digest = start_digest(settings, model_params)
+    if digest is not None:
+        settings['checkpoint'] = {**settings['checkpoint'], 'start_digest': digest}
+    engine = settings['simulation'].get('engine', 'bdsim')
+    version = {'engine': engine, 'engine_version': ENGINE_VERSION,
+               'bdsim': bdsim.__version__ if engine == 'bdsim' else None}
+    data = json.dumps({'settings': settings, 'model_params': model_params, 'version': version},
+                      sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def entry_size(path):
+    """
+    Size in bytes of a cache entry file or directory.
+    """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+class ResultCache():
+    """
+    Two-level (memo + disk) cache of simulation outputs
+    """
+    def __init__(self, directory, max_size_mb=1024, memo_size=16):
+        self.directory = directory
+        self.max_bytes = max_size_mb * 2**20
+        self.memo_size = memo_size
+        self.memo = OrderedDict()
+        self.stats = {'memo_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key, columnar=False):
+        return os.path.join(self.directory, key if columnar else f'{key}.pkl')
+
+    def remember(self, key, out):
+        self.memo[key] = out
+        self.memo.move_to_end(key)
+        while len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+
+    def get(self, key):
+        """
+        Cached output for key, or None on a miss.
+        """
+        if key in self.memo:
+            self.memo.move_to_end(key)
+            self.stats['memo_hits'] += 1
+            return self.memo[key]
+
+        for columnar in (False, True):
+            path = self.path(key, columnar)
+            if not os.path.exists(path):
+                continue
+            if columnar:
+                out = RunReader(path)
+            else:
+                with open(path, 'rb') as f:
+                    out = pickle.load(f)
+            os.utime(path)   # mark as recently used for the LRU eviction
+            self.stats['disk_hits'] += 1
+            self.remember(key, out)
+            return out
+
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, key, out, settings):
+        """
+        Store an output under key, as a columnar run if settings select that format, then evict.
+        """
+        columnar = output_format(out, settings) == 'columnar'
+        path = self.path(key, columnar)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        if columnar:
+            os.makedirs(tmp)
+            write_run(out, settings, tmp)
+        else:
+            with open(tmp, 'wb') as f:
+                pickle.dump(out, f)
+        try:
+            os.replace(tmp, path)   # atomic, concurrent writers of the same key leave one complete entry
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)   # directory entry already written by another process
+
+        self.remember(key, RunReader(path) if columnar else out)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least-recently-used disk entries until the cache fits in max_size_mb.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, name)
+            entries.append((os.path.getmtime(path), entry_size(path), path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            total -= size
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        """
+        Remove all entries from disk and memo.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+        self.memo.clear()
+
+    def __repr__(self):
+        return f"ResultCache: {self.directory}, {self.stats}"
+
+
+def get_cache(settings):
+    """
+    The ResultCache of settings['cache'], or None if caching is disabled.
+    """
+    options = {**CACHE_DEFAULTS, **settings.get('cache', {})}
+    if not options['enabled']:
+        return None
+    directory = options['directory']
+    if directory not in _CACHES:
+        _CACHES[directory] = ResultCache(directory, options['max_size_mb'], options['memo_size'])
+    return _CACHES[directory]
+
+
+def cache_stats():
+    """
+    Hit/miss counters of every cache used in this process, keyed by directory.
+    """
+    return {directory: copy.copy(cache.stats) for directory, cache in _CACHES.items()}
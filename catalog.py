@@ -0,0 +1,167 @@
+"""
+Run catalog of the Output directory
+- Append-only JSONL index 'Output/catalog.jsonl', one line per saved run
+- Written by saver and the columnar store, so every saved run is indexed
+- Queries on key parameters without opening any output files
+
+An entry looks like:
+    {"run_id": "simulation_output_003", "timestamp": "2025-01-31T12:00:00", "format": "pickle",
+     "settings_hash": "...", "model_params_hash": "...", "engine": "bdsim", "mode": "transient",
+     "solver": "RK45", "frequency": 0.4, "amplitude": 40, "baseline": 80, "simulation_time": 7.5,
+     "time_step": 0.008, "debug_indices": [1, 13], "probes": [], "wall_time": 24.1,
+     "paths": {"output": "Output/simulation_output_003.pkl", "settings": "Output/settings_simulation_003.pkl"}}
+
+Example: latest run with frequency 0.4 that probed segment 13
+    entry = latest_run(frequency=0.4, probed=13)
+"""
+
+import glob
+import hashlib
+import json
+import os
+import pickle
+import re
+from datetime import datetime
+
+CATALOG_NAME = 'catalog.jsonl'
+
+
+def content_hash(data):
+    """
+    Short stable hash of a JSON-serializable dict.
+    """
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def probed_signals(settings):
+    """
+    [segment, signal] of every probe in an enabled settings['probes'] section.
+    """
+    probes = settings.get('probes', {})
+    if not probes.get('enabled', False):
+        return []
+    return [[entry['segment'], entry['signal']] if isinstance(entry, dict) else list(entry)
+            for entry in probes.get('signals', [])]
+
+
+def catalog_entry(run_id, settings, paths, fmt='pickle', wall_time=None, model_params=None):
+    """
+    Catalog entry of one run with its key parameters.
+    """
+    simulation = settings['simulation']
+    debugger = settings['debugger']
+    return {
+        'run_id': run_id,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'format': fmt,
+        'settings_hash': content_hash(settings),
+        'model_params_hash': None if model_params is None else content_hash(model_params),
+        'engine': simulation.get('engine', 'bdsim'),
+        'mode': simulation.get('mode', 'transient'),
+        'solver': simulation.get('solver', 'RK45'),
+        'frequency': settings['input_signal']['frequency'],
+        'amplitude': settings['input_signal']['amplitude'],
+        'baseline': settings['input_signal']['baseline'],
+        'simulation_time': simulation['simulation_time'],
+        'time_step': simulation['time_step'],
+        'debug_indices': list(debugger['debug_for_index']) if debugger['enabled'] else [],
+        'probes': probed_signals(settings),
+        'wall_time': wall_time,
+        'paths': paths,
+    }
+
+
+def record_run(entry, output_dir='Output'):
+    """
+    Append one entry to the catalog.
+    The line is written with a single O_APPEND write, so concurrent runs do not interleave.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    line = (json.dumps(entry, default=str) + '\n').encode('utf-8')
+    fd = os.open(os.path.join(output_dir, CATALOG_NAME), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def read_catalog(output_dir='Output'):
+    """
+    All catalog entries in the order they were recorded.
+    """
+    path = os.path.join(output_dir, CATALOG_NAME)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def matches(entry, filters):
+    """
+    True if the entry has every filter value. 'probed' matches a segment in debug_indices or the probes.
+    """
+    for key, value in filters.items():
+        if key == 'probed':
+            probed = value if isinstance(value, (list, tuple, set)) else [value]
+            segments = set(entry['debug_indices']) | {segment for segment, _ in entry.get('probes', [])}
+            if not set(probed) <= segments:
+                return False
+        elif entry.get(key) != value:
+            return False
+    return True
+
+
+def query_runs(output_dir='Output', **filters):
+    """
+    Catalog entries matching all filters, oldest first.
+    Args:
+        output_dir (str): Directory holding the catalog.
+        **filters: Entry fields to match, e.g. frequency=0.4, engine='state_space', probed=13.
+    Returns:
+        entries (list): Matching entries.
+    """
+    return [entry for entry in read_catalog(output_dir) if matches(entry, filters)]
+
+
+def latest_run(output_dir='Output', **filters):
+    """
+    Most recently recorded entry matching all filters, see query_runs.
+    """
+    entries = query_runs(output_dir, **filters)
+    if not entries:
+        raise FileNotFoundError(f"No run matching {filters} in the catalog of {output_dir!r}.")
+    return entries[-1]
+
+
+def load_run(entry):
+    """
+    Load the output of a catalog entry: the unpickled output, or a RunReader for a columnar run.
+    """
+    if entry['format'] == 'columnar':
+        from store import RunReader
+        return RunReader(entry['paths']['output'])
+    with open(entry['paths']['output'], 'rb') as f:
+        return pickle.load(f)
+
+
+def rebuild_catalog(output_dir='Output'):
+    """
+    Index pickle runs saved before the catalog existed, from their settings_simulation_XXX.pkl.
+    Runs that are already in the catalog are skipped. Returns the number of added entries.
+    """
+    known = {entry['paths']['output'] for entry in read_catalog(output_dir)}
+    added = 0
+    for out_path in sorted(glob.glob(os.path.join(output_dir, 'simulation_output_*.pkl'))):
+        match = re.search(r'simulation_output_(\d+)\.pkl$', out_path)
+        settings_path = os.path.join(output_dir, f'settings_simulation_{match.group(1)}.pkl')
+        if out_path in known or not os.path.exists(settings_path):
+            continue
+        with open(settings_path, 'rb') as f:
+            settings = pickle.load(f)
+        entry = catalog_entry(os.path.splitext(os.path.basename(out_path))[0], settings,
+                              {'output': out_path, 'settings': settings_path})
+        entry['timestamp'] = datetime.fromtimestamp(os.path.getmtime(out_path)).isoformat(timespec='seconds')
+        record_run(entry, output_dir)
+        added += 1
+    print(f"Added {added} runs to the catalog of '{output_dir}'.")
+    return added
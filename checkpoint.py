@@ -0,0 +1,307 @@
+"""
+Checkpoint, resume and warm-start
+- A checkpoint holds the integrator state of a run: Fi and Po of every segment (state-space layout), the
+  time, the input-generator phase, the valve state and the settings of the run
+- Written next to the run output (checkpoint_<name>.pkl, or checkpoint.pkl in a columnar run directory)
+- Written periodically while the state-space engine integrates, to '<directory>/checkpoint_<job>.pkl',
+  so an interrupted job can be resumed; the file is removed when the job finishes
+- resume continues a run from its checkpoint time up to simulation_time, e.g. a 7.5 s run extended to 30 s
+- warm_start starts a new run at t = 0 from the final state of another run, with any other settings
+
+Both take a checkpoint file or a saved run (pickle or run directory) with its checkpoint; "resume": "auto"
+picks up the periodic checkpoint of an interrupted identical job, if there is one. A resumed output starts at
+the checkpoint time. bdsim runs are checkpointed at the end only, the state-space engine every 'interval'
+seconds of simulated time (at the end of the integration window that crosses it).
+
+Settings (optional 'checkpoint' section):
+    "checkpoint": {"enabled": true, "interval": 5.0, "directory": "Output/checkpoints",
+                   "resume": null, "warm_start": "Output/simulation_output_003.pkl"}
+"""
+
+import copy
+import hashlib
+import json
+import math
+import os
+import pickle
+import re
+
+import numpy as np
+
+from inflow import file_digest
+
+CHECKPOINT_DEFAULTS = {'enabled': False, 'interval': None, 'directory': os.path.join('Output', 'checkpoints'),
+                       'resume': None, 'warm_start': None}
+
+# Settings sections that do not identify a job for "resume": "auto"
+JOB_IGNORED = ('output', 'cache', 'model_cache', 'profile', 'checkpoint')
+
+
+def checkpoint_options(settings):
+    return {**CHECKPOINT_DEFAULTS, **settings.get('checkpoint', {})}
+
+
+def job_key(settings, model):
+    """
+    Hash of the settings and compiled network of a run, names its periodic checkpoint.
+    """
+    run = {k: v for k, v in settings.items() if k not in JOB_IGNORED}
+    key = hashlib.sha1(json.dumps(run, sort_keys=True, default=str).encode())
+    for array in (model.parent, model.rs, model.l, model.c, model.g):
+        key.update(np.ascontiguousarray(array, dtype=float).tobytes())
+    return key.hexdigest()
+
+
+def job_path(settings, model):
+    return os.path.join(checkpoint_options(settings)['directory'], f'checkpoint_{job_key(settings, model)[:16]}.pkl')
+
+
+def checkpoint_path(run_path=None, directory='Output'):
+    """
+    Path of the checkpoint next to a saved run, or a new 'checkpoint_XXX.pkl' in directory for an unsaved run.
+    """
+    if run_path is None:
+        from filer import claim_output_name
+        return claim_output_name('checkpoint', ext='.pkl', output_dir=directory)[1]
+    if os.path.isdir(run_path):
+        return os.path.join(run_path, 'checkpoint.pkl')
+    folder, name = os.path.split(run_path)
+    return os.path.join(folder, f'checkpoint_{os.path.splitext(name)[0]}.pkl')
+
+
+def make_checkpoint(settings, model, t, x):
+    """
+    Checkpoint of a state-space state x at time t.
+    """
+    frequency = settings['input_signal']['frequency']
+    return {
+        't': float(t),
+        'x': np.array(x, dtype=float),
+        'index': list(model.index),
+        'phase': (t * frequency) % 1.0,   # input-generator phase, fraction of a period
+        'frequency': frequency,
+        'valve_open': bool(x[model.valve] > 0.0),
+        'job': job_key(settings, model),
+        'settings': copy.deepcopy(settings),
+    }
+
+
+def save_checkpoint(checkpoint, path):
+    """
+    Write a checkpoint atomically, so an interruption never leaves a truncated file.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(checkpoint, f)
+    os.replace(path + '.tmp', path)
+
+
+def checkpoint_file(path):
+    """
+    Path of a checkpoint file ('checkpoint*.pkl'), or of the checkpoint of a saved run (pickle or run directory).
+    """
+    name = os.path.basename(os.path.normpath(path))
+    if os.path.isdir(path) or not (name.startswith('checkpoint') and name.endswith('.pkl')):
+        return checkpoint_path(path)
+    return path
+
+
+def load_checkpoint(path):
+    """
+    Load a checkpoint file ('checkpoint*.pkl'), or the checkpoint of a saved run (pickle or run directory).
+    """
+    path = checkpoint_file(path)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No checkpoint found at '{path}'.")
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def start_state(settings, model):
+    """
+    Start time and state of a run: t = 0 and the initial conditions, or the checkpoint of
+    settings['checkpoint']['resume'] or ['warm_start'].
+    Returns:
+        t0 (float): Start time, the checkpoint time when resuming.
+        x0 (np.ndarray): State at t0 in the state-space layout.
+    """
+    options = checkpoint_options(settings)
+    source = options['resume'] or options['warm_start']
+    if source is None:
+        return 0.0, model.x0
+    if source == 'auto':
+        source = job_path(settings, model)
+        if not os.path.exists(source):
+            return 0.0, model.x0
+
+    checkpoint = load_checkpoint(source)
+    if checkpoint['index'] != list(model.index):
+        raise ValueError(f"Checkpoint '{source}' has segments {checkpoint['index']}, "
+                         f"the model {list(model.index)}.")
+    if not options['resume']:
+        print(f"Warm start from the state at t = {checkpoint['t']:g} s of '{source}'.")
+        return 0.0, checkpoint['x']
+
+    T = settings['simulation']['simulation_time']
+    if T is not None and checkpoint['t'] >= T:
+        raise ValueError(f"Checkpoint '{source}' at t = {checkpoint['t']:g} s is not before "
+                         f"simulation_time {T:g} s.")
+    print(f"Resuming from the checkpoint at t = {checkpoint['t']:g} s of '{source}'.")
+    return checkpoint['t'], checkpoint['x']
+
+
+def start_digest(settings, model_params):
+    """
+    Content hash of the checkpoint a run resumes or warm-starts from, for the result cache key.
+    None for runs from t = 0; 'fresh' for "resume": "auto" without a job checkpoint, 'missing' for a source
+    that does not exist (the run itself raises).
+    """
+    options = checkpoint_options(settings)
+    source = options['resume'] or options['warm_start']
+    if source is None:
+        return None
+    if source == 'auto':
+        from state_space import StateSpaceModel
+        source = job_path(settings, StateSpaceModel(model_params, settings))
+        if not os.path.exists(source):
+            return 'fresh'
+    path = checkpoint_file(source)
+    return file_digest(path) if os.path.exists(path) else 'missing'
+
+
+class CheckpointWriter():
+    """
+    Tracks the last state of a windowed run and writes the job checkpoint every interval seconds
+    """
+    def __init__(self, settings, model):
+        self.settings = settings
+        self.model = model
+        self.interval = checkpoint_options(settings)['interval']
+        self.path = job_path(settings, model)
+        self.t, self.x = None, None
+        self.next = None
+
+    def record(self, t, states):
+        """
+        Note the end of a chunk of output steps, states of shape (len(t), n_states).
+        """
+        self.t, self.x = t[-1], states[-1]
+        if self.interval is None:
+            return
+        if self.next is None:
+            self.next = (math.floor(t[0] / self.interval) + 1) * self.interval
+        if self.t >= self.next - 1e-12:
+            save_checkpoint(make_checkpoint(self.settings, self.model, self.t, self.x), self.path)
+            self.next = (math.floor(self.t / self.interval + 1e-9) + 1) * self.interval
+
+    def checkpoint(self):
+        """
+        Checkpoint of the last recorded state, or None before the first chunk.
+        """
+        return None if self.t is None else make_checkpoint(self.settings, self.model, self.t, self.x)
+
+
+def checkpoint_interval(settings):
+    """
+    Seconds of simulated time between periodic checkpoints, or None.
+    """
+    options = checkpoint_options(settings)
+    return options['interval'] if options['enabled'] else None
+
+
+def checkpoint_writer(settings, model):
+    """
+    CheckpointWriter of an enabled 'checkpoint' section, or None.
+    """
+    return CheckpointWriter(settings, model) if checkpoint_options(settings)['enabled'] else None
+
+
+def final_checkpoint(out, settings, model_params, model=None):
+    """
+    Checkpoint of the last state of a finished run with states (bdsim or state-space layout), or None
+    if checkpoints are disabled. Windowed runs keep the checkpoint of their writer as out.checkpoint.
+    """
+    if not checkpoint_options(settings)['enabled']:
+        return None
+    if getattr(out, 'checkpoint', None) is not None or getattr(out, 'x', None) is None:
+        return getattr(out, 'checkpoint', None)
+    from metrics import output_states
+    from state_space import StateSpaceModel
+    if model is None:
+        model = StateSpaceModel(model_params, settings)
+    return make_checkpoint(settings, model, out.t[-1], np.asarray(output_states(out, model)[-1]))
+
+
+def store_checkpoint(out, settings, run_path=None):
+    """
+    Write the final checkpoint of a finished run next to its output and remove the periodic checkpoint
+    of the job.
+    Returns the checkpoint path, or None if the run has no checkpoint.
+    """
+    checkpoint = getattr(out, 'checkpoint', None)
+    if checkpoint is None:
+        return None
+    directory = checkpoint_options(settings)['directory']
+    path = checkpoint_path(run_path, directory)
+    save_checkpoint(checkpoint, path)
+    job = os.path.join(directory, f"checkpoint_{checkpoint['job'][:16]}.pkl")
+    if os.path.exists(job):
+        os.remove(job)
+    print(f"Checkpoint at t = {checkpoint['t']:g} s saved to '{path}'.")
+    return path
+
+
+def run_checkpointed(settings, model_params, model=None):
+    """
+    State-space run integrated window by window with periodic checkpoints, for runs with an interval.
+    Returns:
+        out (StateSpaceOutput): Output with the same layout as run_state_space, and its final checkpoint.
+    """
+    from state_space import StateSpaceModel, build_output, integrate_windows
+    from store import chunk_size
+    if model is None:
+        model = StateSpaceModel(model_params, settings)
+    checkpoints = CheckpointWriter(settings, model)
+    t, states = [], []
+    for chunk_t, chunk_x in integrate_windows(settings, model, chunk_size(settings)):
+        checkpoints.record(chunk_t, chunk_x)
+        t.append(chunk_t)
+        states.append(chunk_x)
+
+    out = build_output(model, np.concatenate(t), np.concatenate(states).T)
+    out.checkpoint = checkpoints.checkpoint()
+    print(f"State-space simulation of {model.n} segments finished: {out.t.size} time steps, "
+          f"checkpoint every {checkpoints.interval:g} s.")
+    return out
+
+
+def bdsim_start(diagram, generator, settings, model_params):
+    """
+    Set the integrator states and the generator phase of a compiled diagram for the start of a run.
+    bdsim always integrates from t = 0, so a resumed run starts in the phase of the checkpoint and its
+    output times are shifted by t0 afterwards.
+    Returns:
+        t0 (float): Start time of the run.
+    """
+    options = checkpoint_options(settings)
+    t0, x0, model = 0.0, None, None
+    if options['resume'] or options['warm_start']:
+        from state_space import StateSpaceModel
+        model = StateSpaceModel(model_params, settings)
+        t0, x0 = start_state(settings, model)
+
+    # The bdsim states are ∫ of the flow and pressure equations, i.e. L·Fi and C·Po
+    ic = settings['initial_conditions']
+    pattern = re.compile(r'subsystem\.(\d+)/(Fi|Po)$')
+    for block in diagram.blocklist:
+        match = pattern.search(block.name or '')
+        if match is None:
+            continue
+        k = int(match.group(1))
+        if match.group(2) == 'Fi':
+            value = ic['int_fi'] if x0 is None else x0[k] * model.l[k]
+        else:
+            value = ic['int_po'] if x0 is None else x0[model.n + k] * model.c[k]
+        block._x0 = np.r_[value]
+    generator.phase = -((t0 * settings['input_signal']['frequency']) % 1.0)
+    return t0
@@ -0,0 +1,427 @@
+"""
+Parallel subtree decomposition of the state-space network
+- Partitions the Connections tree into subtrees, cut at branch points (the Sum junctions of connect_segments)
+- Every subtree is advanced by its own worker process over a window of output steps, in one run of the exact
+  first-order-hold discretization of discrete.py on a coupling grid of 'substeps' points per output step
+- Subtrees exchange the pressure and flow at their junctions: the Po of the segment upstream of a cut (Pi of the
+  subtree root) and the Fi of the subtree root (part of Fo of the junction segment)
+- The junction waveforms of a window are solved for all subtrees at once (Junctions), so the subtrees need no
+  iterations between them unless the aortic valve switches within the window
+
+A subtree with states x_s follows dx_s/dt = A_ss·clip(x_s) + A_so·x_o(t) + B_s·u(t): A_ss and A_so are the
+rows of the full A for its states, A_so has a nonzero per junction and x_o(t) is the other subtrees' junction
+states, linear between coupling points. With the valve state held, the junction states a subtree computes over
+a window are linear in its start state, the input pressure and its imported junction states, so the junction
+waveforms of the whole network solve one small linear system per window. Then
+- "relaxation" integrates the subtrees with these waveforms and, where the valve switched within the window,
+  repeats with Newton corrections until the junction states change less than 'tolerance' (1.1 to 1.7 passes
+  per window on average on trees of 28 to 10,000 segments)
+- "fixed" integrates every window once and cuts it short at a valve switch, so the junction waveforms only miss
+  in the coupling interval of the switch; the runner warns when that mismatch exceeds 'tolerance' (about 1e-4
+  relative on a 1000-segment tree, so at the default tolerance it warns)
+Both match the monolithic exact discretization on the coupling grid up to the linear junction interpolation,
+second order in time_step / substeps: at the default 8, up to 2e-4 of the peak state on the default network and
+5e-4 on a 1000-segment tree (1.4e-3 with 4 substeps).
+
+The subtrees step with dense matrices, O(states^2) per coupling interval and O(states^3) once, so by default the
+tree is cut into subtrees of about SUBTREE_SEGMENTS segments (at least one per worker). Decomposition adds work:
+integrated one after another, the subtrees of a 1 s simulation take 2.4 s against 1.2 s for the monolithic
+Radau run on 1000 segments, and 22 s against 6.4 s on 10,000 segments (40 subtrees), so it needs several
+workers to pay off, and run_decomposed raises a ValueError when os.cpu_count() is 1. The parallel speedup is
+unverified: benchmark.run_decomposition_benchmark has not been run on a multi-core machine.
+
+Subtree roots are chosen bottom-up: a segment below a branch point is cut off as soon as its uncut subtree
+holds n / subtrees segments, or at the indices listed in 'cuts' (e.g. [8, 20, 22] for the leg, carotid and arm).
+The subtrees are spread over the workers largest first.
+
+Settings (optional 'decompose' section; "enabled" selects it for state-space runs of main.init_and_run):
+    "decompose": {"enabled": true, "workers": 4, "subtrees": null, "cuts": null, "coupling": "relaxation", "window": 4,
+                  "substeps": 8, "tolerance": 1e-6, "max_iterations": 50}
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.linalg import lu_factor, lu_solve
+
+from checkpoint import start_state
+from discrete import DiscreteModel
+from state_space import StateSpaceModel, build_output, input_pressure, time_grid
+
+DECOMPOSE_DEFAULTS = {'enabled': False, 'workers': os.cpu_count(), 'subtrees': None, 'cuts': None,
+                      'coupling': 'relaxation', 'window': 4, 'substeps': 8, 'tolerance': 1e-6, 'max_iterations': 50}
+COUPLINGS = ('relaxation', 'fixed')
+SUBTREE_SEGMENTS = 250   # default subtree size: the dense discretization costs O(states^3) once, O(states^2) per step
+
+# Per-worker state, filled by _init_worker and _run_subtrees
+_MODEL = None
+_PARTS = None
+_H = None
+_SUBTREES = {}
+
+
+def decompose_options(settings):
+    """
+    Options of an enabled settings['decompose'] section, or None.
+    """
+    options = {**DECOMPOSE_DEFAULTS, **settings.get('decompose', {})}
+    return options if options['enabled'] else None
+
+
+def partition(model, n_parts=None, cuts=None):
+    """
+    Split the network into subtrees at branch points.
+    Args:
+        model (StateSpaceModel): Compiled model.
+        n_parts (int, optional): Target number of subtrees, used when cuts is not given.
+        cuts (list, optional): Segment indices at which subtrees start.
+    Returns:
+        parts (list): Segment positions of every subtree, the one holding segment 1 first.
+    """
+    children = [[] for _ in range(model.n)]
+    for k in np.flatnonzero(model.parent >= 0):
+        children[model.parent[k]].append(k)
+    if cuts is not None:
+        for index in cuts:
+            if index not in model.position or model.position[index] == model.root:
+                raise ValueError(f"Cannot cut at segment {index}, it must be a non-inflow segment of the network.")
+        is_root = np.zeros(model.n, dtype=bool)
+        is_root[[model.position[index] for index in cuts]] = True
+    else:
+        target = model.n / max(n_parts or 1, 1)
+        # Post-order over the tree: cut a child of a branch point once its uncut subtree is large enough
+        order, stack = [], [model.root]
+        while stack:
+            k = stack.pop()
+            order.append(k)
+            stack.extend(children[k])
+        size = np.ones(model.n)
+        is_root = np.zeros(model.n, dtype=bool)
+        for k in reversed(order):
+            size[k] += sum(size[j] for j in children[k] if not is_root[j])
+            p = model.parent[k]
+            if p >= 0 and len(children[p]) > 1 and size[k] >= target:
+                is_root[k] = True
+    is_root[model.root] = True
+
+    # Assign every segment to the subtree of its nearest cut ancestor
+    owner = np.full(model.n, -1, dtype=int)
+    stack = [model.root]
+    while stack:
+        k = stack.pop()
+        owner[k] = k if is_root[k] else owner[model.parent[k]]
+        stack.extend(children[k])
+    roots = [model.root] + [k for k in np.flatnonzero(is_root) if k != model.root]
+    return [np.flatnonzero(owner == r) for r in roots]
+
+
+class Subtree():
+    """
+    Rows of the network for the states of one subtree, with its junction inputs, stepped exactly by discrete.py
+    """
+    def __init__(self, model, segments, h):
+        """
+        Args:
+            model (StateSpaceModel): Compiled model.
+            segments (np.ndarray): Segment positions of the subtree.
+            h (float): Coupling interval, the step of the exact discretization.
+        """
+        self.segments = np.sort(segments)
+        self.states = np.concatenate([self.segments, model.n + self.segments])
+        self.n_states = self.states.size
+        A = model.A.tocsr()[self.states]
+        inside = np.zeros(model.n_states, dtype=bool)
+        inside[self.states] = True
+        coupling = A[:, ~inside].tocsc()
+        used = np.flatnonzero(np.diff(coupling.indptr))
+        self.A = A[:, self.states].tocsr()
+        self.imports = np.flatnonzero(~inside)[used]   # global states of other subtrees this one reads
+        # Inputs [u, imports]: the driving pressure and the junction states, both linear over a coupling interval
+        self.B = np.column_stack([model.B[self.states], coupling[:, used].toarray()])
+        self.settings = model.settings
+        self.h = h
+        local = np.flatnonzero(self.states == model.valve)
+        self.valve = int(local[0]) if local.size else None
+        self._discrete = None
+
+    @property
+    def discrete(self):
+        """
+        DiscreteModel of the subtree, built on first use so only the process stepping it pays for expm.
+        """
+        if self._discrete is None:
+            self._discrete = DiscreteModel(self, self.h, 'foh')
+        return self._discrete
+
+    def integrate(self, t, x0, imports):
+        """
+        States of the subtree on the coupling grid t, driven by the junction states imports of shape
+        (len(t), len(self.imports)): one run of the exact discretization over the whole window.
+        """
+        return self.discrete.run(x0, np.column_stack([input_pressure(t, self.settings), imports]))
+
+    def responses(self, rows, W, is_open):
+        """
+        Linear response of the states rows over W coupling intervals with the valve state held:
+        x[k] = Φ^k·x0 + Σ_{i<k} Φ^(k-1-i)·((G0 - G1)·w[i] + G1·w[i+1]), w = [u, imports].
+        Returns:
+            P (np.ndarray): Response to the start state, shape (W, len(rows), n_states).
+            L (np.ndarray): Response to the inputs w[0..W], shape (W, len(rows), W + 1, 1 + len(imports)).
+        """
+        Phi, G0, G1 = self.discrete.matrices[is_open or self.valve is None]
+        P = np.empty((W + 1, rows.size, self.n_states))
+        P[0] = np.eye(self.n_states)[rows]
+        for d in range(W):
+            P[d + 1] = P[d] @ Phi
+        Ma, Mb = P[:W] @ (G0 - G1), P[:W] @ G1
+        L = np.zeros((W, rows.size, W + 1, G0.shape[1]))
+        for k in range(1, W + 1):
+            L[k - 1, :, :k] += Ma[k - 1::-1].transpose(1, 0, 2)
+            L[k - 1, :, 1:k + 1] += Mb[k - 1::-1].transpose(1, 0, 2)
+        return P[1:], L
+
+
+def _init_worker(settings, model_params, parts, h):
+    """
+    Compile the model once per worker process; its subtrees are built on first use.
+    """
+    global _MODEL, _PARTS, _H
+    _MODEL = StateSpaceModel(model_params, settings)
+    _PARTS, _H = parts, h
+    _SUBTREES.clear()
+
+
+def _call_subtrees(ids, method, args):
+    """
+    Call a Subtree method for a group of subtrees in a worker.
+    """
+    for i in ids:
+        if i not in _SUBTREES:
+            _SUBTREES[i] = Subtree(_MODEL, _PARTS[i], _H)
+    return [getattr(_SUBTREES[i], method)(*a) for i, a in zip(ids, args)]
+
+
+def call_subtrees(subtrees, groups, pool, method, args):
+    """
+    Call a Subtree method with args[i] for every subtree i, in the worker processes if pool is given.
+    Returns:
+        results (list): Results in subtree order.
+    """
+    results = [None] * len(subtrees)
+    if pool is None:
+        for group in groups:
+            for i in group:
+                results[i] = getattr(subtrees[i], method)(*args[i])
+        return results
+    futures = [pool.submit(_call_subtrees, group, method, [args[i] for i in group]) for group in groups]
+    for group, future in zip(groups, futures):
+        for i, result in zip(group, future.result()):
+            results[i] = result
+    return results
+
+
+class Junctions():
+    """
+    Coupling of the subtrees through their junction states, solved for a whole window at once.
+    Over W coupling intervals the junction states a subtree exports are a linear function of its start state,
+    the input pressure and the junction states it imports (discrete.py step with the valve state held), so the
+    junction waveforms y of the whole network solve one small system (I - T)·y = f with J·W unknowns.
+    """
+    def __init__(self, subtrees, groups, pool=None):
+        self.subtrees, self.groups, self.pool = subtrees, groups, pool
+        self.states = np.unique(np.concatenate([s.imports for s in subtrees]))   # global junction states
+        self.exports = [np.flatnonzero(np.isin(s.states, self.states)) for s in subtrees]   # local rows
+        self.export_pos = [np.searchsorted(self.states, s.states[rows]) for s, rows in zip(subtrees, self.exports)]
+        self.import_pos = [np.searchsorted(self.states, s.imports) for s in subtrees]
+        self.operators = {}
+
+    def operator(self, W, is_open):
+        """
+        Export responses of every subtree and the factorized I - T, cached per window length and valve state.
+        """
+        key = (W, is_open)
+        if key not in self.operators:
+            J = self.states.size
+            responses = call_subtrees(self.subtrees, self.groups, self.pool, 'responses',
+                                      [(rows, W, is_open) for rows in self.exports])
+            T = np.zeros((W, J, W, J))
+            for (_, L), export_pos, import_pos in zip(responses, self.export_pos, self.import_pos):
+                for p, row in enumerate(export_pos):
+                    for q, col in enumerate(import_pos):
+                        T[:, row, :, col] += L[:, p, 1:, 1 + q]
+            self.operators[key] = responses, lu_factor(np.eye(W * J) - T.reshape(W * J, W * J))
+        return self.operators[key]
+
+    def predict(self, t, x0, is_open):
+        """
+        Junction waveforms of shape (len(t), J) solving the coupling over the window t from the full state x0.
+        """
+        W, y0 = len(t) - 1, x0[self.states]
+        u = input_pressure(t, self.subtrees[0].settings)
+        responses, lu = self.operator(W, is_open)
+        f = np.zeros((W, self.states.size))
+        for s, export_pos, import_pos, (P, L) in zip(self.subtrees, self.export_pos, self.import_pos, responses):
+            f[:, export_pos] += P @ x0[s.states] + L[:, :, :, 0] @ u + L[:, :, 0, 1:] @ y0[import_pos]
+        return np.vstack([y0, lu_solve(lu, f.ravel()).reshape(W, -1)])
+
+    def correct(self, y, computed, is_open):
+        """
+        Newton update of the junction waveforms y from the junction states computed with them.
+        """
+        W = len(y) - 1
+        _, lu = self.operator(W, is_open)
+        y = y.copy()
+        y[1:] += lu_solve(lu, (computed[1:] - y[1:]).ravel()).reshape(W, -1)
+        return y
+
+
+def relax(junctions, t, x0, is_open, max_iterations, tolerance):
+    """
+    Coupled integration of all subtrees over one window: junction waveforms predicted by Junctions, then
+    corrected by Newton iterations while the junction states the subtrees compute differ from them, which
+    happens when the aortic valve switches within the window.
+    Args:
+        junctions (Junctions): Coupling of the subtrees.
+        t (np.ndarray): Coupling times of the window.
+        x0 (np.ndarray): Full state at t[0].
+        is_open (bool): Aortic valve state at t[0], selecting the linear response of the root subtree.
+    Returns:
+        x_w (np.ndarray): States at t of the last iteration.
+        iteration (int): Iterations taken.
+        mismatch (np.ndarray): Largest difference between the junction states used and computed in the last
+            iteration at every coupling time, relative to their magnitude.
+        diverged (bool): True if the junction differences grew.
+    """
+    subtrees = junctions.subtrees
+    if not junctions.states.size:
+        x_w = np.empty((len(t), x0.size))
+        for s, xs in zip(subtrees, call_subtrees(subtrees, junctions.groups, junctions.pool, 'integrate',
+                                                 [(t, x0[s.states], np.empty((len(t), 0))) for s in subtrees])):
+            x_w[:, s.states] = xs
+        return x_w, 1, np.zeros(len(t)), False
+
+    y = junctions.predict(t, x0, is_open)
+    errors = []
+    for iteration in range(1, max_iterations + 1):
+        args = [(t, x0[s.states], y[:, pos]) for s, pos in zip(subtrees, junctions.import_pos)]
+        x_w = np.empty((len(t), x0.size))
+        for s, xs in zip(subtrees, call_subtrees(subtrees, junctions.groups, junctions.pool, 'integrate', args)):
+            x_w[:, s.states] = xs
+        computed = x_w[:, junctions.states]
+        scale = np.maximum(np.abs(computed).max(axis=0), 1.0)
+        mismatch = (np.abs(computed - y) / scale).max(axis=1)
+        errors.append(float(mismatch.max()))
+        if errors[-1] < tolerance or iteration == max_iterations:
+            break
+        if not np.isfinite(errors[-1]) or (iteration > 2 and errors[-1] > 10.0 * errors[0]):
+            return x_w, iteration, mismatch, True
+        y = junctions.correct(y, computed, is_open)
+    return x_w, iteration, mismatch, False
+
+
+def assign(parts, workers):
+    """
+    Groups of subtree ids per worker, largest subtrees first onto the least loaded worker.
+    """
+    groups, load = [[] for _ in range(workers)], np.zeros(workers)
+    for i in sorted(range(len(parts)), key=lambda i: -len(parts[i])):
+        w = int(np.argmin(load))
+        groups[w].append(i)
+        load[w] += len(parts[i])
+    return [group for group in groups if group]
+
+
+def run_decomposed(settings, model_params, model=None):
+    """
+    Integrate the network as coupled subtrees in parallel worker processes.
+    Every subtree is advanced over a window by the exact first-order-hold discretization of discrete.py, one
+    matrix-vector product per coupling interval; settings['simulation']['solver'] is not used. With one worker
+    the subtrees are integrated in this process, which is slower than the monolithic run and meant for testing.
+    Args:
+        settings (dict): Simulation settings with an optional 'decompose' section.
+        model_params (dict): Model parameters.
+        model (StateSpaceModel, optional): Previously compiled model to reuse.
+    Returns:
+        out (StateSpaceOutput): Output with the same layout as run_state_space, plus iterations (per window),
+            coupling_error (largest difference between the junction states used and computed per window),
+            n_subtrees and window (the final window length in output steps, halved from the setting whenever the
+            Newton corrections diverged).
+    """
+    options = {**DECOMPOSE_DEFAULTS, **settings.get('decompose', {})}
+    if options['coupling'] not in COUPLINGS:
+        raise ValueError(f"Unknown coupling: {options['coupling']}, available options: {list(COUPLINGS)}")
+    if (os.cpu_count() or 1) < 2:
+        # The subtrees would run one after another, which only adds work to the monolithic run
+        raise ValueError("Decomposition needs more than one CPU, os.cpu_count() is 1: disable 'decompose'.")
+    if model is None:
+        model = StateSpaceModel(model_params, settings)
+
+    workers = max(int(options['workers'] or 1), 1)
+    substeps = max(int(options['substeps']), 1)
+    h = settings['simulation']['time_step'] / substeps
+    parts = partition(model, options['subtrees'] or max(workers, round(model.n / SUBTREE_SEGMENTS)), options['cuts'])
+    subtrees = [Subtree(model, segments, h) for segments in parts]
+    groups = assign(parts, workers)
+    max_iterations = 1 if options['coupling'] == 'fixed' else options['max_iterations']
+
+    t0, x0 = start_state(settings, model)
+    t = time_grid(settings, t0)
+    x = np.empty((t.size, model.n_states))
+    x[0] = x0
+    iterations, errors = [], []
+    n_fine = (t.size - 1) * substeps
+    window = max(int(options['window'] * substeps), 1)   # in coupling intervals
+
+    pool = None
+    if len(groups) > 1:
+        pool = ProcessPoolExecutor(max_workers=len(groups), initializer=_init_worker,
+                                   initargs=(settings, model_params, parts, h))
+    junctions = Junctions(subtrees, groups, pool)
+    wall = time.perf_counter()
+    try:
+        k, x_k = 0, x0
+        while k < n_fine:
+            stop = min(k + window, n_fine)
+            t_w = t[0] + np.arange(k, stop + 1) * h
+            is_open = bool(x_k[model.valve] > 0.0)
+            x_w, iteration, mismatch, diverged = relax(junctions, t_w, x_k, is_open, max_iterations,
+                                                       options['tolerance'])
+            if diverged and window > 1:
+                window //= 2   # a valve switch far from the window start can defeat the Newton correction
+                continue
+            if options['coupling'] == 'fixed':
+                # The junction waveforms hold up to the coupling interval in which the valve switched
+                switched = np.flatnonzero((x_w[1:, model.valve] > 0.0) != is_open)
+                if switched.size:
+                    stop = k + switched[0] + 1
+                    x_w, mismatch = x_w[:stop - k + 1], mismatch[:stop - k + 1]
+            error = float(mismatch.max())
+            rows = np.arange(k + 1, stop + 1)
+            on_grid = rows % substeps == 0
+            x[rows[on_grid] // substeps] = x_w[1:][on_grid]
+            iterations.append(iteration)
+            errors.append(error)
+            x_k, k = x_w[-1], stop
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    wall = time.perf_counter() - wall
+
+    if max(errors, default=0.0) >= options['tolerance']:
+        if options['coupling'] == 'fixed':
+            print(f"Warning: fixed coupling exceeds tolerance {options['tolerance']}: at valve switches the junction "
+                  f"states differ from the solved waveforms by up to {max(errors):.3g}, raise 'substeps' or use "
+                  f"relaxation.")
+        else:
+            print(f"Warning: relaxation did not reach tolerance {options['tolerance']} in "
+                  f"{options['max_iterations']} iterations (largest junction difference {max(errors):.3g}).")
+    print(f"Decomposed simulation of {model.n} segments in {len(parts)} subtrees on {len(groups)} workers finished: "
+          f"{t.size} time steps, {sum(iterations)} window iterations, {wall:.2f} s.")
+    out = build_output(model, t, x.T)
+    out.iterations = np.asarray(iterations)
+    out.coupling_error = np.asarray(errors)
+    out.n_subtrees = len(parts)
+    out.window = window / substeps
+    return out
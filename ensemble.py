@@ -0,0 +1,234 @@
+"""
+Monte Carlo uncertainty ensembles on the state-space engine
+- Draws M samples of rs/l/c/rp of every segment, independently per segment, from a lognormal (default) or
+  uniform distribution with a given coefficient of variation per parameter
+- Integrates the samples as a batched (chunk_size, n_states) state array, one chunk at a time
+- Running mean/variance (Welford, merged per chunk) and histogram quantiles of Po and Fi per segment and time
+  point; individual trajectories are never kept, memory is bounded by chunk_size and bins
+- The result is a set of envelope arrays and a db that plot_all_segments draws as bands
+
+Quantiles come from a fixed-bin histogram per (time point, segment), its range set from the first chunk with a
+margin. Samples outside that range fall into two overflow bins that are interpolated towards the exact running
+minimum and maximum, so extreme quantiles of later chunks stay within the observed range.
+
+Settings (optional 'ensemble' section):
+    "ensemble": {"samples": 1000, "chunk_size": 100, "seed": 0, "distribution": "lognormal",
+                 "cv": {"rs": 0.1, "l": 0.1, "c": 0.2, "rp": 0.1},
+                 "quantiles": [0.05, 0.25, 0.5, 0.75, 0.95], "bins": 100}
+"""
+
+import numpy as np
+from scipy.integrate import solve_ivp
+
+from inflow import batch_signal
+from state_space import StateSpaceModel, time_grid
+from sweep import PARAM_KEYS
+
+ENSEMBLE_DEFAULTS = {'samples': 1000, 'chunk_size': 100, 'seed': 0, 'distribution': 'lognormal',
+                     'cv': {'rs': 0.1, 'l': 0.1, 'c': 0.2, 'rp': 0.1},
+                     'quantiles': [0.05, 0.25, 0.5, 0.75, 0.95], 'bins': 100}
+DISTRIBUTIONS = ('lognormal', 'uniform')
+ENSEMBLE_SIGNALS = ('Po', 'Fi')
+
+
+def ensemble_options(settings):
+    """
+    settings['ensemble'] completed with ENSEMBLE_DEFAULTS.
+    """
+    options = {**ENSEMBLE_DEFAULTS, **settings.get('ensemble', {})}
+    options['cv'] = {**ENSEMBLE_DEFAULTS['cv'], **options['cv']}
+    if options['distribution'] not in DISTRIBUTIONS:
+        raise ValueError(f"Unknown ensemble distribution: {options['distribution']}, "
+                         f"available options: {list(DISTRIBUTIONS)}")
+    for key in options['cv']:
+        if key not in PARAM_KEYS:
+            raise ValueError(f"Unknown ensemble parameter: {key}, available options: {list(PARAM_KEYS)}")
+    return options
+
+
+def sample_factors(rng, shape, cv, distribution):
+    """
+    Multiplicative factors with mean 1 and coefficient of variation cv.
+    """
+    if cv == 0.0:
+        return np.ones(shape)
+    if distribution == 'lognormal':
+        sigma2 = np.log1p(cv ** 2)
+        return rng.lognormal(-0.5 * sigma2, np.sqrt(sigma2), shape)
+    half_width = np.sqrt(3.0) * cv   # uniform on [1 - w, 1 + w] has standard deviation w/√3
+    if half_width >= 1.0:
+        raise ValueError(f"Uniform factors with cv {cv} would give non-positive parameters.")
+    return rng.uniform(1.0 - half_width, 1.0 + half_width, shape)
+
+
+class StreamingStatistics():
+    """
+    Running mean, variance, extremes and histogram quantiles of samples of shape (n_t, n_columns)
+    """
+    def __init__(self, shape, bins):
+        self.shape = shape
+        self.bins = bins
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+        self.low = self.width = None
+        self.counts = np.zeros((int(np.prod(shape)), bins + 2), dtype=np.int64)   # underflow, bins, overflow
+
+    def update(self, values):
+        """
+        Add a chunk of samples of shape (m, *shape).
+        """
+        m = values.shape[0]
+        mean, m2 = values.mean(axis=0), values.var(axis=0) * m
+        # Chan et al. merge of two (count, mean, M2) summaries
+        delta, total = mean - self.mean, self.count + m
+        self.mean = self.mean + delta * m / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * m / total
+        self.count = total
+        self.min = np.minimum(self.min, values.min(axis=0))
+        self.max = np.maximum(self.max, values.max(axis=0))
+
+        if self.low is None:
+            span = np.maximum(self.max - self.min, 1e-12 * np.maximum(np.abs(self.max), 1.0))
+            self.low = self.min - 0.25 * span
+            self.width = 1.5 * span / self.bins
+        b = np.floor((values - self.low) / self.width).astype(np.int64)
+        b = np.clip(b, -1, self.bins) + 1
+        cell = np.arange(self.counts.shape[0]).reshape(self.shape)
+        flat = (cell * (self.bins + 2) + b).ravel()
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def variance(self):
+        return self.m2 / max(self.count - 1, 1)
+
+    def quantiles(self, qs):
+        """
+        Quantiles from the histogram, shape (len(qs), *shape).
+        """
+        n_cells = self.counts.shape[0]
+        low, width = self.low.ravel(), self.width.ravel()
+        # Bin edges per cell, the overflow bins extend to the running extremes
+        edges = low[:, None] + width[:, None] * np.arange(self.bins + 1)
+        lower = np.minimum(self.min.ravel(), edges[:, 0])[:, None]
+        upper = np.maximum(self.max.ravel(), edges[:, -1])[:, None]
+        edges = np.concatenate([lower, edges, upper], axis=1)
+
+        cdf = np.cumsum(self.counts, axis=1) / self.count
+        cdf = np.concatenate([np.zeros((n_cells, 1)), cdf], axis=1)
+        out = np.empty((len(qs), n_cells))
+        rows = np.arange(n_cells)
+        for i, q in enumerate(qs):
+            j = np.clip((cdf < q).sum(axis=1) - 1, 0, self.bins + 1)   # bin holding quantile q
+            c0, c1 = cdf[rows, j], cdf[rows, j + 1]
+            frac = np.where(c1 > c0, (q - c0) / np.where(c1 > c0, c1 - c0, 1.0), 0.0)
+            out[i] = edges[rows, j] + frac * (edges[rows, j + 1] - edges[rows, j])
+        out = np.clip(out, self.min.ravel(), self.max.ravel())
+        return out.reshape((len(qs),) + self.shape)
+
+
+class EnsembleResult():
+    """
+    Envelopes of an ensemble, per signal arrays of shape (len(t), n) in model segment order:
+    mean, std, min, max and quantiles of shape (len(quantiles), len(t), n)
+    """
+    def __init__(self, model, t, statistics, quantiles, n_samples, options):
+        self.model = model
+        self.t = t
+        self.quantile_levels = list(quantiles)
+        self.n_samples = n_samples
+        self.options = options
+        self.mean, self.std, self.min, self.max, self.quantiles = {}, {}, {}, {}, {}
+        for name, stats in statistics.items():
+            self.mean[name] = stats.mean
+            self.std[name] = np.sqrt(stats.variance())
+            self.min[name] = stats.min
+            self.max[name] = stats.max
+            self.quantiles[name] = stats.quantiles(self.quantile_levels)
+
+    def quantile(self, signal, q):
+        """
+        Envelope of one quantile level, shape (len(t), n).
+        """
+        if q not in self.quantile_levels:
+            raise ValueError(f"Quantile {q} was not accumulated, available options: {self.quantile_levels}")
+        return self.quantiles[signal][self.quantile_levels.index(q)]
+
+    def envelope(self, segment, signal, band=None):
+        """
+        (lower, center, upper) of a segment: the outer quantiles around the median, or mean ± band·std.
+        """
+        k = self.model.position[segment]
+        if band is not None:
+            mean, std = self.mean[signal][:, k], self.std[signal][:, k]
+            return mean - band * std, mean, mean + band * std
+        q = self.quantiles[signal][:, :, k]
+        center = self.quantile(signal, 0.5)[:, k] if 0.5 in self.quantile_levels else self.mean[signal][:, k]
+        return q[0], center, q[-1]
+
+    def db(self, segments=None, band=None):
+        """
+        Debugger-style db {'t': t, 'SS<index>': {'Po': ..., 'Po_lo': ..., 'Po_hi': ..., 'Fi': ...}} of the
+        envelopes, for plot_all_segments(db, 'Po', band=True).
+        """
+        db = {'t': self.t}
+        for index in self.model.index if segments is None else segments:
+            ss = db[f'SS{index}'] = {}
+            for signal in ENSEMBLE_SIGNALS:
+                ss[f'{signal}_lo'], ss[signal], ss[f'{signal}_hi'] = self.envelope(index, signal, band)
+        return db
+
+    def __repr__(self):
+        return (f"EnsembleResult: {self.n_samples} samples, {len(self.t)} time steps, {self.model.n} segments, "
+                f"quantiles {self.quantile_levels}")
+
+
+def run_ensemble(settings, model_params, model=None):
+    """
+    Integrate a Monte Carlo ensemble of perturbed segment parameters in chunks and reduce it to envelopes.
+    Args:
+        settings (dict): Simulation settings with an optional 'ensemble' section.
+        model_params (dict): Nominal model parameters.
+        model (StateSpaceModel, optional): Previously compiled nominal model to reuse.
+    Returns:
+        result (EnsembleResult): Mean, std, extremes and quantile envelopes of Po and Fi.
+    """
+    options = ensemble_options(settings)
+    if model is None:
+        model = StateSpaceModel(model_params, settings)
+    rng = np.random.default_rng(options['seed'])
+    n, M = model.n, options['samples']
+    t_eval = time_grid(settings)
+    dt = settings['simulation']['time_step']
+    ic = settings['initial_conditions']
+
+    statistics = {name: StreamingStatistics((t_eval.size, n), options['bins']) for name in ENSEMBLE_SIGNALS}
+    nfev = 0
+    for start in range(0, M, options['chunk_size']):
+        N = min(options['chunk_size'], M - start)
+        factor = {key: sample_factors(rng, (N, n), options['cv'][key], options['distribution'])
+                  for key in PARAM_KEYS}
+        rs, l, c = model.rs * factor['rs'], model.l * factor['l'], model.c * factor['c']
+        g = model.g / factor['rp']
+        signal = batch_signal([settings['input_signal']] * N)
+        X0 = np.concatenate([ic['int_fi'] / l, ic['int_po'] / c], axis=1)
+
+        def rhs(t, y):
+            return model.batch_derivative(t, y.reshape(N, -1), signal, rs, l, c, g).ravel()
+
+        sol = solve_ivp(rhs, (t_eval[0], t_eval[-1]), X0.ravel(), method='RK45', t_eval=t_eval, max_step=dt)
+        if not sol.success:
+            raise RuntimeError(f"Ensemble integration failed: {sol.message}")
+        nfev += sol.nfev
+
+        # (N * n_states, n_t) -> (N, n_t, n_states), only this chunk is held in memory
+        x = sol.y.reshape(N, model.n_states, -1).transpose(0, 2, 1)
+        fi = x[:, :, :n].copy()
+        fi[:, :, model.valve] = np.maximum(fi[:, :, model.valve], 0.0)   # aortic valve
+        statistics['Fi'].update(fi)
+        statistics['Po'].update(x[:, :, n:])
+
+    print(f"Ensemble of {M} samples finished in chunks of {options['chunk_size']}: "
+          f"{t_eval.size} time steps, {nfev} batched RHS evaluations.")
+    return EnsembleResult(model, t_eval, statistics, options['quantiles'], M, options)
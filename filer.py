@@ -7,6 +7,9 @@ import pickle
 import re
 import glob
 
+from catalog import catalog_entry, record_run
+from profiler import phase
+
 def loader():
     """
     Load settings and model parameters from JSON files.
@@ -23,22 +26,45 @@ def loader():
         model_params = json.load(file)
     return settings, model_params
 
-def saver(out, settings):
+def claim_output_name(prefix, ext='.pkl', output_dir='Output'):
+    """
+    Atomically claim the next free '<prefix>_XXX<ext>' file in output_dir.
+    The file is created empty with O_EXCL, so concurrent runs never get the same name.
+    Returns (i, path).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    i = 1
+    while True:
+        path = os.path.join(output_dir, f'{prefix}_{i:03d}{ext}')
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            i += 1
+            continue
+        os.close(fd)
+        return i, path
+
+def saver(out, settings, output_dir='Output', wall_time=None, model_params=None):
     """
     Save simulation output to a pickle file with an incremented filename.
     The filename format is 'simulation_output_XXX.pkl', where XXX is a zero-padded integer.
+    The run is added to the catalog of output_dir together with wall_time and the model_params hash.
+    Returns the path of the saved output.
     """
-    i = 1
-    while os.path.exists(f'Output\simulation_output_{i:03d}.pkl'):
-        i += 1
+    i, out_path = claim_output_name('simulation_output', output_dir=output_dir)
 
-    with open(f'Output\simulation_output_{i:03d}.pkl', 'wb') as f:
+    with open(out_path, 'wb') as f:
         pickle.dump(out, f)
 
-    with open(f'Output\settings_simulation_{i:03d}.pkl', 'wb') as f:
+    settings_path = os.path.join(output_dir, f'settings_simulation_{i:03d}.pkl')
+    with open(settings_path, 'wb') as f:
         pickle.dump(settings, f)
 
+    record_run(catalog_entry(f'simulation_output_{i:03d}', settings, {'output': out_path, 'settings': settings_path},
+                             'pickle', wall_time, model_params), output_dir)
+
     print(f"Simulation complete and output saved to 'simulation_output_{i:03d}.pkl'.")
+    return out_path
 
 def load_latest_simulation_output(output_dir='Output', pattern=str):
     """
@@ -64,42 +90,62 @@ def load_latest_simulation_output(output_dir='Output', pattern=str):
 
     return data, last_file
 
-def build_debug_db(data, settings, last_file, output_dir='Output', save=False):
+def debug_keys(ynames, port_list):
     """
-    Build a debugger DB from simulation `data` and `settings`.
-    Returns (db, out_path).
-    Saves the DB to a pickle file in output_dir if save is True.
+    Map every output name to its (SS key, port) in the debugger DB.
+    Returns a list with one (ss_key, port) per yname.
     """
-
-    os.makedirs(output_dir, exist_ok=True)
-    
-    port_list = settings['debugger'].get('debugger_port_list', [])
-
-    db = {'t': data.t}
-
     pattern = re.compile(r'out_(\d+)\[')
-    for i, yname in enumerate(data.ynames):
+    keys = []
+    for i, yname in enumerate(ynames):
         match = pattern.search(yname)
         out_num = int(match.group(1)) if match else None
 
-        attr = f'y{i}'
-        if not hasattr(data, attr):
-            continue
-
         # choose a stable SS key (use parsed out number if available, otherwise use index)
         ss_key = f'SS{out_num}' if out_num is not None else f'SS{i}'
         # pick port from port_list circularly if available, otherwise fall back to a generated name
         port = port_list[i % len(port_list)] if port_list else f'port{i}'
+        keys.append((ss_key, port))
+    return keys
 
-        db.setdefault(ss_key, {})[port] = getattr(data, attr)
+def build_debug_db(data, settings, last_file, output_dir='Output', save=False, ss_keys=None, ports=None):
+    """
+    Build a debugger DB from simulation `data` and `settings`.
+    Returns (db, out_path).
+    Saves the DB to a pickle file in output_dir if save is True.
+    Only the segments in ss_keys (e.g. ['SS1', 'SS13']) and the ports in ports are included if given.
+    For a columnar run (store.RunReader) the signals are memory-mapped and only read when used.
+    """
 
-    # Save the debugger DB if requested
-    if save:
+    with phase('debug_db'):
         os.makedirs(output_dir, exist_ok=True)
-        base = os.path.splitext(os.path.basename(last_file))[0]
-        out_path = os.path.join(output_dir, f'db_{base}.pkl')
-        with open(out_path, 'wb') as f:
-            pickle.dump(db, f, protocol=pickle.HIGHEST_PROTOCOL)
+    
+        port_list = settings['debugger'].get('debugger_port_list', [])
+
+        db = {'t': data.t}
+
+        for i, (ss_key, port) in enumerate(debug_keys(data.ynames, port_list)):
+            if (ss_keys and ss_key not in ss_keys) or (ports and port not in ports):
+                continue
+
+            attr = f'y{i}'
+            if not hasattr(data, attr):
+                continue
+
+            db.setdefault(ss_key, {})[port] = getattr(data, attr)
+
+        if save and hasattr(data, 'run_dir'):
+            # A columnar run is already stored per signal, pickling the DB would copy every signal
+            print(f'Debugger DB of a columnar run is read in place from {data.run_dir}')
+            save = False
+
+        # Save the debugger DB if requested
+        if save:
+            os.makedirs(output_dir, exist_ok=True)
+            base = os.path.splitext(os.path.basename(last_file))[0]
+            out_path = os.path.join(output_dir, f'db_{base}.pkl')
+            with open(out_path, 'wb') as f:
+                pickle.dump(db, f, protocol=pickle.HIGHEST_PROTOCOL)
 
-        print(f'Saved debugger DB to {out_path}')
+            print(f'Saved debugger DB to {out_path}')
     return db
\ No newline at end of file
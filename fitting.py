@@ -0,0 +1,112 @@
+"""
+Fitting segment parameters to measured waveforms
+- Bounded quasi-Newton (L-BFGS-B) over log scale factors of rs/l/c/rp, per segment or a chosen subset
+- Every iteration is one forward-sensitivity run (sensitivity.py) that gives the loss and its full gradient,
+  so a fit takes tens of runs instead of (number of parameters + 1) runs per gradient
+- Measured traces from arrays or CSV files, on any sample times within the simulation
+- Returns the fitted model_params, ready to save like Data/model_params.json
+
+The objective is the trace loss relative to its starting value plus an optional Tikhonov term
+regularization · Σ log(scale)², which keeps poorly observed parameters near their starting values.
+
+Settings (optional 'fit' section, keyword arguments of fit_segments take precedence):
+    "fit": {"parameters": ["rs", "l", "c", "rp"], "segments": null, "bounds": [0.25, 4.0],
+            "max_runs": 30, "regularization": 0.0, "tolerance": 1e-8}
+"""
+
+import numpy as np
+from scipy.optimize import minimize
+
+from sensitivity import PARAMETERS, TRACE_SIGNALS, loss_gradient, parameter_names
+from state_space import StateSpaceModel
+from sweep import scaled_model_params
+from synthetic import save_model_params
+
+FIT_DEFAULTS = {'parameters': list(PARAMETERS), 'segments': None, 'bounds': [0.25, 4.0], 'max_runs': 30,
+                'regularization': 0.0, 'tolerance': 1e-8}
+
+
+def load_trace(path, segment, signal, weight=1.0, time_offset=0.0):
+    """
+    Measured trace from a CSV file with columns time, value; header and comment lines are skipped.
+    Args:
+        path (str): CSV file.
+        segment (int): Segment index of the measurement.
+        signal (str): One of TRACE_SIGNALS.
+        weight (float): Weight of the trace in the loss.
+        time_offset (float): Added to the file times, to place the recording within the simulation.
+    """
+    if signal not in TRACE_SIGNALS:
+        raise ValueError(f"Unknown trace signal: {signal}, available options: {list(TRACE_SIGNALS)}")
+    data = np.genfromtxt(path, delimiter=',', comments='#')
+    data = data[~np.isnan(data).any(axis=1)]
+    return {'segment': segment, 'signal': signal, 't': data[:, 0] + time_offset, 'values': data[:, 1],
+            'weight': weight}
+
+
+class FitResult():
+    """
+    Fitted model parameters, scale factors and the loss history of a fit
+    """
+    def __init__(self, model_params, scales, loss, initial_loss, history, n_runs, success, message):
+        self.model_params = model_params
+        self.scales = scales
+        self.loss = loss
+        self.initial_loss = initial_loss
+        self.history = history
+        self.n_runs = n_runs
+        self.success = success
+        self.message = message
+
+    def save(self, path):
+        """
+        Write the fitted model parameters as JSON.
+        """
+        save_model_params(self.model_params, path)
+
+    def __repr__(self):
+        changed = sum(abs(scale - 1.0) > 1e-3 for scale in self.scales.values())
+        return (f"FitResult: loss {self.initial_loss:.4g} -> {self.loss:.4g} in {self.n_runs} runs, "
+                f"{changed} of {len(self.scales)} parameters changed, {'converged' if self.success else self.message}")
+
+
+def fit_segments(settings, model_params, traces, **options):
+    """
+    Fit scale factors of segment parameters to measured traces.
+    Args:
+        settings (dict): Simulation settings; simulation_time must cover the trace times.
+        model_params (dict): Starting model parameters.
+        traces (list): Measured traces, see sensitivity.py and load_trace.
+        **options: Overrides of FIT_DEFAULTS (parameters, segments, bounds, max_runs, regularization, tolerance).
+    Returns:
+        result (FitResult): Fitted model_params and the scale factor of every parameter.
+    """
+    options = {**FIT_DEFAULTS, **settings.get('fit', {}), **options}
+    names = parameter_names(StateSpaceModel(model_params, settings), options['parameters'], options['segments'])
+    low, high = np.log(options['bounds'])
+    history, scale, evaluated = [], {}, {}
+
+    def objective(theta):
+        point = dict(zip(names, np.exp(theta)))
+        loss, gradient, _ = loss_gradient(settings, scaled_model_params(model_params, point), traces, names)
+        if not history:
+            scale['loss'] = loss if loss > 0.0 else 1.0
+        history.append(loss)
+        evaluated[theta.tobytes()] = loss
+        g = np.array([gradient[name] for name in names])
+        value = loss / scale['loss'] + options['regularization'] * theta @ theta
+        return value, g / scale['loss'] + 2.0 * options['regularization'] * theta
+
+    result = minimize(objective, np.zeros(len(names)), jac=True, method='L-BFGS-B',
+                      bounds=[(low, high)] * len(names),
+                      options={'maxfun': options['max_runs'], 'ftol': options['tolerance']})
+
+    scales = {name: float(value) for name, value in zip(names, np.exp(result.x))}
+    fitted = scaled_model_params(model_params, scales)
+    loss = evaluated.get(result.x.tobytes())
+    if loss is None:   # the optimizer returned a point it did not evaluate last
+        loss, _, _ = loss_gradient(settings, fitted, traces, names)
+        history.append(loss)
+    fit = FitResult(fitted, scales, loss, history[0], history, len(history), result.success, result.message)
+    print(fit)
+    return fit
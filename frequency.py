@@ -0,0 +1,139 @@
+"""
+Frequency-domain solver for the arterial tree
+- Input impedance of every segment, vectorized over a frequency vector
+- Pressure and flow transfer from the segment 1 input to every segment
+- Periodic time waveforms for any harmonic input via FFT
+
+Each segment is treated analytically with s = j·2π·f:
+    Z_node = 1 / (s·C + 1/Rp + sum of 1/Z_in of the downstream segments)
+    Z_in   = Rs + s·L + Z_node
+    Po / Pi = Z_node / Z_in,   Fi = Pi / Z_in
+
+This is the linear network with the aortic valve open; the CLIP of segment 1 is not
+represented, so waveforms of a closing valve are only reproduced by the time-domain engines.
+"""
+
+import numpy as np
+
+from state_space import StateSpaceModel, input_pressure
+
+
+class FrequencyResponse():
+    """
+    Complex spectra of every segment over a frequency vector
+    All arrays have shape (n_segments, n_freqs), rows in model_params.json order.
+    """
+    def __init__(self, model, freqs):
+        self.model = model
+        self.freqs = np.asarray(freqs, dtype=float)
+        self.index = model.index
+        self.position = model.position
+        self.solve()
+
+    def solve(self):
+        """
+        Walk the tree from the terminal segments up and combine child impedances in parallel.
+        """
+        model = self.model
+        s = 2j * np.pi * self.freqs
+        n = model.n
+
+        self.z_in = np.zeros((n, s.size), dtype=complex)
+        self.z_node = np.zeros((n, s.size), dtype=complex)
+        node_admittance = s * model.c[:, None] + model.g[:, None]
+
+        # Downstream segments first: reverse breadth-first order from the root
+        order = self.order()
+        for k in reversed(order):
+            y = node_admittance[k].copy()
+            for j in np.flatnonzero(model.parent == k):
+                y += 1.0 / self.z_in[j]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.z_node[k] = 1.0 / y
+            self.z_in[k] = model.rs[k] + s * model.l[k] + self.z_node[k]
+
+        # Transfer functions relative to the pressure at the segment 1 input
+        self.pressure_in = np.zeros((n, s.size), dtype=complex)    # Pi / P_input
+        self.pressure_out = np.zeros((n, s.size), dtype=complex)   # Po / P_input
+        for k in order:
+            parent = model.parent[k]
+            self.pressure_in[k] = 1.0 if parent < 0 else self.pressure_out[parent]
+            self.pressure_out[k] = self.pressure_in[k] * self.z_node[k] / self.z_in[k]
+        self.flow_in = self.pressure_in / self.z_in              # Fi / P_input
+
+    def order(self):
+        """
+        Segment positions in breadth-first order from the inflow segment.
+        """
+        order = [self.model.root]
+        for k in order:
+            order.extend(np.flatnonzero(self.model.parent == k))
+        return order
+
+    def impedance(self, index):
+        """
+        Input impedance spectrum of segment `index`; impedance(1) is the input impedance of the tree.
+        """
+        return self.z_in[self.position[index]]
+
+    def transfer(self, index, signal='Po'):
+        """
+        Transfer spectrum from the segment 1 input pressure to 'Pi', 'Po' or 'Fi' of segment `index`.
+        """
+        k = self.position[index]
+        match signal:
+            case 'Pi':
+                return self.pressure_in[k]
+            case 'Po':
+                return self.pressure_out[k]
+            case 'Fi':
+                return self.flow_in[k]
+            case _:
+                raise ValueError(f"Unknown signal: {signal}, available options: ['Pi', 'Po', 'Fi']")
+
+
+def frequency_response(model_params, settings, freqs):
+    """
+    Compute impedances and transfer functions of every segment.
+    Args:
+        model_params (dict): Model parameters loaded from JSON file.
+        settings (dict): Settings loaded from JSON file.
+        freqs (array_like): Frequencies in Hz.
+    Returns:
+        response (FrequencyResponse): Spectra of every segment.
+    """
+    return FrequencyResponse(StateSpaceModel(model_params, settings), freqs)
+
+
+def periodic_waveforms(model_params, settings, waveform=None, n_samples=256):
+    """
+    Steady-state periodic waveforms of every segment, rebuilt by inverse FFT.
+    Args:
+        model_params (dict): Model parameters loaded from JSON file.
+        settings (dict): Settings loaded from JSON file; input_signal frequency sets the period.
+        waveform (array_like, optional): One period of input pressure, uniformly sampled.
+            Defaults to the input_signal waveform of the simulation.
+        n_samples (int): Samples per period when waveform is not given.
+    Returns:
+        t (np.ndarray): Time over one period.
+        waves (dict): 'Pi', 'Po' and 'Fi' arrays of shape (n_segments, n_samples).
+        response (FrequencyResponse): Spectra at the harmonics of the input.
+    """
+    period = 1.0 / settings['input_signal']['frequency']
+    if waveform is None:
+        t = np.arange(n_samples) * period / n_samples
+        waveform = input_pressure(t, settings)
+    waveform = np.asarray(waveform, dtype=float)
+    n_samples = waveform.size
+    t = np.arange(n_samples) * period / n_samples
+
+    spectrum = np.fft.rfft(waveform)
+    freqs = np.fft.rfftfreq(n_samples, d=period / n_samples)
+    response = frequency_response(model_params, settings, freqs)
+
+    waves = {
+        'Pi': np.fft.irfft(response.pressure_in * spectrum, n=n_samples),
+        'Po': np.fft.irfft(response.pressure_out * spectrum, n=n_samples),
+        'Fi': np.fft.irfft(response.flow_in * spectrum, n=n_samples),
+    }
+    return t, waves, response
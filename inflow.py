@@ -0,0 +1,217 @@
+"""
+Input signal of segment 1: analytic shapes and tabulated or measured inflow waveforms
+- 'rootsine' (default): sqrt(max(sin, 0))·amplitude + baseline, the WAVEFORM + FUNCTION blocks of connect_segments
+- 'sine' and 'halfsine': amplitude·sin + baseline and amplitude·max(sin, 0) + baseline
+- A measured waveform from a CSV or NPY file, one cycle resampled onto the period of the input frequency
+- Anything but the plain default is precomputed once into a NumPy table of one period, and looked up with
+  periodic linear interpolation at any time array, or per run for batched (N, table_size) tables
+
+Measured files hold one cycle of pressure, in the units of the model (mmHg). One column (or a 1-D NPY array)
+is read as uniform samples over one period; two columns are time and pressure, with the cycle starting at the
+first time and lasting 'file_period' seconds (default: the time span plus one sample interval). amplitude and
+baseline do not apply to measured waveforms; the frequency still sets the period.
+
+Settings (in 'input_signal', all optional):
+    "input_signal": {"frequency": 0.5, "amplitude": 40, "baseline": 80,
+                     "shape": "rootsine", "file": null, "file_period": null, "table_size": null}
+A table_size (default 1024 when a table is needed) also tabulates the default shape.
+"""
+
+import hashlib
+import math
+import os
+
+import numpy as np
+
+INFLOW_SHAPES = ('rootsine', 'sine', 'halfsine')
+TABLE_SIZE = 1024
+SIGNAL_ARRAYS = ('frequency', 'amplitude', 'baseline')
+
+_TABLES = {}   # table key -> InflowTable, shared by every run with the same input signal
+_MAX_TABLES = 64
+_DIGESTS = {}  # (path, mtime, size) -> content hash of a waveform file
+
+
+def tabulated(signal):
+    """
+    True if the input signal is driven from a table instead of the closed-form root sine.
+    """
+    return (signal.get('file') is not None or signal.get('table_size') is not None
+            or signal.get('shape', 'rootsine') != 'rootsine')
+
+
+def shape_values(phase, signal):
+    """
+    Analytic input pressure at phases (fraction of a period) of an input_signal.
+    """
+    sine = np.sin(2 * np.pi * np.asarray(phase, dtype=float))
+    match signal.get('shape', 'rootsine'):
+        case 'rootsine':
+            wave = np.sqrt(np.maximum(sine, 0.0))
+        case 'sine':
+            wave = sine
+        case 'halfsine':
+            wave = np.maximum(sine, 0.0)
+        case shape:
+            raise ValueError(f"Unknown input shape: {shape}, available options: {list(INFLOW_SHAPES)}")
+    return wave * signal['amplitude'] + signal['baseline']
+
+
+def load_waveform(path, period=None):
+    """
+    One measured cycle from a CSV or NPY file as (phase, pressure); header and comment lines are skipped.
+    Args:
+        path (str): File with one column (uniform samples) or two columns (time, pressure).
+        period (float, optional): Duration of the recorded cycle, for two-column files.
+    """
+    if os.path.splitext(path)[1].lower() == '.npy':
+        data = np.load(path)
+    else:
+        data = np.genfromtxt(path, delimiter=',', comments='#')
+    data = np.asarray(data, dtype=float)
+    if data.ndim == 2 and data.shape[1] == 1:
+        data = data[:, 0]
+    if data.ndim == 1:
+        data = data[~np.isnan(data)]
+        return np.arange(data.size) / data.size, data
+    if data.ndim != 2 or data.shape[1] != 2:
+        raise ValueError(f"Waveform file {path} must have one column (pressure) or two (time, pressure).")
+    data = data[~np.isnan(data).any(axis=1)]
+    t, values = data[:, 0] - data[0, 0], data[:, 1]
+    if period is None:
+        period = t[-1] + np.median(np.diff(t))
+    if np.any(np.diff(t) <= 0.0) or t[-1] >= period:
+        raise ValueError(f"Waveform file {path} must hold one cycle with increasing times.")
+    return t / period, values
+
+
+class InflowTable():
+    """
+    Input pressure over one period, sampled at table_size uniform phases
+    """
+    def __init__(self, values, frequency):
+        self.values = np.ascontiguousarray(values, dtype=float)
+        self.size = self.values.size
+        self.frequency = float(frequency)
+        self._phases = np.arange(self.size) / self.size
+
+    def __call__(self, t):
+        """
+        Pressure at a time or time array, by periodic linear interpolation.
+        """
+        phase = np.asarray(t, dtype=float) * self.frequency
+        return np.interp(phase, self._phases, self.values, period=1.0)
+
+    def value(self, t):
+        """
+        Pressure at a scalar time without NumPy overhead, for per-step callers.
+        """
+        position = ((t * self.frequency) % 1.0) * self.size
+        i = int(position)
+        frac = position - i
+        return self.values[i % self.size] * (1.0 - frac) + self.values[(i + 1) % self.size] * frac
+
+    def __repr__(self):
+        return f"InflowTable: {self.size} samples per period of {1.0 / self.frequency:.4g} s"
+
+
+def file_digest(path):
+    """
+    SHA-256 of a waveform file's content, rehashed only when its modification time or size changes.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    digest = _DIGESTS.get(key)
+    if digest is None:
+        with open(path, 'rb') as f:
+            digest = _DIGESTS[key] = hashlib.sha256(f.read()).hexdigest()
+    return digest
+
+
+def table_key(signal):
+    """
+    Hashable key of the input_signal entries that determine its table; files are keyed by path and content.
+    """
+    path = signal.get('file')
+    return (float(signal['frequency']), float(signal['amplitude']), float(signal['baseline']),
+            signal.get('shape', 'rootsine'), path, None if path is None else file_digest(path),
+            signal.get('file_period'), int(signal.get('table_size') or TABLE_SIZE))
+
+
+def inflow_table(signal):
+    """
+    InflowTable of an input_signal, built once per distinct signal and kept for later runs.
+    """
+    key = table_key(signal)
+    table = _TABLES.get(key)
+    if table is None:
+        size = key[-1]
+        phases = np.arange(size) / size
+        if signal.get('file') is not None:
+            phase, values = load_waveform(signal['file'], signal.get('file_period'))
+            values = np.interp(phases, phase, values, period=1.0)
+        else:
+            values = shape_values(phases, signal)
+        if len(_TABLES) >= _MAX_TABLES:
+            _TABLES.pop(next(iter(_TABLES)))
+        table = _TABLES[key] = InflowTable(values, signal['frequency'])
+    return table
+
+
+def inflow_pressure(t, signal):
+    """
+    Driving pressure of segment 1 at time(s) t.
+    signal is an input_signal dict, or the batched form of batch_signal with arrays of shape (N,) and an
+    optional per-run 'table' of shape (N, table_size), evaluated at a scalar t.
+    """
+    if 'table' in signal:
+        table = signal['table']
+        position = ((t * signal['frequency']) % 1.0) * table.shape[1]
+        i = position.astype(int) % table.shape[1]
+        frac = position - np.floor(position)
+        rows = np.arange(table.shape[0])
+        return table[rows, i] * (1.0 - frac) + table[rows, (i + 1) % table.shape[1]] * frac
+    if isinstance(signal['frequency'], np.ndarray) or not tabulated(signal):
+        return shape_values(signal['frequency'] * np.asarray(t, dtype=float), signal)
+    return inflow_table(signal)(t)
+
+
+def scalar_pressure(t, signal):
+    """
+    inflow_pressure at a scalar time, for per-step callers such as the fused kernel.
+    """
+    if tabulated(signal):
+        return inflow_table(signal).value(t)
+    sine = math.sin(2 * math.pi * signal['frequency'] * t)
+    return math.sqrt(max(sine, 0.0)) * signal['amplitude'] + signal['baseline']
+
+
+def batch_signal(signals):
+    """
+    Stack the input_signal dicts of N runs into the arrays batch_derivative takes.
+    If any run is tabulated, every run gets a row of one (N, table_size) table at the largest table_size.
+    """
+    batch = {key: np.array([float(signal[key]) for signal in signals]) for key in SIGNAL_ARRAYS}
+    if any(tabulated(signal) for signal in signals):
+        size = max(int(signal.get('table_size') or TABLE_SIZE) for signal in signals)
+        batch['table'] = np.stack([inflow_table({**signal, 'table_size': size}).values for signal in signals])
+    return batch
+
+
+class InflowSource():
+    """
+    Tabulated input pressure of a bdsim TIME block, used by the 'Waveform' FUNCTION block instead of WAVEFORM.
+    Has the freq and phase attributes of the WAVEFORM generator (phase as a fraction of a period, subtracted),
+    so compiled models and resumed runs set them the same way. The table is looked up once, a reused compiled
+    model passes a changed input_signal to update().
+    """
+    def __init__(self, settings):
+        self.freq = settings['input_signal']['frequency']
+        self.phase = 0.0
+        self.update(settings['input_signal'])
+
+    def update(self, signal):
+        self.table = inflow_table(signal)
+
+    def __call__(self, t):
+        return self.table.value((t * self.freq - self.phase) / self.table.frequency)
@@ -5,11 +5,28 @@ Connects arterial elements based on configuration from a JSON file.
 """
 
 import bdsim
+import contextlib
+import copy
+import io
 import re
+import time
 from arterial_element import arterial_elements_from_params, to_subsystem, connect_segments
-from filer import loader, saver, load_latest_simulation_output, build_debug_db
+from filer import loader, saver, build_debug_db
+from state_space import run_state_space
+from periodic import run_periodic
+from store import RunReader, output_format, save_run, stream_state_space
+from cache import cache_key, get_cache
+from model_cache import load_state_space_model, model_key
+from profiler import instrument_model, phase, profiling, record_steps
+from probes import probe_bdsim, probe_specs, run_probed
+from metrics import metrics_only, reduce_output, run_metrics
+from checkpoint import bdsim_start, checkpoint_interval, final_checkpoint, run_checkpointed, store_checkpoint
+from decompose import decompose_options, run_decomposed
 import numpy as np
 
+# Built bdsim diagrams per (sim, model_key), see compiled_model, and state-space models per model_key
+_COMPILED = {}
+_STATE_SPACE = {}
 
 
 def main():
@@ -19,56 +36,281 @@ def main():
 
     settings['debugger']['debug_for_index'] = [1,3,5,7,9,11,13]
     settings['input_signal']['frequency'] = 0.5  # Change frequency to 0.5 Hz
-    init_and_run(settings, model_params, sim)
-    data1, last_file1 = load_latest_simulation_output(pattern='simulation_output_*.pkl')
-    db1 = build_debug_db(data1, settings, last_file1, save=True)
+    with profiling(settings):   # one report for the run and the debugger DB if settings['profile'] is enabled
+        # The returned output is used directly: pickle, columnar RunReader or cached result alike
+        out1, path1 = run_and_save(settings, model_params, sim)
+        db1 = output_db(out1, settings, path1)
 
     # settings['input_signal']['frequency'] = 0.4  # Change frequency to 0.5 Hz
-    # init_and_run(settings, model_params, sim)
-    # data2, last_file2 = load_latest_simulation_output(pattern='simulation_output_*.pkl')
-    # db2 = build_debug_db(data2, settings, last_file2, save=True)
+    # out2, path2 = run_and_save(settings, model_params, sim)
+    # db2 = output_db(out2, settings, path2)
     
     # settings['input_signal']['frequency'] = 0.20  # Change frequency to 0.5 Hz
-    # init_and_run(settings, model_params, sim)
-    # data3, last_file3 = load_latest_simulation_output(pattern='simulation_output_*.pkl')
-    # db3 = build_debug_db(data3, settings, last_file3, save=True)
+    # out3, path3 = run_and_save(settings, model_params, sim)
+    # db3 = output_db(out3, settings, path3)
     
 
+def output_db(out, settings, path):
+    """
+    Debugger DB of a run output: built from the watched signals of a waveform output (saved next to it when
+    it was saved), the probe DB of a probes.ProbeOutput, or None for the metrics.MetricsTable of a
+    metrics-only run, which is printed instead.
+    """
+    if hasattr(out, 'ynames'):
+        return build_debug_db(out, settings, path, save=path is not None)
+    if hasattr(out, 'db'):
+        return out.db()
+    print(out)
+    return None
+
 def init_and_run(settings, model_params, sim):
     """
     Initialize and run the arterial network simulation.
+    With settings['cache']['enabled'], a previous result of identical settings and model_params
+    is returned instead of simulating (see cache.py).
+    With settings['profile']['enabled'], time and memory per phase are written to a report next to
+    the output (see profiler.py).
     Args:
         settings (dict): Simulation settings.
         model_params (dict): Model parameters.
         sim (bdsim.BDSim): BDSim simulation instance.
     """
-    arterial_elements = arterial_elements_from_params(sim, model_params, settings)
+    return run_and_save(settings, model_params, sim)[0]
 
-    ## Initialize main model and add subsystems to dictionary
-    
-    model = sim.blockdiagram(name='Arterial Network Model')
+def run_and_save(settings, model_params, sim):
+    """
+    init_and_run, also returning where the output was saved.
+    Returns:
+        out: Simulation output.
+        path (str): Path of the saved output or run directory, None if not saved or reused from the cache.
+    """
+    with profiling(settings) as profiler:
+        cache = get_cache(settings)
+        if cache is not None:
+            key = cache_key(settings, model_params)
+            with phase('cache'):
+                out = cache.get(key)
+            if out is not None:
+                print(f"Cached result {key[:12]} reused, {cache.stats}")
+                return out, None
+
+        t0 = time.perf_counter()
+        out = simulate(settings, model_params, sim)
+        if isinstance(out, RunReader):  # streamed runs are already on disk
+            path = out.run_dir
+        else:
+            with phase('save'):
+                path = save_output(out, settings, time.perf_counter() - t0, model_params)
+        store_checkpoint(out, settings, path)
+        if profiler is not None and path is not None:
+            profiler.run_path = path
+
+        if cache is not None:
+            with phase('cache'):
+                cache.put(key, out, settings)
+        return out, path
+
+def check_run_sections(settings):
+    """
+    Raise a ValueError for run sections that simulate cannot combine.
+    probes, metrics-only runs and decompose each select their own state-space runner. Checkpoint intervals
+    combine with all but decompose, and columnar output with all but probes and metrics-only runs, whose
+    outputs are not runs of signals. Periodic mode takes none of them but metrics, which are reduced from the
+    recorded cycles.
+    """
+    selected = [name for name, active in (('probes', probe_specs(settings) is not None),
+                                          ('metrics (keep_waveforms false)', metrics_only(settings)),
+                                          ('decompose', decompose_options(settings) is not None)) if active]
+    columnar = settings['output']['save_results'] and settings['output'].get('format', 'pickle') == 'columnar'
+    if settings['simulation'].get('mode', 'transient') == 'periodic':
+        unsupported = [name for name in selected if not name.startswith('metrics')]
+        unsupported += ['checkpoint interval'] if checkpoint_interval(settings) is not None else []
+        if unsupported:
+            raise ValueError(f"Periodic mode cannot be combined with: {unsupported}")
+        return
+    if 'decompose' in selected and settings['simulation'].get('engine', 'bdsim') != 'state_space':
+        raise ValueError("Decompose needs the state_space engine.")
+    if len(selected) > 1:
+        raise ValueError(f"Only one of probes, metrics-only runs and decompose can be enabled, got: {selected}")
+    if 'decompose' in selected and checkpoint_interval(settings) is not None:
+        raise ValueError("Decomposed runs write no periodic checkpoints, remove the checkpoint interval.")
+    if columnar and selected and selected[0] != 'decompose':
+        raise ValueError(f"Columnar output stores runs of signals, {selected[0]} outputs cannot be stored "
+                         f"columnar; use output.format 'pickle'.")
+
+def simulate(settings, model_params, sim):
+    """
+    Run the simulation selected by settings['simulation'] and return its output.
+    Conflicting run sections raise a ValueError, see check_run_sections.
+    """
+    check_run_sections(settings)
+    if settings['simulation'].get('mode', 'transient') == 'periodic':
+        # Periodic steady state on the state-space engine, records only converged cycles
+        with phase('build'):
+            model, _ = state_space_model(settings, model_params)
+        with phase('run'), instrument_model(model):
+            out = run_periodic(settings, model_params, model=model)
+        record_steps(out)
+        return reduce_output(out, settings, model_params, model=model)
+
+    if settings['simulation'].get('engine', 'bdsim') == 'state_space':
+        with phase('build'):
+            model, _ = state_space_model(settings, model_params)
+        with phase('run'), instrument_model(model):
+            if probe_specs(settings) is not None:
+                # Only the probed signals are kept, see probes.py
+                out = run_probed(settings, model_params, model=model)
+            elif metrics_only(settings):
+                # Only the per-cycle metrics are kept, see metrics.py
+                out = run_metrics(settings, model_params, model=model)
+            elif decompose_options(settings) is not None:
+                # Subtrees integrated in parallel worker processes, see decompose.py; a columnar output is
+                # written after the run
+                out = run_decomposed(settings, model_params, model=model)
+            elif settings['output']['save_results'] and settings['output'].get('format', 'pickle') == 'columnar':
+                # Write chunks to disk while integrating, returns a memory-mapped RunReader
+                out = stream_state_space(settings, model_params, model=model)
+            elif checkpoint_interval(settings) is not None:
+                # Windowed run that writes a checkpoint every interval, see checkpoint.py
+                out = run_checkpointed(settings, model_params, model=model)
+            else:
+                # Sparse state-space engine, skips building the block diagram
+                out = run_state_space(settings, model_params, model=model)
+        record_steps(out, getattr(out, 'stats', {}).get('nfev'))
+        checkpoint = final_checkpoint(out, settings, model_params, model=model)
+        out = reduce_output(out, settings, model_params, model=model)
+        if checkpoint is not None:
+            out.checkpoint = checkpoint
+        return out
 
-    # Convert all arterial elements to subsystems under main model and store in 'SS' dictionary
-    arterial_elements = to_subsystem(model, arterial_elements)
+    model, arterial_elements, _ = compiled_model(settings, model_params, sim)
+    if settings['simulation'].get('quiet', False):
+        sim.set_options(quiet=True)
 
-    # Connect segments based on model_params connections
-    connect_segments(model, arterial_elements, model_params, settings)
+    # Integrator states and generator phase of the start, from a checkpoint if resuming or warm-starting
+    t0 = bdsim_start(model, arterial_elements['generator'], settings, model_params)
+    with phase('run'), instrument_model(model):
+        out = sim.run(model, dt = settings['simulation']['time_step'],
+                      T = settings['simulation']['simulation_time'] - t0,
+                      block = settings['simulation']['block'])  # simulate for 30s
+    out.t = out.t + t0
+    record_steps(out, sim.simstate.count)
+    checkpoint = final_checkpoint(out, settings, model_params)
+    if probe_specs(settings) is not None:
+        out = probe_bdsim(out, settings, model_params)
+    out = reduce_output(out, settings, model_params)
+    if checkpoint is not None:
+        out.checkpoint = checkpoint
+    return out
+
+def compiled_model(settings, model_params, sim):
+    """
+    Built and compiled block diagram, reused within this process when sim and model_key match.
+    A reused diagram keeps its own copy of settings, updated in place, and the generator frequency and
+    the Waveform FUNCTION block are set from settings['input_signal'].
+    Returns:
+        model (bdsim.BlockDiagram): Compiled block diagram.
+        arterial_elements (dict): Element diagrams, subsystems and the input generator.
+        reused (bool): True if a previously built diagram was returned.
+    """
+    key = (id(sim), model_key(settings, model_params))
+    reused = key in _COMPILED
+    if not reused:
+        model_settings = copy.deepcopy(settings)
+        model, arterial_elements = build_model(model_settings, model_params, sim)
+        _COMPILED[key] = (sim, model_settings, model, arterial_elements)
+
+    _, model_settings, model, arterial_elements = _COMPILED[key]
+    model_settings.clear()
+    model_settings.update(copy.deepcopy(settings))
+    arterial_elements['generator'].freq = settings['input_signal']['frequency']
+    arterial_elements['source'].update(settings['input_signal'])
+    return model, arterial_elements, reused
+
+def state_space_model(settings, model_params):
+    """
+    StateSpaceModel reused within this process when model_key matches, loaded from the model cache or
+    built otherwise. A reused model gets the settings of this run.
+    Returns:
+        model (StateSpaceModel): Compiled model.
+        reused (bool): True if a model of this process was returned.
+    """
+    key = model_key(settings, model_params)
+    reused = key in _STATE_SPACE
+    if not reused:
+        _STATE_SPACE[key], _ = load_state_space_model(settings, model_params)
+    model = _STATE_SPACE[key]
+    model.settings = settings
+    return model, reused
+
+def model_built(settings, model_params, sim):
+    """
+    True if simulate would reuse a model built earlier in this process.
+    """
+    key = model_key(settings, model_params)
+    if settings['simulation'].get('mode', 'transient') == 'periodic' or \
+            settings['simulation'].get('engine', 'bdsim') == 'state_space':
+        return key in _STATE_SPACE
+    return (id(sim), key) in _COMPILED
+
+def build_model(settings, model_params, sim):
+    """
+    Build and compile the arterial network block diagram.
+    Args:
+        settings (dict): Simulation settings.
+        model_params (dict): Model parameters.
+        sim (bdsim.BDSim): BDSim simulation instance.
+    Returns:
+        model (bdsim.BlockDiagram): Compiled block diagram.
+        arterial_elements (dict): Element diagrams, subsystems and the input generator.
+    """
+    with phase('build'):
+        with phase('elements'):
+            arterial_elements = arterial_elements_from_params(sim, model_params, settings)
+
+        ## Initialize main model and add subsystems to dictionary
+
+        model = sim.blockdiagram(name='Arterial Network Model')
+
+        # Convert all arterial elements to subsystems under main model and store in 'SS' dictionary
+        with phase('subsystems'):
+            arterial_elements = to_subsystem(model, arterial_elements, settings)
+
+        # Connect segments based on model_params connections
+        with phase('connect'):
+            connect_segments(model, arterial_elements, model_params, settings)
 
     if settings['simulation']['report']:
         model.report()    # list all blocks and wires
 
-    model.compile()
+    with phase('compile'):
+        if settings['simulation'].get('quiet', False):
+            # bdsim prints its connection checks unconditionally; a failed compile still raises
+            with contextlib.redirect_stdout(io.StringIO()):
+                model.compile(verbose=False)
+        else:
+            model.compile()
+    return model, arterial_elements
 
-    out = sim.run(model, dt = settings['simulation']['time_step'],
-                  T = settings['simulation']['simulation_time'],
-                  block = settings['simulation']['block'])  # simulate for 30s
-    
-    # Save the output if specified in settings
+def save_output(out, settings, wall_time=None, model_params=None):
+    """
+    Save the output if specified in settings and add it to the run catalog.
+    settings['output']['format'] selects 'pickle' (default) or the 'columnar' run directory of store.py.
+    Returns the path of the saved output, or None.
+    """
     if settings['output']['save_results']: # only save if specified in settings
-        print(out)
-        saver(out, settings)
+        if not settings['simulation'].get('quiet', False):
+            print(out)
+        match output_format(out, settings):
+            case 'pickle':
+                return saver(out, settings, wall_time=wall_time, model_params=model_params)
+            case 'columnar':
+                return save_run(out, settings, wall_time=wall_time, model_params=model_params)
+            case fmt:
+                raise ValueError(f"Unknown output format: {fmt}, available options: ['pickle', 'columnar']")
     else :
         print("Output saving is disabled in settings.")
+        return None
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,251 @@
+"""
+Online per-cycle hemodynamic metrics
+- Streaming reducers over the states of every segment, one cycle of the input_signal frequency at a time
+- Pressure (Po): systolic, diastolic, mean, pulse pressure and time of the systolic peak
+- Flow (Fi): maximum, minimum, mean, stroke volume (∫Fi over the cycle) and time of the peak flow
+- Junction balance: mean inflow Fi against mean outflow Fo + Po/Rp (Fo is the Sum block of the children)
+- O(1) memory per segment while integrating; the result is a compact per-cycle MetricsTable
+
+Only complete cycles are reported. Times of peaks are relative to the start of their cycle.
+Without 'keep_waveforms' a run returns just the table, which is orders of magnitude smaller than the
+waveforms; with it, the table is attached to the output as out.metrics.
+
+Settings (optional 'metrics' section):
+    "metrics": {"enabled": true, "keep_waveforms": false}
+"""
+
+import csv
+import re
+
+import numpy as np
+
+from checkpoint import checkpoint_writer
+from state_space import StateSpaceModel, integrate_windows
+from store import CHUNK_SIZE, chunk_size
+
+METRICS_DEFAULTS = {'enabled': False, 'keep_waveforms': False}
+METRICS = ('P_sys', 'P_dia', 'P_mean', 'P_pulse', 't_P_peak',
+           'F_max', 'F_min', 'F_mean', 'stroke_volume', 't_F_peak',
+           'Q_in', 'Q_out', 'balance')
+
+# np.trapezoid is NumPy >= 2.0, np.trapz before
+trapezoid = np.trapezoid if hasattr(np, 'trapezoid') else np.trapz
+
+
+def metrics_options(settings):
+    """
+    Options of an enabled settings['metrics'] section, or None.
+    """
+    options = {**METRICS_DEFAULTS, **settings.get('metrics', {})}
+    return options if options['enabled'] else None
+
+
+def metrics_only(settings):
+    """
+    True if the run keeps the per-cycle metrics and no waveforms.
+    """
+    options = metrics_options(settings)
+    return options is not None and not options['keep_waveforms']
+
+
+class CycleMetrics():
+    """
+    Streaming per-cycle reducer of all segments
+    """
+    def __init__(self, model, period):
+        self.model = model
+        self.period = period
+        self.cycle = None
+        self.complete = False   # the current cycle was recorded from its start
+        self.prev = None   # last sample (t, Po, Fi, Qout), left end of the next trapezoid
+        self.rows = []
+        self.cycles = []
+        self.n_steps = 0
+        self.reset()
+
+    def reset(self):
+        n = self.model.n
+        self.p_max, self.p_min = np.full(n, -np.inf), np.full(n, np.inf)
+        self.f_max, self.f_min = np.full(n, -np.inf), np.full(n, np.inf)
+        self.t_p_max, self.t_f_max = np.zeros(n), np.zeros(n)
+        self.int_p, self.int_f, self.int_q = np.zeros(n), np.zeros(n), np.zeros(n)
+        self.duration = 0.0
+
+    def record(self, t, states):
+        """
+        Reduce a chunk of output steps.
+        Args:
+            t (np.ndarray): Increasing times of the chunk.
+            states (np.ndarray): State-space states at t, shape (len(t), n_states).
+        """
+        self.n_steps += len(t)
+        model = self.model
+        x = model.clip(states.T)
+        fi, po = x[:model.n], x[model.n:]
+        q_out = model.incidence @ fi + model.g[:, None] * po
+        cycles = np.floor(t / self.period + 1e-9).astype(np.int64)
+
+        for part in np.split(np.arange(t.size), np.flatnonzero(np.diff(cycles)) + 1):
+            if self.cycle is not None and cycles[part[0]] != self.cycle:
+                # The step into the new cycle still belongs to the old one
+                first = part[:1]
+                self.accumulate(t[first], po[:, first], fi[:, first], q_out[:, first], extremes=False)
+                self.close()
+                self.complete = True
+            elif self.cycle is None:
+                # A run resumed from a checkpoint can start within a cycle
+                self.complete = t[0] <= cycles[0] * self.period + 1e-9
+            self.cycle = cycles[part[0]]
+            self.accumulate(t[part], po[:, part], fi[:, part], q_out[:, part])
+
+    def accumulate(self, t, po, fi, q_out, extremes=True):
+        if extremes:
+            k = np.argmax(po, axis=1)
+            better = po[np.arange(po.shape[0]), k] > self.p_max
+            self.t_p_max[better] = t[k[better]]
+            self.p_max = np.maximum(self.p_max, po.max(axis=1))
+            self.p_min = np.minimum(self.p_min, po.min(axis=1))
+            k = np.argmax(fi, axis=1)
+            better = fi[np.arange(fi.shape[0]), k] > self.f_max
+            self.t_f_max[better] = t[k[better]]
+            self.f_max = np.maximum(self.f_max, fi.max(axis=1))
+            self.f_min = np.minimum(self.f_min, fi.min(axis=1))
+
+        if self.prev is not None:
+            t_prev, po_prev, fi_prev, q_prev = self.prev
+            t = np.concatenate([[t_prev], t])
+            po = np.column_stack([po_prev, po])
+            fi = np.column_stack([fi_prev, fi])
+            q_out = np.column_stack([q_prev, q_out])
+        if t.size > 1:
+            self.int_p += trapezoid(po, t, axis=1)
+            self.int_f += trapezoid(fi, t, axis=1)
+            self.int_q += trapezoid(q_out, t, axis=1)
+            self.duration += t[-1] - t[0]
+        self.prev = (t[-1], po[:, -1], fi[:, -1], q_out[:, -1])
+
+    def close(self):
+        """
+        Store the metrics of the current cycle and start the next one.
+        """
+        if self.complete and self.duration > 0.0:
+            start = self.cycle * self.period
+            p_mean, f_mean = self.int_p / self.duration, self.int_f / self.duration
+            q_out = self.int_q / self.duration
+            self.rows.append(np.column_stack([
+                self.p_max, self.p_min, p_mean, self.p_max - self.p_min, self.t_p_max - start,
+                self.f_max, self.f_min, f_mean, self.int_f, self.t_f_max - start,
+                f_mean, q_out, f_mean - q_out]))
+            self.cycles.append(int(self.cycle))
+        self.reset()
+
+    def table(self):
+        return MetricsTable(self.cycles, self.period, list(self.model.index), self.rows, self.n_steps)
+
+
+class MetricsTable():
+    """
+    Per-cycle metrics of every segment: data[cycle, segment, metric] with metrics in METRICS order
+    """
+    def __init__(self, cycles, period, index, rows, n_steps=0):
+        self.cycles = np.asarray(cycles, dtype=int)
+        self.period = period
+        self.index = index
+        self.columns = list(METRICS)
+        self.data = np.array(rows) if rows else np.empty((0, len(index), len(METRICS)))
+        self.n_steps = n_steps   # output steps reduced into the table
+
+    def column(self, name):
+        """
+        One metric of all cycles and segments, shape (n_cycles, n_segments).
+        """
+        if name not in self.columns:
+            raise ValueError(f"Unknown metric: {name}, available options: {self.columns}")
+        return self.data[:, :, self.columns.index(name)]
+
+    def segment(self, index):
+        """
+        Metrics of one segment as {metric: value per cycle}.
+        """
+        k = self.index.index(index)
+        return {name: self.data[:, k, j] for j, name in enumerate(self.columns)}
+
+    def rows(self):
+        """
+        Flat table, one dict per (cycle, segment).
+        """
+        return [{'cycle': int(cycle), 'segment': index, **dict(zip(self.columns, map(float, self.data[i, k])))}
+                for i, cycle in enumerate(self.cycles) for k, index in enumerate(self.index)]
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['cycle', 'segment'] + self.columns)
+            writer.writeheader()
+            writer.writerows(self.rows())
+
+    def __repr__(self):
+        return (f"MetricsTable: {len(self.cycles)} cycles of {self.period:g} s, {len(self.index)} segments, "
+                f"{len(self.columns)} metrics")
+
+
+def cycle_reducer(settings, model):
+    """
+    CycleMetrics of an enabled 'metrics' section, or None, for runs that record other outputs as well.
+    """
+    if metrics_options(settings) is None:
+        return None
+    return CycleMetrics(model, 1.0 / settings['input_signal']['frequency'])
+
+
+def run_metrics(settings, model_params, model=None):
+    """
+    Integrate the state-space model window by window and keep only the per-cycle metrics.
+    Returns:
+        table (MetricsTable): Metrics of every complete cycle.
+    """
+    if model is None:
+        model = StateSpaceModel(model_params, settings)
+    reducer = CycleMetrics(model, 1.0 / settings['input_signal']['frequency'])
+    checkpoints = checkpoint_writer(settings, model)
+    for t, states in integrate_windows(settings, model, chunk_size(settings)):
+        reducer.record(t, states)
+        if checkpoints is not None:
+            checkpoints.record(t, states)
+    table = reducer.table()
+    if checkpoints is not None:
+        table.checkpoint = checkpoints.checkpoint()
+    print(f"State-space simulation of {model.n} segments reduced to {table}.")
+    return table
+
+
+def output_states(out, model):
+    """
+    States of a bdsim or state-space output in the state-space layout, shape (len(t), n_states).
+    """
+    if any(re.search(r'/(Fi|Po)x0$', name) for name in out.xnames):
+        from probes import bdsim_states
+        return bdsim_states(out, model)
+    return out.x
+
+
+def reduce_output(out, settings, model_params, model=None):
+    """
+    Apply an enabled 'metrics' section to a finished run.
+    Returns:
+        out: The MetricsTable alone, or out with the table as out.metrics when keep_waveforms is set.
+            Outputs without states are returned unchanged; a probes.ProbeOutput carries its own metrics.
+    """
+    options = metrics_options(settings)
+    if options is None or getattr(out, 'x', None) is None:
+        return out
+    if model is None:
+        model = StateSpaceModel(model_params, settings)
+    reducer = cycle_reducer(settings, model)
+    states = output_states(out, model)
+    for k in range(0, len(out.t), CHUNK_SIZE):
+        reducer.record(np.asarray(out.t[k:k + CHUNK_SIZE]), np.asarray(states[k:k + CHUNK_SIZE]))
+    table = reducer.table()
+    if not options['keep_waveforms']:
+        return table
+    out.metrics = table
+    return out
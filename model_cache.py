@@ -0,0 +1,69 @@
+"""
+Compiled-model cache
+- Key: hash of model_params and the settings that shape the model (debugger, initial conditions)
+- The compiled state-space form is pickled once per key and later loaded in a single read
+- The same key is used by main.compiled_model to reuse built bdsim diagrams within a process
+
+A bdsim BlockDiagram cannot be serialized (its blocks hold closures and a reference to the
+BDSim runtime), so the on-disk form is the equivalent StateSpaceModel. Built bdsim diagrams are
+memoized per process instead.
+
+Settings (optional 'model_cache' section):
+    "model_cache": {"enabled": true, "directory": "Output/models"}
+"""
+
+import hashlib
+import json
+import os
+import pickle
+
+from inflow import tabulated
+from state_space import StateSpaceModel
+
+MODEL_CACHE_DEFAULTS = {'enabled': False, 'directory': os.path.join('Output', 'models')}
+
+# Settings sections that can change between runs of one built model
+RUN_SECTIONS = ('input_signal', 'simulation', 'output', 'cache', 'model_cache', 'periodic', 'implicit',
+                'checkpoint', 'decompose', 'probes', 'metrics', 'profile', 'ensemble', 'sensitivity', 'fit',
+                'reduction')
+
+
+def model_key(settings, model_params):
+    """
+    Hash of model_params and the settings that determine the built model.
+    """
+    structure = {k: v for k, v in settings.items() if k not in RUN_SECTIONS}
+    structure['engine'] = settings['simulation'].get('engine', 'bdsim')
+    structure['model_params'] = model_params
+    if tabulated(settings['input_signal']):
+        structure['inflow'] = 'table'   # the diagram drives segment 1 from a TIME block instead of WAVEFORM
+    return hashlib.sha1(json.dumps(structure, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_state_space_model(settings, model_params):
+    """
+    Compiled StateSpaceModel from the model cache, built and stored on a miss.
+    Without an enabled 'model_cache' section the model is simply built.
+    Returns:
+        model (StateSpaceModel): Compiled model with settings attached.
+        cached (bool): True if it was loaded from disk.
+    """
+    options = {**MODEL_CACHE_DEFAULTS, **settings.get('model_cache', {})}
+    if not options['enabled']:
+        return StateSpaceModel(model_params, settings), False
+
+    key = model_key({**settings, 'simulation': {**settings['simulation'], 'engine': 'state_space'}}, model_params)
+    path = os.path.join(options['directory'], f'state_space_{key}.pkl')
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            model = pickle.load(f)
+        model.settings = settings
+        return model, True
+
+    model = StateSpaceModel(model_params, settings)
+    os.makedirs(options['directory'], exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    return model, False
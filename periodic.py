@@ -0,0 +1,155 @@
+"""
+Periodic steady-state (shooting) mode for the state-space engine
+- Solves x0 = Φ(x0) for the one-period map Φ of the network driven at the input_signal frequency
+- Newton iteration on Φ(x0) - x0 = 0, starting from initial_conditions
+- Only the requested number of converged cycles is simulated and recorded
+
+The aortic-valve clip of segment 1 is included. The network is linear in each valve state
+(open: A, closed: A with the Fi1 column removed), so the period map is evaluated exactly on a
+fine grid with the first-order-hold discretization of discrete.py, split where the valve switches.
+The right-hand side is continuous at the switch, so the monodromy matrix dΦ/dx0 is simply the
+product of the step matrices.
+
+The valve can create unstable periodic orbits next to the physical one. A Newton step is only
+accepted when it lowers the residual and the Floquet multipliers (eigenvalues of the monodromy
+matrix) stay inside the unit circle; otherwise one plain cycle x0 <- Φ(x0) is taken instead.
+
+Settings (optional 'periodic' section):
+    "periodic": {"cycles": 1, "tolerance": 1e-6, "max_iterations": 200, "steps_per_period": 1000}
+"""
+
+import numpy as np
+
+from checkpoint import start_state
+from discrete import DiscreteModel
+from state_space import StateSpaceModel, build_output, input_pressure
+
+PERIODIC_DEFAULTS = {'cycles': 1, 'tolerance': 1e-6, 'max_iterations': 200, 'steps_per_period': 1000}
+
+
+class PeriodMap():
+    """
+    One-period map of the network on a fixed grid, with its monodromy matrix
+    """
+    def __init__(self, model, period, steps):
+        self.model = model
+        self.period = period
+        self.steps = steps
+        self.h = period / steps
+        self.discrete = DiscreteModel(model, self.h, 'foh')
+        self.u = input_pressure(np.arange(steps + 1) * self.h, model.settings)
+
+    def __call__(self, x0, monodromy=True, states=None):
+        """
+        Returns Φ(x0) and the monodromy matrix dΦ/dx0 (None if monodromy is False).
+        If states is given, the state at every grid point is written into it, shape (steps + 1, n_states).
+        """
+        if not monodromy:
+            states = self.discrete.run(x0, self.u, states)
+            return states[-1].copy(), None
+
+        x, M = np.array(x0, dtype=float), np.eye(self.model.n_states)
+        for k in range(self.steps):
+            x, M = self.discrete.step(x, self.u[k], self.u[k + 1], M)
+        return x, M
+
+
+def spectral_radius(M):
+    """
+    Largest Floquet multiplier magnitude of a monodromy matrix.
+    """
+    return np.max(np.abs(np.linalg.eigvals(M)))
+
+
+def find_periodic_state(model, x0=None):
+    """
+    Solve Φ(x0) - x0 = 0 for a stable periodic orbit.
+    Args:
+        model (StateSpaceModel): Compiled state-space model; settings hold input_signal and periodic options.
+        x0 (np.ndarray, optional): Initial guess, defaults to the model initial conditions.
+    Returns:
+        x0 (np.ndarray): State at the start of a converged period.
+        info (dict): residual (|Φ(x0) - x0| / max(|Φ(x0)|, 1)), iterations, newton_steps,
+            plain_cycles and spectral_radius.
+    """
+    options = {**PERIODIC_DEFAULTS, **model.settings.get('periodic', {})}
+    period_map = PeriodMap(model, 1.0 / model.settings['input_signal']['frequency'], options['steps_per_period'])
+    return newton_periodic(period_map, model.x0 if x0 is None else x0, options)
+
+
+def newton_periodic(period_map, x0, options):
+    """
+    Newton / plain-cycle iteration on a PeriodMap, see find_periodic_state.
+    """
+    I = np.eye(period_map.model.n_states)
+
+    x0 = np.array(x0, dtype=float)
+    x1, M = period_map(x0)
+    info = {'newton_steps': 0, 'plain_cycles': 0}
+    for iterations in range(1, options['max_iterations'] + 1):
+        info['residual'] = np.linalg.norm(x1 - x0) / max(np.linalg.norm(x1), 1.0)
+        info['spectral_radius'] = spectral_radius(M)
+        info['iterations'] = iterations
+        if info['residual'] < options['tolerance'] and info['spectral_radius'] < 1.0:
+            return x1, info
+
+        # Newton step, kept only if it lowers the residual on a stable orbit
+        try:
+            x_try = x0 - np.linalg.solve(M - I, x1 - x0)
+            x1_try, M_try = period_map(x_try)
+            accept = (np.linalg.norm(x1_try - x_try) < np.linalg.norm(x1 - x0)
+                      and spectral_radius(M_try) < 1.0)
+        except np.linalg.LinAlgError:
+            accept = False
+
+        if accept:
+            x0, x1, M = x_try, x1_try, M_try
+            info['newton_steps'] += 1
+        else:
+            x0 = x1
+            x1, M = period_map(x0)
+            info['plain_cycles'] += 1
+
+    print(f"Periodic steady state did not converge in {options['max_iterations']} iterations.")
+    return x1, info
+
+
+def run_periodic(settings, model_params, model=None):
+    """
+    Solve for the periodic steady state and record only the converged cycles.
+    Args:
+        settings (dict): Simulation settings.
+        model_params (dict): Model parameters.
+        model (StateSpaceModel, optional): Previously compiled model to reuse.
+    Returns:
+        out (StateSpaceOutput): Output over settings['periodic']['cycles'] periods, with
+            residual, iterations, newton_steps, plain_cycles, spectral_radius and converged attributes.
+    """
+    if model is None:
+        model = StateSpaceModel(model_params, settings)
+
+    options = {**PERIODIC_DEFAULTS, **settings.get('periodic', {})}
+    period_map = PeriodMap(model, 1.0 / settings['input_signal']['frequency'], options['steps_per_period'])
+    # A warm start (see checkpoint.py) only changes the initial guess of the iteration
+    x0, info = newton_periodic(period_map, start_state(settings, model)[1], options)
+
+    # Record the converged cycles with the same exact stepping, sampled at time_step
+    steps, cycles = period_map.steps, options['cycles']
+    states = np.empty((cycles * steps + 1, model.n_states))
+    x = x0
+    for c in range(cycles):
+        x, _ = period_map(x, monodromy=False, states=states[c * steps:(c + 1) * steps + 1])
+    stride = max(1, int(round(settings['simulation']['time_step'] / period_map.h)))
+    t = np.arange(states.shape[0]) * period_map.h
+
+    converged = info['residual'] < options['tolerance'] and info['spectral_radius'] < 1.0
+    print(f"Periodic steady state {'found' if converged else 'NOT converged'} after {info['iterations']} iterations "
+          f"({info['newton_steps']} Newton steps, {info['plain_cycles']} plain cycles), "
+          f"residual {info['residual']:.3e}, spectral radius {info['spectral_radius']:.3f}; "
+          f"recorded {cycles} cycle(s).")
+
+    out = build_output(model, t[::stride], states[::stride].T)
+    for key, value in info.items():
+        setattr(out, key, value)
+    out.converged = converged
+    return out
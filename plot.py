@@ -24,7 +24,8 @@ import matplotlib.pyplot as plt
 
 from filer import loader, load_latest_simulation_output, build_debug_db
 
-def plot_all_segments(db, fi_substring, ss_keys=False, figsize=(10, 6), cmap_name='tab20'):
+def plot_all_segments(db, fi_substring, ss_keys=False, figsize=(10, 6), cmap_name='tab20', band=False):
+    # band: also draw '<key>_lo'/'<key>_hi' of a segment as a shaded band (ensemble envelopes)
     t = np.asarray(db.get('t', []))
     # find SS keys and sort by numeric index if present
     if not ss_keys:
@@ -56,6 +57,10 @@ def plot_all_segments(db, fi_substring, ss_keys=False, figsize=(10, 6), cmap_nam
                 ax.plot(t[:n], y[:n], label=label, color=color)
             else:
                 ax.plot(t, y, label=label, color=color)
+            if band and f'{key}_lo' in seg and f'{key}_hi' in seg:
+                lo, hi = np.asarray(seg[f'{key}_lo']), np.asarray(seg[f'{key}_hi'])
+                n = min(t.size, lo.size, hi.size)
+                ax.fill_between(t[:n], lo[:n], hi[:n], color=color, alpha=0.25, linewidth=0)
             any_plotted = True
 
     ax.set_xlabel('time')
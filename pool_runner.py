@@ -0,0 +1,132 @@
+"""
+Process-pool sweep runner for jobs that cannot be vectorized
+- Spreads init_and_run style jobs over a concurrent.futures process pool
+- model_params and base settings are sent once per worker, not per job
+- Every worker builds its model once per structure and reuses it across jobs
+- Results stream back to the parent as each job finishes
+
+A job is a dict of settings overrides, e.g. {'input_signal': {'frequency': 0.4}}.
+Jobs run through main.run_and_save, the same dispatch as init_and_run, so every settings section applies
+(periodic mode, probes, metrics, decompose, columnar output, checkpoints, cache, profiling).
+Only run settings (see model_cache.RUN_SECTIONS) may differ between jobs that share a model; other
+changes (debugger, initial conditions) make the worker build a new one.
+With an enabled 'model_cache' section, state-space workers load the compiled model from disk.
+With an enabled 'checkpoint' section every job writes its final checkpoint next to its output, so
+"resume": "auto" in the base settings lets a rerun of an interrupted sweep continue where each job stopped.
+"""
+
+import copy
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import bdsim
+
+from filer import claim_output_name
+from main import model_built, run_and_save
+
+# Per-worker state, filled by _init_worker
+_BASE_SETTINGS = None
+_MODEL_PARAMS = None
+_SIM = None
+
+
+def merge_settings(settings, overrides):
+    """
+    Return a deep copy of settings with nested overrides applied.
+    """
+    merged = copy.deepcopy(settings)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_settings(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def _init_worker(settings, model_params):
+    """
+    Store the shared read-only data once per worker process.
+    """
+    global _BASE_SETTINGS, _MODEL_PARAMS, _SIM
+    _BASE_SETTINGS = settings
+    _MODEL_PARAMS = model_params
+    _SIM = None
+
+
+def _run_job(job_id, overrides):
+    """
+    Run one job in a worker through main.run_and_save, so jobs honor every option of a direct run and reuse
+    the worker's previously built model when the structure matches.
+    """
+    global _SIM
+    settings = merge_settings(_BASE_SETTINGS, overrides)
+    if _SIM is None:
+        _SIM = bdsim.BDSim(banner=False, graphics=False, progress=False,
+                           quiet=settings['simulation'].get('quiet', False))
+    reused = model_built(settings, _MODEL_PARAMS, _SIM)
+
+    t0 = time.perf_counter()
+    out, out_path = run_and_save(settings, _MODEL_PARAMS, _SIM)
+    elapsed = time.perf_counter() - t0
+    return {
+        'job_id': job_id,
+        'overrides': overrides,
+        'engine': settings['simulation'].get('engine', 'bdsim'),
+        'output': out_path,
+        'wall_time': elapsed,
+        'model_reused': reused,
+        'worker_pid': os.getpid(),
+        'out': out,
+    }
+
+
+def iter_pool(jobs, settings, model_params, max_workers=None):
+    """
+    Run jobs on a process pool and yield each result as soon as it finishes.
+    Args:
+        jobs (list): Settings overrides, one dict per job.
+        settings (dict): Base settings shared by all jobs.
+        model_params (dict): Model parameters, parsed once and shared with the workers.
+        max_workers (int, optional): Number of worker processes.
+    Yields:
+        result (dict): Job id, overrides, output path, timing and the output object under 'out'.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(settings, model_params)) as pool:
+        futures = {pool.submit(_run_job, job_id, overrides): job_id for job_id, overrides in enumerate(jobs)}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as err:
+                yield {'job_id': futures[future], 'overrides': jobs[futures[future]], 'error': repr(err)}
+
+
+def run_pool(jobs, settings, model_params, max_workers=None, output_dir='Output'):
+    """
+    Run all jobs on a process pool and write one summary of all jobs.
+    Args:
+        jobs (list): Settings overrides, one dict per job.
+        settings (dict): Base settings shared by all jobs.
+        model_params (dict): Model parameters.
+        max_workers (int, optional): Number of worker processes.
+        output_dir (str): Directory for the summary file.
+    Returns:
+        results (list): Results ordered by job id.
+        summary_path (str): Path of the 'pool_summary_XXX.json' file.
+    """
+    results = []
+    for result in iter_pool(jobs, settings, model_params, max_workers):
+        status = f"failed: {result['error']}" if 'error' in result else f"done in {result['wall_time']:.2f} s"
+        print(f"Job {result['job_id']} {status}")
+        results.append(result)
+    results.sort(key=lambda r: r['job_id'])
+
+    _, summary_path = claim_output_name('pool_summary', ext='.json', output_dir=output_dir)
+    summary = [{k: v for k, v in result.items() if k != 'out'} for result in results]
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump({'n_jobs': len(jobs), 'jobs': summary}, f, indent=4)
+
+    print(f"Pool of {len(jobs)} jobs complete, summary saved to '{summary_path}'.")
+    return results, summary_path
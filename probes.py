@@ -0,0 +1,261 @@
+"""
+Decimated signal probes
+- A list of (segment, signal) pairs instead of debugger OUTPORTs and WATCH blocks
+- Per probe a recording period (decimation of time_step, or a rate in Hz) and an optional time window
+- Values go into preallocated ring buffers, so memory is set by the probe specification, not by
+  the simulation length; signals that are not probed are never computed
+
+The state-space engine integrates window by window (state_space.integrate_windows) and only the probed
+samples are kept. With the bdsim engine the probes are read from the integrator states of the run.
+Either way the run returns a ProbeOutput, which is always saved as a pickle. With an enabled
+'metrics' section the per-cycle metrics are reduced in the same pass and kept as out.metrics.
+
+Settings (optional 'probes' section), entries are [segment, signal] or dicts with per-probe options:
+    "probes": {
+        "enabled": true,
+        "signals": [[13, "-Po"], [1, "Pi"], {"segment": 7, "signal": "Fi", "rate": 50}],
+        "decimation": 5,          # every 5th time_step, or "rate": 25 (Hz)
+        "cycles": 2               # last 2 input periods only, or "window": 1.5 (s)
+    }
+"""
+
+import math
+import re
+
+import numpy as np
+
+from checkpoint import checkpoint_writer
+from metrics import cycle_reducer
+from state_space import DEBUG_PORTS, StateSpaceModel, integrate_windows, state_names
+from store import CHUNK_SIZE, chunk_size
+
+PROBE_DEFAULTS = {'enabled': False, 'signals': [], 'decimation': 1, 'rate': None, 'window': None, 'cycles': None}
+PROBE_SIGNALS = DEBUG_PORTS + ['Fi', 'Po']
+
+
+def probe_specs(settings):
+    """
+    Normalized probe specifications of settings['probes'], or None if probes are disabled.
+    Returns:
+        specs (list): Dicts with segment, signal, period (s) and start (s, first recorded time).
+    """
+    options = {**PROBE_DEFAULTS, **settings.get('probes', {})}
+    if not options['enabled']:
+        return None
+
+    dt = settings['simulation']['time_step']
+    T = settings['simulation']['simulation_time']
+    specs = []
+    for entry in options['signals']:
+        if isinstance(entry, dict):
+            probe = {**options, **entry}
+        else:
+            segment, signal = entry
+            probe = {**options, 'segment': segment, 'signal': signal}
+        if probe['signal'] not in PROBE_SIGNALS:
+            raise ValueError(f"Unknown probe signal: {probe['signal']}, available options: {PROBE_SIGNALS}")
+
+        period = 1.0 / probe['rate'] if probe['rate'] else probe['decimation'] * dt
+        window = probe['window']
+        if probe['cycles'] is not None:
+            window = probe['cycles'] / settings['input_signal']['frequency']
+        specs.append({'segment': probe['segment'], 'signal': probe['signal'], 'period': max(period, dt),
+                      'start': 0.0 if window is None else max(T - window, 0.0)})
+    return specs
+
+
+def probe_signal(model, t, x, segment, signal):
+    """
+    One of PROBE_SIGNALS of a segment from states x of shape (n_states, len(t)).
+    """
+    match signal:
+        case 'Fi':
+            return -model.signals(t, x, segment, '-Fi')
+        case 'Po':
+            return -model.signals(t, x, segment, '-Po')
+        case _:
+            return model.signals(t, x, segment, signal)
+
+
+class RingBuffer():
+    """
+    Fixed-capacity buffer of (t, value) samples; when full, the oldest samples are overwritten
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.t = np.empty(capacity)
+        self.values = np.empty(capacity)
+        self.count = 0
+
+    def extend(self, t, values):
+        n = len(t)
+        if n >= self.capacity:
+            t, values = t[-self.capacity:], values[-self.capacity:]
+            self.count += n - self.capacity
+            n = self.capacity
+        start = self.count % self.capacity
+        first = min(n, self.capacity - start)
+        self.t[start:start + first] = t[:first]
+        self.values[start:start + first] = values[:first]
+        self.t[:n - first] = t[first:]
+        self.values[:n - first] = values[first:]
+        self.count += n
+
+    def arrays(self):
+        """
+        Recorded samples in time order, as copies.
+        """
+        if self.count <= self.capacity:
+            return self.t[:self.count].copy(), self.values[:self.count].copy()
+        k = self.count % self.capacity
+        return np.roll(self.t, -k), np.roll(self.values, -k)
+
+
+class ProbeSet():
+    """
+    Probes of one run: sample selection, signal evaluation and buffers
+    """
+    def __init__(self, model, specs, simulation_time):
+        self.model = model
+        self.specs = specs
+        self.buffers = []
+        self.last_bin = np.full(len(specs), -1, dtype=np.int64)
+        self.n_steps = 0
+        for spec in specs:
+            if spec['segment'] not in model.position:
+                raise ValueError(f"Probe on unknown segment {spec['segment']}.")
+            samples = math.ceil((simulation_time - spec['start']) / spec['period']) + 1
+            self.buffers.append(RingBuffer(max(samples, 1)))
+
+    def record(self, t, states):
+        """
+        Record the probed samples of a chunk of output steps.
+        Args:
+            t (np.ndarray): Increasing times of the chunk.
+            states (np.ndarray): State-space states at t, shape (len(t), n_states).
+        """
+        self.n_steps += len(t)
+        for i, spec in enumerate(self.specs):
+            # First output step in every recording period after the start of the window
+            bins = np.floor(t / spec['period'] + 1e-9).astype(np.int64)
+            new = np.flatnonzero((np.diff(bins, prepend=self.last_bin[i]) > 0) & (t >= spec['start'] - 1e-12))
+            if new.size == 0:
+                continue
+            self.last_bin[i] = bins[new[-1]]
+            self.buffers[i].extend(t[new], probe_signal(self.model, t[new], states[new].T,
+                                                        spec['segment'], spec['signal']))
+
+    def output(self, t_end, x_end):
+        return ProbeOutput({(spec['segment'], spec['signal']): buffer.arrays()
+                            for spec, buffer in zip(self.specs, self.buffers)}, self.specs, t_end, x_end,
+                           self.n_steps)
+
+
+class ProbeOutput():
+    """
+    Probed signals of a run, probes[(segment, signal)] = (t, values), and the final state
+    """
+    def __init__(self, probes, specs, t_end, x_end, n_steps):
+        self.probes = probes
+        self.specs = specs
+        self.t_end = t_end
+        self.x_end = x_end
+        self.n_steps = n_steps   # output steps of the run, most of them not recorded
+        self.metrics = None      # metrics.MetricsTable if metrics were enabled
+
+    def signal(self, segment, signal):
+        """
+        (t, values) of one probe, e.g. signal(13, '-Po').
+        """
+        return self.probes[(segment, signal)]
+
+    def db(self):
+        """
+        Probes in the layout of the debugger DB, {'SS<i>': {signal: (t, values)}}.
+        """
+        db = {}
+        for (segment, signal), record in self.probes.items():
+            db.setdefault(f'SS{segment}', {})[signal] = record
+        return db
+
+    def __repr__(self):
+        samples = sum(len(t) for t, _ in self.probes.values())
+        return f"ProbeOutput: {len(self.probes)} probes, {samples} samples, t_end = {self.t_end:g} s"
+
+
+def run_probed(settings, model_params, model=None):
+    """
+    Integrate the state-space model window by window and keep only the probed samples.
+    Returns:
+        out (ProbeOutput): Probed signals and the final state.
+    """
+    if model is None:
+        model = StateSpaceModel(model_params, settings)
+    probes = ProbeSet(model, probe_specs(settings), settings['simulation']['simulation_time'])
+    reducer = cycle_reducer(settings, model)
+    checkpoints = checkpoint_writer(settings, model)
+    t_end, x_end = 0.0, model.x0
+    for t, states in integrate_windows(settings, model, chunk_size(settings)):
+        probes.record(t, states)
+        if reducer is not None:
+            reducer.record(t, states)
+        if checkpoints is not None:
+            checkpoints.record(t, states)
+        t_end, x_end = t[-1], states[-1]
+
+    out = probes.output(float(t_end), np.array(x_end))
+    if reducer is not None:
+        out.metrics = reducer.table()
+    if checkpoints is not None:
+        out.checkpoint = checkpoints.checkpoint()
+    print(f"Probed state-space simulation of {model.n} segments finished: {out}.")
+    return out
+
+
+def bdsim_states(out, model):
+    """
+    Integrator states of a bdsim output in the state-space layout (Fi of every segment, then Po).
+    The bdsim states are ∫ of the flow and pressure equations, i.e. L·Fi and C·Po.
+    Raises a ValueError unless every Fi and Po state of the network is found in out.xnames.
+    """
+    states = np.empty((len(out.t), model.n_states))
+    found = np.zeros(model.n_states, dtype=bool)
+    pattern = re.compile(r'subsystem\.(\d+)/(Fi|Po)x0$')
+    for column, name in enumerate(out.xnames):
+        match = pattern.search(name)
+        if match is None:
+            continue
+        k = int(match.group(1))
+        if k >= model.n:
+            raise ValueError(f"bdsim state {name} has no segment in the state-space model of {model.n} segments.")
+        if match.group(2) == 'Fi':
+            states[:, k] = out.x[:, column] / model.l[k]
+            found[k] = True
+        else:
+            states[:, model.n + k] = out.x[:, column] / model.c[k]
+            found[model.n + k] = True
+    if not found.all():
+        missing = [name for name, present in zip(state_names(model), found) if not present]
+        raise ValueError(f"bdsim output lacks {len(missing)} of the {model.n_states} network states: {missing}")
+    return states
+
+
+def probe_bdsim(out, settings, model_params, model=None):
+    """
+    Probed signals of a finished bdsim run, read from its integrator states.
+    Returns:
+        out (ProbeOutput): Probed signals and the final state.
+    """
+    if model is None:
+        model = StateSpaceModel(model_params, settings)
+    probes = ProbeSet(model, probe_specs(settings), settings['simulation']['simulation_time'])
+    reducer = cycle_reducer(settings, model)
+    states = bdsim_states(out, model)
+    for k in range(0, len(out.t), CHUNK_SIZE):
+        probes.record(out.t[k:k + CHUNK_SIZE], states[k:k + CHUNK_SIZE])
+        if reducer is not None:
+            reducer.record(out.t[k:k + CHUNK_SIZE], states[k:k + CHUNK_SIZE])
+    probed = probes.output(float(out.t[-1]), states[-1])
+    if reducer is not None:
+        probed.metrics = reducer.table()
+    return probed
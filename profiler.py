@@ -0,0 +1,251 @@
+"""
+Opt-in run profiling
+- Wall time, CPU time and peak traced memory per phase of init_and_run (build, compile, run, save, debug DB)
+- Per output step: number of steps, model evaluations and time per step
+- bdsim engine: call counts and cumulative time per block type (GAIN, SUM, INTEGRATOR, CLIP, FUNCTION, ...)
+- Report written as JSON next to the run output and available as last_report()
+
+Phases are timed with phase(name) anywhere in the code; it does nothing unless a profiler is active.
+Nested phases are reported as 'outer/inner'. Block timing wraps the output and deriv methods of every
+block for the duration of the run, which slows bdsim down noticeably, so it can be switched off.
+
+Settings (optional 'profile' section):
+    "profile": {"enabled": true, "memory": true, "blocks": true}
+"""
+
+import contextlib
+import json
+import os
+import time
+import tracemalloc
+from collections import defaultdict
+
+PROFILE_DEFAULTS = {'enabled': False, 'memory': True, 'blocks': True}
+
+# Profiler of the outermost profiling() context, see phase()
+_ACTIVE = None
+_LAST_REPORT = None
+
+
+class Profiler():
+    """
+    Collects phase timings, step statistics and per-block-type timings of one run
+    """
+    def __init__(self, memory=True, blocks=True):
+        self.memory = memory
+        self.blocks = blocks
+        self.phases = {}
+        self.block_stats = defaultdict(lambda: {'blocks': 0, 'calls': 0, 'time': 0.0})
+        self.steps = {}
+        self.run_path = None
+        self.peak = 0
+        self._stack = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Time a block of code as phase name; repeated phases are accumulated.
+        """
+        name = '/'.join([frame['name'] for frame in self._stack] + [name])
+        frame = {'name': name.rsplit('/', 1)[-1], 'peak': 0}
+        if self.memory and tracemalloc.is_tracing():
+            # keep the peak of the enclosing phases before it is reset for this one
+            self._propagate_peak(tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._stack.append(frame)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            self._stack.pop()
+            if self.memory and tracemalloc.is_tracing():
+                frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                self._propagate_peak(frame['peak'])
+            entry = self.phases.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_memory_mb': None})
+            entry['calls'] += 1
+            entry['wall'] += wall
+            entry['cpu'] += cpu
+            if self.memory and tracemalloc.is_tracing():
+                entry['peak_memory_mb'] = max(entry['peak_memory_mb'] or 0.0, frame['peak'] / 2**20)
+
+    def _propagate_peak(self, peak):
+        self.peak = max(self.peak, peak)
+        for frame in self._stack:
+            frame['peak'] = max(frame['peak'], peak)
+
+    @contextlib.contextmanager
+    def instrument(self, targets):
+        """
+        Count calls and time of methods while the context is open.
+        Args:
+            targets (list): (label, obj, method names) triples; the methods are wrapped on the instance
+                            and restored afterwards.
+        """
+        wrapped = []
+        for label, obj, methods in targets:
+            stats = self.block_stats[label]
+            stats['blocks'] += 1
+            for method in methods:
+                if hasattr(obj, method):
+                    wrapped.append((obj, method, obj.__dict__.get(method)))
+                    setattr(obj, method, timed(getattr(obj, method), stats))
+        try:
+            yield
+        finally:
+            for obj, method, original in wrapped:
+                if original is None:
+                    delattr(obj, method)   # back to the class method
+                else:
+                    setattr(obj, method, original)
+
+    def record_steps(self, n_steps, evaluations, wall, cpu):
+        """
+        Per output step statistics of the run phase.
+        """
+        n = max(n_steps, 1)
+        self.steps = {
+            'n_steps': n_steps,
+            'evaluations': evaluations,
+            'evaluations_per_step': None if evaluations is None else evaluations / n,
+            'wall_per_step_ms': 1e3 * wall / n,
+            'cpu_per_step_ms': 1e3 * cpu / n,
+        }
+
+    def report(self):
+        """
+        Profile as a JSON-serializable dict, phases in the order they were first entered.
+        """
+        return {
+            'phases': self.phases,
+            'steps': self.steps,
+            'blocks': {label: {**stats, 'time_per_call_us': 1e6 * stats['time'] / max(stats['calls'], 1)}
+                       for label, stats in sorted(self.block_stats.items(),
+                                                  key=lambda item: -item[1]['time'])},
+            'run_path': self.run_path,
+        }
+
+    def __repr__(self):
+        lines = ["Profile:"]
+        for name, entry in self.phases.items():
+            memory = '' if entry['peak_memory_mb'] is None else f", peak {entry['peak_memory_mb']:.1f} MB"
+            lines.append(f"  {name:<24} wall {entry['wall']:8.3f} s, cpu {entry['cpu']:8.3f} s{memory}")
+        for label, stats in self.report()['blocks'].items():
+            lines.append(f"  {label:<24} {stats['calls']:>10} calls, {stats['time']:8.3f} s")
+        return '\n'.join(lines)
+
+
+def timed(method, stats):
+    """
+    Wrap a bound method to add its call count and duration to stats.
+    """
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            stats['calls'] += 1
+            stats['time'] += time.perf_counter() - t0
+    return wrapper
+
+
+def active():
+    """
+    The active Profiler, or None when profiling is off.
+    """
+    return _ACTIVE
+
+
+def phase(name):
+    """
+    Time a block of code in the active profiler, a no-op without one.
+    """
+    return _ACTIVE.phase(name) if _ACTIVE is not None else contextlib.nullcontext()
+
+
+def instrument_model(model):
+    """
+    Call counts and timing of the model while the context is open: per block type of a compiled bdsim
+    diagram, or of the RHS and output signals of a StateSpaceModel.
+    """
+    if _ACTIVE is None or not _ACTIVE.blocks:
+        return contextlib.nullcontext()
+    if hasattr(model, 'blocklist'):
+        return _ACTIVE.instrument([(block.type.upper(), block, ('output', 'deriv')) for block in model.blocklist])
+    return _ACTIVE.instrument([('RHS', model, ('rhs',)), ('SIGNALS', model, ('signals',))])
+
+
+def record_steps(out, evaluations=None):
+    """
+    Per output step statistics of the finished 'run' phase in the active profiler.
+    Args:
+        out: Simulation output with a time vector t, or a ProbeOutput.
+        evaluations (int, optional): Model evaluations of the run, counted RHS calls if not given.
+    """
+    if _ACTIVE is None or 'run' not in _ACTIVE.phases:
+        return
+    if evaluations is None and 'RHS' in _ACTIVE.block_stats:
+        evaluations = _ACTIVE.block_stats['RHS']['calls']
+    run = _ACTIVE.phases['run']
+    n_steps = len(out.t) if hasattr(out, 't') else out.n_steps   # probes.ProbeOutput keeps no time vector
+    _ACTIVE.record_steps(n_steps, evaluations, run['wall'], run['cpu'])
+
+
+def report_path(run_path, output_dir='Output'):
+    """
+    Path of the profile report next to a saved run, or a new 'profile_XXX.json' for an unsaved run.
+    """
+    if run_path is None:
+        from filer import claim_output_name
+        return claim_output_name('profile', ext='.json', output_dir=output_dir)[1]
+    if os.path.isdir(run_path):
+        return os.path.join(run_path, 'profile.json')
+    folder, name = os.path.split(run_path)
+    return os.path.join(folder, f'profile_{os.path.splitext(name)[0]}.json')
+
+
+@contextlib.contextmanager
+def profiling(settings, output_dir='Output'):
+    """
+    Profile the enclosed code if settings['profile']['enabled'].
+    Only the outermost context collects and writes a report, so init_and_run can be profiled on its own
+    or together with the code around it (e.g. build_debug_db in main).
+    Yields the active Profiler, or None when profiling is off.
+    """
+    global _ACTIVE, _LAST_REPORT
+    options = {**PROFILE_DEFAULTS, **settings.get('profile', {})}
+    if not options['enabled'] or _ACTIVE is not None:
+        yield _ACTIVE
+        return
+
+    _ACTIVE = Profiler(options['memory'], options['blocks'])
+    started = options['memory'] and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield _ACTIVE
+    finally:
+        profiler, _ACTIVE = _ACTIVE, None
+        peak = None
+        if profiler.memory and tracemalloc.is_tracing():
+            peak = max(profiler.peak, tracemalloc.get_traced_memory()[1]) / 2**20
+        profiler.phases['total'] = {'calls': 1, 'wall': time.perf_counter() - wall,
+                                    'cpu': time.process_time() - cpu, 'peak_memory_mb': peak}
+        if started:
+            tracemalloc.stop()
+
+    _LAST_REPORT = profiler.report()
+    path = report_path(profiler.run_path, output_dir)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(_LAST_REPORT, f, indent=4)
+    if not settings['simulation'].get('quiet', False):
+        print(profiler)
+    print(f"Profile saved to '{path}'.")
+
+
+def last_report():
+    """
+    Report of the most recently finished profiling() context, or None.
+    """
+    return _LAST_REPORT
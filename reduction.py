@@ -0,0 +1,443 @@
+"""
+Model order reduction of the state-space network into a fast surrogate
+- Outputs: Pi/Po/Fi/Fo of chosen segments, by default Po and Fi of debugger.debug_for_index
+- Balanced truncation (square-root method) with the Hankel singular values, or moment matching (Krylov
+  projection at real expansion points)
+- The order is chosen from the observed error: the smallest order whose surrogate run stays within tolerance of
+  the full model on the settings' time grid
+- An a posteriori error per output over the harmonics of the input up to the Nyquist frequency of time_step
+- The surrogate runs on the exact discretization of discrete.py, single, over a list of input signals (e.g.
+  Monte Carlo draws of the inflow) or over a sweep grid of input_signal coordinates; check_reduced compares it
+  with the full model on the same grid and input hold
+
+The aortic valve is kept exact: Fi1 stays an unreduced state and only max(Fi1, 0) drives the rest of the
+network, whose 2N - 1 states form the linear system that is reduced. Its outputs are the chosen signals and
+the pressure feedback into the Fi1 equation (Po1), each scaled by its H2 norm so that pressures and flows weigh
+the same. No a priori bound is reported: the balanced-truncation bound 2·Σ σ_i covers only that open-loop
+network, not the Po1 feedback through the clipped valve, and is far below the output error. The harmonic error
+is that of the whole surrogate with the valve open, driven by the input pressure. The network is lightly damped,
+so the valve closure rings through the tree and the a posteriori time-domain error against a full run (the
+order search and check_reduced) is the only error measure of the surrogate outputs.
+
+Moment matching projects in the energy inner product ½·Σ(L·Fi² + C·Po²), which keeps the reduced network
+passive and therefore stable with the valve in the loop.
+
+Settings (optional 'reduction' section):
+    "reduction": {"method": "balanced", "order": null, "tolerance": 1e-3, "signals": ["Po", "Fi"],
+                  "segments": null, "expansion_points": [0.0]}
+order null picks the smallest order whose largest time-domain error relative to the peak of each full output is
+below tolerance (see select_order), at the cost of one full run plus one surrogate run per tried order; the
+search starts at the order whose Hankel tail 2·Σ σ_i relative to the largest Hankel singular value is below
+tolerance (balanced truncation) or at one state per expansion point (moment matching). The Gramians are dense,
+which suits networks up to a few thousand states. A lightly damped network keeps most of its states: the
+surrogate of the default network is barely cheaper than the full model, larger trees gain more.
+"""
+
+import itertools
+import time
+
+import numpy as np
+import scipy.linalg as la
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+from discrete import HOLDS, DiscreteModel
+from inflow import inflow_pressure
+from state_space import StateSpaceModel, time_grid
+from sweep import INPUT_KEYS, parse_coordinate
+
+REDUCTION_DEFAULTS = {'method': 'balanced', 'order': None, 'tolerance': 1e-3, 'signals': ['Po', 'Fi'],
+                      'segments': None, 'expansion_points': [0.0]}
+REDUCTION_METHODS = ('balanced', 'krylov')
+REDUCTION_SIGNALS = ('Pi', 'Po', 'Fi', 'Fo')
+
+
+def output_matrix(model, outputs):
+    """
+    Output rows y = C·clip(x) + d·u of (segment, signal) pairs, C of shape (len(outputs), n_states).
+    """
+    n = model.n
+    C, d = np.zeros((len(outputs), model.n_states)), np.zeros(len(outputs))
+    for i, (segment, signal) in enumerate(outputs):
+        if segment not in model.position:
+            raise ValueError(f"Output of unknown segment {segment}.")
+        k = model.position[segment]
+        match signal:
+            case 'Po':
+                C[i, n + k] = 1.0
+            case 'Fi':
+                C[i, k] = 1.0
+            case 'Pi':
+                if k == model.root:
+                    d[i] = 1.0
+                else:
+                    C[i, n + model.parent[k]] = 1.0
+            case 'Fo':
+                C[i, np.flatnonzero(model.parent == k)] = 1.0
+            case _:
+                raise ValueError(f"Unknown output signal: {signal}, available options: {list(REDUCTION_SIGNALS)}")
+    return C, d
+
+
+def gramian_factor(W):
+    """
+    L with L·Lᵀ = W for a symmetric positive semidefinite Gramian.
+    """
+    w, V = la.eigh((W + W.T) / 2.0)
+    return V * np.sqrt(np.maximum(w, 0.0))
+
+
+def balanced_truncation(A, B, C):
+    """
+    Square-root balancing of a stable system (A, B, C), truncated to order r by T[:, :r] and Ti[:r].
+    Returns:
+        T, Ti (np.ndarray): Projection x ≈ T·z and z = Ti·x, Ti·T = I, over the nonzero Hankel singular values.
+        hsv (np.ndarray): Hankel singular values.
+    """
+    Lc = gramian_factor(la.solve_continuous_lyapunov(A, -B @ B.T))
+    Lo = gramian_factor(la.solve_continuous_lyapunov(A.T, -C.T @ C))
+    U, hsv, Vt = la.svd(Lo.T @ Lc)
+    rank = max(int(np.sum(hsv > hsv[0] * 1e-14)), 1)
+    s = 1.0 / np.sqrt(hsv[:rank])
+    return Lc @ Vt[:rank].T * s, (U[:, :rank] * s).T @ Lo.T, hsv
+
+
+def hankel_order(hsv, tolerance):
+    """
+    Fewest states whose Hankel tail 2·Σ σ_i over the truncated states is below tolerance·σ_1, where the order
+    search starts.
+    """
+    tail = 2.0 * np.append(np.cumsum(hsv[::-1])[::-1], 0.0)   # tail[r]: bound when keeping r states
+    return max(int(np.argmax(tail <= tolerance * hsv[0])), 1)
+
+
+def krylov_basis(A, b, order, points, M):
+    """
+    Basis of the Krylov spaces of (s0·I - A)⁻¹·b at the expansion points, order vectors in total,
+    orthonormal in the inner product of the diagonal M (Vᵀ·M·V = I).
+    """
+    vectors = []
+    for j, s0 in enumerate(points):
+        lu = la.lu_factor(s0 * np.eye(A.shape[0]) - A)
+        v = b
+        for _ in range(order // len(points) + (j < order % len(points))):
+            v = la.lu_solve(lu, v)
+            vectors.append(v)
+    V, _ = la.qr(np.array(vectors).T, mode='economic')
+    R = la.cholesky((V.T * M) @ V)
+    return la.solve_triangular(R, V.T, trans='T').T
+
+
+class ReducedModel():
+    """
+    Surrogate network with the state [Fi1, z]: Fi1 exact, the rest z' = Ar·z + br·max(Fi1, 0).
+    Has the A, B, valve and n_states of a StateSpaceModel, so DiscreteModel steps it like the full model.
+    Outputs y = C·clip(x) + d·u, in the order of outputs.
+    """
+    def __init__(self, model, outputs, Ar, br, Cr, feedback, z0, C_valve, d, options, hsv=None):
+        self.n_full = model.n_states
+        self.outputs = outputs
+        self.options = options
+        self.method = options['method']
+        self.order = Ar.shape[0]
+        self.n_states = 1 + self.order
+        self.valve = 0
+
+        A = np.zeros((self.n_states, self.n_states))
+        A[0, 0] = model.A[model.valve, model.valve]   # -Rs1/L1
+        A[0, 1:] = feedback                           # -Po1/L1
+        A[1:, 0], A[1:, 1:] = br, Ar
+        self.A = sp.csr_matrix(A)
+        self.B = np.zeros(self.n_states)
+        self.B[0] = model.B[model.valve]
+        self.C = np.column_stack([C_valve, Cr])
+        self.d = d
+        self.x0 = np.concatenate([[model.x0[model.valve]], z0])
+
+        self.hsv = hsv
+        self.error = None            # a posteriori over the input harmonics, valve open, per output
+        self.observed_error = None   # time-domain error relative to the full peak, set by the order search
+
+    def output(self, states, u):
+        """
+        Outputs at states of shape (..., n_states) and input pressures u, shape (..., len(outputs)).
+        """
+        x = np.array(states, dtype=float, copy=True)
+        x[..., self.valve] = np.maximum(x[..., self.valve], 0.0)
+        return x @ self.C.T + np.asarray(u)[..., None] * self.d
+
+    def __repr__(self):
+        observed = '' if self.observed_error is None else f", time-domain error {np.max(self.observed_error):.3g}"
+        return (f"ReducedModel ({self.method}): {self.n_full} -> {self.n_states} states, "
+                f"{len(self.outputs)} outputs{observed}")
+
+
+def reduction_outputs(settings, options):
+    """
+    (segment, signal) outputs of the reduction: the segments (default debug_for_index) times the signals.
+    """
+    segments = options['segments']
+    if segments is None:
+        segments = settings['debugger']['debug_for_index']
+    return [(segment, signal) for segment in segments for signal in options['signals']]
+
+
+def harmonic_error(model, reduced, settings):
+    """
+    Largest |G(jω) - Gr(jω)| per output from the input pressure with the valve open, over the harmonics of the
+    input frequency up to the Nyquist frequency of time_step (and DC).
+    """
+    C, d = output_matrix(model, reduced.outputs)
+    frequency = settings['input_signal']['frequency']
+    n_harmonics = max(int(0.5 / (settings['simulation']['time_step'] * frequency)), 1)
+    A, Ar = model.A.tocsc(), reduced.A.toarray()
+    I, Ir = sp.identity(model.n_states, format='csc'), np.eye(reduced.n_states)
+    error = np.zeros(len(reduced.outputs))
+    for f in frequency * np.arange(n_harmonics + 1):
+        s = 2j * np.pi * f
+        g = C @ spla.spsolve(s * I - A, model.B.astype(complex))
+        gr = reduced.C @ np.linalg.solve(s * Ir - Ar, reduced.B)
+        error = np.maximum(error, np.abs(g - gr))
+    return error
+
+
+def full_outputs(model, outputs, settings):
+    """
+    Outputs of the full model on the exact discretization the surrogate runs on.
+    Returns:
+        y (np.ndarray): Outputs of shape (len(t), len(outputs)).
+        run_time (float): Run time without the discretization.
+    """
+    t = time_grid(settings)
+    u = inflow_pressure(t, settings['input_signal'])
+    C, d = output_matrix(model, outputs)
+    full = DiscreteModel(model, settings['simulation']['time_step'], surrogate_hold(settings))
+    wall = time.perf_counter()
+    x = full.run(model.x0, u)
+    run_time = time.perf_counter() - wall
+    return (C @ model.clip(x.T)).T + np.outer(u, d), run_time
+
+
+def output_error(reduced, settings, y_full, discrete=None):
+    """
+    Largest time-domain error of the surrogate per output, relative to the peak of the full output y_full.
+    """
+    out = run_reduced(settings, reduced, discrete=discrete)
+    error = np.array([np.abs(out.signal(*output) - y_full[:, i]).max() for i, output in enumerate(reduced.outputs)])
+    return error / np.maximum(np.abs(y_full).max(axis=0), 1e-300)
+
+
+def select_order(surrogate, error, start, max_order, tolerance):
+    """
+    Surrogate of an order from start whose largest error is below tolerance, found by doubling steps and
+    bisection, or of max_order if none is. The order is the smallest one when the error falls with the order;
+    on a lightly damped network it need not, and a smaller order may pass as well.
+    Args:
+        surrogate (callable): ReducedModel of a given order.
+        error (callable): Error per output of a ReducedModel.
+    """
+    tried = {}
+
+    def passes(order):
+        if order not in tried:
+            tried[order] = surrogate(order)
+            tried[order].observed_error = error(tried[order])
+        return np.max(tried[order].observed_error) <= tolerance
+
+    low, order, step = start - 1, min(start, max_order), 1   # low: largest order known to fail
+    while order < max_order and not passes(order):
+        low, order, step = order, min(order + step, max_order), 2 * step
+    if not passes(order):
+        return tried[order]
+    while order - low > 1:
+        middle = (low + order) // 2
+        if passes(middle):
+            order = middle
+        else:
+            low = middle
+    return tried[order]
+
+
+def reduce_model(settings, model_params, model=None, **options):
+    """
+    Reduce the network to a low-order surrogate of the chosen outputs.
+    Args:
+        settings (dict): Simulation settings with an optional 'reduction' section.
+        model_params (dict): Model parameters.
+        model (StateSpaceModel, optional): Previously compiled model to reuse.
+        **options: Overrides of the 'reduction' section.
+    Returns:
+        reduced (ReducedModel): Surrogate with its Hankel singular values and errors.
+    """
+    options = {**REDUCTION_DEFAULTS, **settings.get('reduction', {}), **options}
+    if options['method'] not in REDUCTION_METHODS:
+        raise ValueError(f"Unknown reduction method: {options['method']}, "
+                         f"available options: {list(REDUCTION_METHODS)}")
+    for signal in options['signals']:
+        if signal not in REDUCTION_SIGNALS:
+            raise ValueError(f"Unknown output signal: {signal}, available options: {list(REDUCTION_SIGNALS)}")
+    if model is None:
+        model = StateSpaceModel(model_params, settings)
+    outputs = reduction_outputs(settings, options)
+    C_full, d = output_matrix(model, outputs)
+
+    # Linear part: every state but Fi1, driven by the clipped valve flow
+    A = model.A.toarray()
+    rest = np.flatnonzero(np.arange(model.n_states) != model.valve)
+    A_rest, b = A[np.ix_(rest, rest)], A[rest, model.valve][:, None]
+    C = np.vstack([A[model.valve, rest], C_full[:, rest]])   # Fi1 feedback first, then the outputs
+
+    if options['method'] == 'balanced':
+        # Scale every output by its H2 norm, so pressures and flows weigh the same
+        Wc = la.solve_continuous_lyapunov(A_rest, -b @ b.T)
+        h2 = np.sqrt(np.maximum(np.einsum('ij,jk,ik->i', C, Wc, C), 0.0))
+        weight = 1.0 / np.where(h2 > 0.0, h2, 1.0)
+        T_all, Ti_all, hsv = balanced_truncation(A_rest, b, C * weight[:, None])
+        start, max_order = hankel_order(hsv, options['tolerance']), T_all.shape[1]
+
+        def projection(order):
+            return T_all[:, :order], Ti_all[:order]
+    else:
+        points = options['expansion_points']
+        M = np.concatenate([model.l, model.c])[rest]
+        hsv, start, max_order = None, len(points), A_rest.shape[0]
+
+        def projection(order):
+            T = krylov_basis(A_rest, b[:, 0], order, points, M)
+            return T, T.T * M
+
+    def surrogate(order):
+        T, Ti = projection(order)
+        Cr = C @ T
+        return ReducedModel(model, outputs, Ti @ A_rest @ T, Ti @ b[:, 0], Cr[1:], Cr[0], Ti @ model.x0[rest],
+                            C_full[:, model.valve], d, options, hsv)
+
+    if options['order'] is None:
+        y_full, _ = full_outputs(model, outputs, settings)
+        reduced = select_order(surrogate, lambda r: output_error(r, settings, y_full), start, max_order,
+                               options['tolerance'])
+        if np.max(reduced.observed_error) > options['tolerance']:
+            print(f"Warning: no order reaches tolerance {options['tolerance']}, keeping all {max_order} states "
+                  f"(time-domain error {np.max(reduced.observed_error):.3g}).")
+    else:
+        reduced = surrogate(max(min(options['order'], max_order), 1))
+    reduced.error = harmonic_error(model, reduced, settings)
+    if np.any(np.linalg.eigvals(reduced.A.toarray()[1:, 1:]).real >= 0.0):
+        print("Warning: the reduced network is not stable, raise the order.")
+    print(f"{reduced}, largest harmonic error {np.max(reduced.error):.3g}.")
+    return reduced
+
+
+class ReducedOutput():
+    """
+    Outputs of surrogate runs, values[(segment, signal)] of shape (len(t),), or (N, len(t)) for N input signals
+    """
+    def __init__(self, t, outputs, y):
+        self.t = t
+        self.values = {output: y[..., i] for i, output in enumerate(outputs)}
+
+    def signal(self, segment, signal):
+        return self.values[(segment, signal)]
+
+    def db(self):
+        """
+        Debugger-style db {'t': t, 'SS<index>': {signal: values}} for plot_all_segments.
+        """
+        db = {'t': self.t}
+        for (segment, signal), values in self.values.items():
+            db.setdefault(f'SS{segment}', {})[signal] = values
+        return db
+
+    def __repr__(self):
+        return f"ReducedOutput: {len(self.values)} outputs, {len(self.t)} time steps"
+
+
+def surrogate_hold(settings):
+    """
+    Input hold of the exact discretization: the solver when it is one, first-order otherwise.
+    """
+    solver = settings['simulation'].get('solver')
+    return solver if solver in HOLDS else 'foh'
+
+
+def run_reduced(settings, reduced, signals=None, discrete=None):
+    """
+    Run the surrogate on the time_step grid with the exact discretization.
+    Args:
+        settings (dict): Simulation settings; input_signal drives a single run.
+        reduced (ReducedModel): Surrogate from reduce_model.
+        signals (list, optional): input_signal dicts of N runs, e.g. the points of an input sweep.
+        discrete (DiscreteModel, optional): Previously built discretization of the surrogate to reuse.
+    Returns:
+        out (ReducedOutput): Outputs of the run, or of every run.
+    """
+    t = time_grid(settings)
+    if discrete is None:
+        discrete = DiscreteModel(reduced, settings['simulation']['time_step'], surrogate_hold(settings))
+    runs = [settings['input_signal']] if signals is None else signals
+    states = np.empty((len(t), reduced.n_states))
+    y = np.empty((len(runs), len(t), len(reduced.outputs)))
+    for i, signal in enumerate(runs):
+        u = inflow_pressure(t, signal)
+        y[i] = reduced.output(discrete.run(reduced.x0, u, states), u)
+    return ReducedOutput(t, reduced.outputs, y[0] if signals is None else y)
+
+
+def run_reduced_sweep(settings, reduced, coords):
+    """
+    Sweep of input_signal coordinates on the surrogate, see sweep.py for the coordinates.
+    The surrogate holds one set of segment parameters, so rs/l/c/rp scalings need a model reduced per point.
+    Returns:
+        out (ReducedOutput): values of shape (*shape, len(t)), with the sweep coordinates in out.coords.
+    """
+    coords = {name: list(values) for name, values in coords.items()}
+    for name in coords:
+        if parse_coordinate(name)[0] not in INPUT_KEYS:
+            raise ValueError(f"Reduced sweeps take input coordinates only, got {name}, "
+                             f"available options: {list(INPUT_KEYS)}")
+    grid = list(itertools.product(*coords.values()))
+    signals = [{**settings['input_signal'], **dict(zip(coords, values))} for values in grid]
+    out = run_reduced(settings, reduced, signals)
+    shape = tuple(len(values) for values in coords.values())
+    out.values = {output: values.reshape(shape + values.shape[1:]) for output, values in out.values.items()}
+    out.coords = coords
+    print(f"Reduced sweep of {len(grid)} runs finished: {reduced.n_states} states, {len(out.t)} time steps.")
+    return out
+
+
+def check_reduced(settings, model_params, reduced, model=None):
+    """
+    Error of the surrogate against the full model, both on the exact discretization with the same hold.
+    A largest relative error above the reduction tolerance is reported with a warning.
+    Returns:
+        report (dict): max_abs_error and max_rel_error (relative to the peak of the full output) per output,
+            the harmonic error (valve open), the run times (without discretization) and speedup, and
+            within_tolerance. The errors are a posteriori; no a priori bound of the outputs is reported.
+    """
+    if model is None:
+        model = StateSpaceModel(model_params, settings)
+    y_full, full_time = full_outputs(model, reduced.outputs, settings)
+
+    discrete = DiscreteModel(reduced, settings['simulation']['time_step'], surrogate_hold(settings))
+    wall = time.perf_counter()
+    out = run_reduced(settings, reduced, discrete=discrete)
+    reduced_time = time.perf_counter() - wall
+
+    tolerance = reduced.options['tolerance']
+    report = {'order': reduced.n_states, 'full_order': model.n_states, 'full_time': full_time,
+              'reduced_time': reduced_time, 'speedup': full_time / reduced_time, 'tolerance': tolerance,
+              'max_abs_error': {}, 'max_rel_error': {}, 'harmonic_error': {}}
+    for i, output in enumerate(reduced.outputs):
+        name = f'{output[1]}:{output[0]}'
+        error = np.abs(out.signal(*output) - y_full[:, i]).max()
+        report['max_abs_error'][name] = float(error)
+        report['max_rel_error'][name] = float(error / max(np.abs(y_full[:, i]).max(), 1e-300))
+        report['harmonic_error'][name] = float(reduced.error[i])
+    largest = max(report['max_rel_error'].values())
+    report['within_tolerance'] = largest <= tolerance
+    if not report['within_tolerance']:
+        print(f"Warning: the largest relative error {largest:.3g} of the reduced model exceeds the tolerance "
+              f"{tolerance}, raise the order or leave it null.")
+    print(f"Reduced model check finished: {report['full_order']} -> {report['order']} states, "
+          f"speedup {report['speedup']:.1f}, largest relative error {largest:.3g}.")
+    return report
@@ -0,0 +1,256 @@
+"""
+Forward sensitivities of the state-space network
+- Integrates dx/dt = A·clip(x) + B·u together with S = dx/dθ, θ = log of the segment parameters
+- Parameters named like sweep coordinates: 'rs:13', 'l:13', 'c:13', 'rp:13' (rp only where the segment has one)
+- Loss and gradient of the mismatch against measured traces from one run, instead of one finite-difference
+  run per parameter
+
+With θ = log p the parameter derivatives of the right-hand side are simple, per segment k:
+    ∂(dFi_k/dt)/∂log rs_k = -Rs·Fi / L      ∂(dFi_k/dt)/∂log l_k = -dFi_k/dt
+    ∂(dPo_k/dt)/∂log c_k  = -dPo_k/dt       ∂(dPo_k/dt)/∂log rp_k = Po / (Rp·C)
+and dS/dt = A·D·S + ∂f/∂θ, with D the derivative of the valve clip. Between valve events the augmented
+system is linear, so the implicit solvers get its exact sparse Jacobian.
+
+Measured traces are dicts {'segment': 13, 'signal': 'Po', 't': t, 'values': y, 'weight': 1.0}; the loss is
+the weighted mean squared error of every trace at its own sample times.
+
+Settings (optional 'sensitivity' section, tolerances of the augmented integration):
+    "sensitivity": {"rtol": 1e-6, "atol": 1e-6}
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.integrate import solve_ivp
+
+from checkpoint import start_state
+from state_space import StateSpaceModel, input_pressure, time_grid
+
+PARAMETERS = ('rs', 'l', 'c', 'rp')
+TRACE_SIGNALS = ('Pi', 'Po', 'Fi', 'Fo')
+SENSITIVITY_DEFAULTS = {'rtol': 1e-6, 'atol': 1e-6}
+
+
+def parameter_names(model, parameters=PARAMETERS, segments=None):
+    """
+    Names '<param>:<index>' of the fitted parameters, segments in model order (None: all segments).
+    """
+    for name in parameters:
+        if name not in PARAMETERS:
+            raise ValueError(f"Unknown parameter: {name}, available options: {list(PARAMETERS)}")
+    segments = model.index if segments is None else segments
+    for index in segments:
+        if index not in model.position:
+            raise ValueError(f"Parameter of unknown segment {index}.")
+    return [f'{name}:{index}' for name in parameters for index in segments
+            if name != 'rp' or model.g[model.position[index]] > 0.0]
+
+
+class SensitivityModel():
+    """
+    State-space model augmented with the forward sensitivities of a set of parameters
+    """
+    def __init__(self, model, names):
+        self.model = model
+        self.names = list(names)
+        self.m = len(self.names)
+        n = model.n
+
+        # Per parameter: kind, segment position and the state row its derivative term enters
+        self.kind = np.array([PARAMETERS.index(name.split(':')[0]) for name in self.names], dtype=int)
+        self.segment = np.array([model.position[int(name.split(':')[1])] for name in self.names], dtype=int)
+        self.row = np.where(self.kind < 2, self.segment, n + self.segment)
+        self.columns = np.arange(self.m)
+
+        # Exact Jacobian blocks of the two valve states
+        self.AD = {}
+        for is_open in (False, True):
+            d = np.ones(model.n_states)
+            d[model.valve] = float(is_open)
+            self.AD[is_open] = (model.A @ sp.diags(d)).tocsr()
+
+    def forcing(self, t, x, dx):
+        """
+        ∂f/∂θ at state x with derivative dx, as a dense (n_states, m) matrix.
+        """
+        model, n, k = self.model, self.model.n, self.segment
+        fi = model.clip(x)[:n]
+        values = np.select([self.kind == 0, self.kind == 1, self.kind == 2],
+                           [-model.rs[k] * fi[k] / model.l[k], -dx[k], -dx[n + k]],
+                           model.g[k] * x[n + k] / model.c[k])
+        P = np.zeros((model.n_states, self.m))
+        P[self.row, self.columns] = values
+        return P
+
+    def rhs(self, t, z):
+        """
+        Derivative of z = [x, S.ravel()], S of shape (n_states, m).
+        """
+        model = self.model
+        x, S = z[:model.n_states], z[model.n_states:].reshape(model.n_states, self.m)
+        dx = model.rhs(t, x)
+        dS = self.AD[bool(x[model.valve] > 0.0)] @ S + self.forcing(t, x, dx)
+        return np.concatenate([dx, dS.ravel()])
+
+    def jac(self, t, z):
+        """
+        Sparse Jacobian of rhs; exact between valve events.
+        """
+        model, n, k = self.model, self.model.n, self.segment
+        x = z[:model.n_states]
+        is_open = bool(x[model.valve] > 0.0)
+        AD = self.AD[is_open]
+
+        # ∂(∂f/∂θ)/∂x, one row per parameter: -rows of A·D for l and c, single entries for rs and rp
+        rs, rp = self.kind == 0, self.kind == 3
+        d_rs = -model.rs[k[rs]] / model.l[k[rs]] * np.where(k[rs] == model.valve, float(is_open), 1.0)
+        Q = (sp.diags(-((self.kind == 1) | (self.kind == 2)).astype(float)) @ AD[self.row]
+             + sp.csr_matrix((np.concatenate([d_rs, model.g[k[rp]] / model.c[k[rp]]]),
+                              (np.concatenate([self.columns[rs], self.columns[rp]]),
+                               np.concatenate([k[rs], n + k[rp]]))),
+                             shape=(self.m, model.n_states))).tocoo()
+        # S is stored row-major, so the derivative of parameter j enters row row[j]·m + j of dS
+        Q = sp.csr_matrix((Q.data, (self.row[Q.row] * self.m + Q.row, Q.col)),
+                          shape=(model.n_states * self.m, model.n_states))
+        return sp.bmat([[AD, None], [Q, sp.kron(AD, sp.identity(self.m), format='csr')]], format='csr')
+
+    def initial(self, x0, from_checkpoint):
+        """
+        Initial sensitivities: x0 = int_fi/L, int_po/C depends on l and c, a checkpoint state does not.
+        """
+        S0 = np.zeros((self.model.n_states, self.m))
+        if not from_checkpoint:
+            for j in np.flatnonzero((self.kind == 1) | (self.kind == 2)):
+                S0[self.row[j], j] = -x0[self.row[j]]
+        return S0
+
+
+class SensitivityOutput():
+    """
+    States x (len(t), n_states) and sensitivities S (len(t), n_states, m) to the parameters in names
+    """
+    def __init__(self, model, t, x, S, names, stats):
+        self.model = model
+        self.t = t
+        self.x = x
+        self.S = S
+        self.names = names
+        self.stats = stats
+
+    def signal(self, segment, signal):
+        """
+        A TRACE_SIGNALS signal of a segment and its sensitivities, shapes (len(t),) and (len(t), m).
+        """
+        model = self.model
+        if segment not in model.position:
+            raise ValueError(f"Trace of unknown segment {segment}.")
+        k, n = model.position[segment], model.n
+        fi, dfi = self.x[:, :n].copy(), self.S[:, :n].copy()
+        closed = fi[:, model.valve] <= 0.0   # aortic valve clip
+        fi[closed, model.valve] = 0.0
+        dfi[closed, model.valve] = 0.0
+        match signal:
+            case 'Po':
+                return self.x[:, n + k], self.S[:, n + k]
+            case 'Fi':
+                return fi[:, k], dfi[:, k]
+            case 'Pi':
+                if k == model.root:
+                    return input_pressure(self.t, model.settings), np.zeros((self.t.size, len(self.names)))
+                return self.x[:, n + model.parent[k]], self.S[:, n + model.parent[k]]
+            case 'Fo':
+                children = model.parent == k
+                return fi[:, children].sum(axis=1), dfi[:, children].sum(axis=1)
+            case _:
+                raise ValueError(f"Unknown trace signal: {signal}, available options: {list(TRACE_SIGNALS)}")
+
+    def __repr__(self):
+        return f"SensitivityOutput: {self.t.size} time steps, {self.x.shape[1]} states, {len(self.names)} parameters"
+
+
+def trace_times(settings, traces):
+    """
+    Output times of a sensitivity run: the time_step grid plus the sample times of every trace.
+    """
+    times = [time_grid(settings)] + [np.asarray(trace['t'], dtype=float) for trace in traces]
+    return np.unique(np.concatenate(times))
+
+
+def run_sensitivity(settings, model_params, names=None, t_eval=None, model=None):
+    """
+    Integrate the state-space model together with its parameter sensitivities.
+    settings['simulation']['solver'] selects an explicit ('RK45', default) or implicit ('Radau', 'BDF')
+    SciPy method; the implicit ones use the sparse Jacobian of the augmented system.
+    Args:
+        settings (dict): Simulation settings.
+        model_params (dict): Model parameters.
+        names (list, optional): Parameter names, defaults to parameter_names(model) (all of them).
+        t_eval (np.ndarray, optional): Output times, defaults to the time_step grid.
+        model (StateSpaceModel, optional): Previously compiled model to reuse.
+    Returns:
+        out (SensitivityOutput): States and sensitivities ∂x/∂log p at t_eval.
+    """
+    if model is None:
+        model = StateSpaceModel(model_params, settings)
+    names = parameter_names(model) if names is None else names
+    augmented = SensitivityModel(model, names)
+
+    t0, x0 = start_state(settings, model)
+    t_eval = time_grid(settings, t0) if t_eval is None else np.asarray(t_eval, dtype=float)
+    t_eval = t_eval[t_eval >= t0]
+    z0 = np.concatenate([x0, augmented.initial(x0, x0 is not model.x0).ravel()])
+
+    solver = settings['simulation'].get('solver', 'RK45')
+    options = {**SENSITIVITY_DEFAULTS, **settings.get('sensitivity', {})}
+    kwargs = {'max_step': settings['simulation']['time_step'], 'rtol': options['rtol'], 'atol': options['atol']}
+    match solver:
+        case 'RK45' | 'DOP853':
+            pass
+        case 'Radau' | 'BDF':
+            kwargs['jac'] = augmented.jac
+        case _:
+            raise ValueError(f"Unknown sensitivity solver: {solver}, available options: "
+                             f"['RK45', 'DOP853', 'Radau', 'BDF']")
+    sol = solve_ivp(augmented.rhs, (t0, t_eval[-1]), z0, method=solver, t_eval=t_eval, **kwargs)
+    if not sol.success:
+        raise RuntimeError(f"Sensitivity integration failed: {sol.message}")
+
+    states = sol.y.T
+    x = states[:, :model.n_states]
+    S = states[:, model.n_states:].reshape(-1, model.n_states, augmented.m)
+    print(f"Sensitivity ({solver}) run of {model.n} segments and {augmented.m} parameters finished: "
+          f"{sol.t.size} time steps, {sol.nfev} RHS evaluations.")
+    return SensitivityOutput(model, sol.t, x, S, names, {'nfev': sol.nfev, 'njev': sol.njev, 'nlu': sol.nlu})
+
+
+def trace_loss(out, traces):
+    """
+    Weighted mean squared mismatch against measured traces and its gradient.
+    Returns:
+        loss (float): Σ weight · mean((y - measured)²) over the traces.
+        gradient (np.ndarray): ∂loss/∂log p, in the order of out.names.
+    """
+    loss, gradient = 0.0, np.zeros(len(out.names))
+    for trace in traces:
+        y, dy = out.signal(trace['segment'], trace['signal'])
+        t = np.asarray(trace['t'], dtype=float)
+        k = np.searchsorted(out.t, t)
+        if np.any(k >= out.t.size) or not np.allclose(out.t[k], t):
+            raise ValueError(f"Trace {trace['segment']}:{trace['signal']} has samples outside the simulated times.")
+        residual = y[k] - np.asarray(trace['values'], dtype=float)
+        weight = trace.get('weight', 1.0) / t.size
+        loss += weight * residual @ residual
+        gradient += 2.0 * weight * residual @ dy[k]
+    return loss, gradient
+
+
+def loss_gradient(settings, model_params, traces, names=None, model=None):
+    """
+    Mismatch loss against measured traces and its gradient to every parameter, from one run.
+    Returns:
+        loss (float): Weighted mean squared error, see trace_loss.
+        gradient (dict): ∂loss/∂log p per parameter name; divide by p for ∂loss/∂p.
+        out (SensitivityOutput): The sensitivity run.
+    """
+    out = run_sensitivity(settings, model_params, names, trace_times(settings, traces), model)
+    loss, gradient = trace_loss(out, traces)
+    return loss, dict(zip(out.names, gradient)), out
@@ -0,0 +1,362 @@
+"""
+Sparse state-space engine for the arterial network
+- Compiles model_params.json directly into dx/dt = A·x + B·u
+- Two states per segment: Fi and Po
+- Bypasses the bdsim block diagram, integrates with SciPy
+
+State layout: x[:n] = Fi of every segment, x[n:] = Po of every segment,
+in the row order of model_params.json.
+
+The aortic valve of segment 1 is modelled like the CLIP block in ArterialElement:
+the integrator state Fi1 is left untouched, but only max(Fi1, 0) is fed back
+into the network. The A matrix is therefore applied to the clipped state.
+"""
+
+import math
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.integrate import solve_ivp
+
+from checkpoint import start_state
+from inflow import inflow_pressure
+
+DEBUG_PORTS = ['Pi', 'Fo', '-Rs*Fi', '-Fi', '-Po', 'int_fi', 'int_po']
+
+
+def segment_params(model_params):
+    """
+    Parse model parameter rows into flat arrays.
+    Uses the same unit conversion as arterial_elements_from_params.
+    Args:
+        model_params (dict): Model parameters loaded from JSON file.
+    Returns:
+        params (dict): names, index, rs, l, c, g (= 1/Rp, 0 without Rp) and connections.
+    """
+    params = {'names': [], 'index': [], 'rs': [], 'l': [], 'c': [], 'g': [], 'connections': []}
+    for art_seg in model_params['rows']:
+        name, index, rs, l, c, rp, _, connections = art_seg
+        params['names'].append(name)
+        params['index'].append(index)
+        params['rs'].append(rs * 1e-3)  # Convert Rs to mm
+        params['l'].append(l * 1e-3)    # Convert L to mm
+        params['c'].append(c * 1e-3)    # Convert C to mm
+        params['g'].append(0.0 if rp is None else 1.0 / rp)
+        params['connections'].append(list(connections))
+
+    for key in ('rs', 'l', 'c', 'g'):
+        params[key] = np.asarray(params[key], dtype=float)
+    return params
+
+
+def input_pressure(t, settings):
+    """
+    Driving pressure of segment 1, equivalent to the WAVEFORM + FUNCTION blocks in connect_segments.
+    The negative half of the sine gives a complex root in the block diagram whose real part is
+    the baseline, so the root is taken of the positive part only.
+    Other shapes and measured waveforms are looked up in a precomputed table, see inflow.py.
+    Args:
+        t (float or np.ndarray): Time(s) in seconds.
+        settings (dict): Settings loaded from JSON file.
+    """
+    return inflow_pressure(t, settings['input_signal'])
+
+
+class StateSpaceModel():
+    """
+    Sparse linear state-space form of the arterial network
+    """
+    def __init__(self, model_params, settings):
+        """
+        Compile the topology and parameters into sparse A and B.
+        """
+        self.settings = settings
+        params = segment_params(model_params)
+
+        self.names = params['names']
+        self.index = params['index']
+        self.connections = params['connections']
+        self.rs, self.l, self.c, self.g = params['rs'], params['l'], params['c'], params['g']
+
+        self.n = len(self.index)
+        self.n_states = 2 * self.n
+        self.position = {index: k for k, index in enumerate(self.index)}
+
+        if 1 not in self.position:
+            raise ValueError("Segment 1 is required as the inflow segment of the network.")
+        self.root = self.position[1]
+        self.valve = self.root  # state index of Fi1, clipped to mimic the aortic valve
+
+        # Parent position of every segment (-1 for the inflow segment)
+        self.parent = np.full(self.n, -1, dtype=int)
+        for k, connections in enumerate(self.connections):
+            for conn in connections:
+                if conn not in self.position:
+                    raise ValueError(f"Segment {self.index[k]} connects to unknown segment {conn}.")
+                j = self.position[conn]
+                if self.parent[j] != -1:
+                    raise ValueError(f"Segment {conn} has more than one upstream segment.")
+                self.parent[j] = k
+
+        # incidence[k, j] = 1 if segment j is downstream of segment k, so Fo = incidence @ Fi
+        child = np.flatnonzero(self.parent >= 0)
+        self.incidence = sp.csr_matrix((np.ones(child.size), (self.parent[child], child)),
+                                       shape=(self.n, self.n))
+
+        self.A, self.B = self.build_matrices()
+
+        ic = settings['initial_conditions']
+        self.x0 = np.concatenate([np.full(self.n, ic['int_fi']) / self.l,
+                                  np.full(self.n, ic['int_po']) / self.c])
+
+    def build_matrices(self):
+        """
+        Assemble A and B from the Wesseling equations
+        dFi/dt = 1/L * (Pi - Po - Rs*Fi),  Pi = Po of the upstream segment or the input u
+        dPo/dt = 1/C * (Fi - Fo - Po/Rp),  Fo = sum of Fi of the downstream segments
+        """
+        n = self.n
+        k = np.arange(n)
+        child = np.flatnonzero(self.parent >= 0)
+        rows, cols, vals = [], [], []
+
+        def add(r, c, v):
+            rows.append(r)
+            cols.append(c)
+            vals.append(v)
+
+        add(k, k, -self.rs / self.l)                                     # -Rs*Fi / L
+        add(k, n + k, -1.0 / self.l)                                     # -Po / L
+        add(child, n + self.parent[child], 1.0 / self.l[child])         #  Pi / L
+        add(n + k, k, 1.0 / self.c)                                      #  Fi / C
+        add(n + self.parent[child], child, -1.0 / self.c[self.parent[child]])  # -Fo / C
+        add(n + k, n + k, -self.g / self.c)                              # -Po/Rp / C
+
+        A = sp.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                          shape=(self.n_states, self.n_states))
+        B = np.zeros(self.n_states)
+        B[self.root] = 1.0 / self.l[self.root]
+        return A, B
+
+    def clip(self, x):
+        """
+        Return a copy of x with the valve flow clipped at zero.
+        Works on a single state vector or on states stacked along the last axis.
+        """
+        xc = np.array(x, dtype=float, copy=True)
+        xc[self.valve] = np.maximum(xc[self.valve], 0.0)
+        return xc
+
+    def rhs(self, t, x):
+        """
+        Right-hand side dx/dt = A·clip(x) + B·u(t), usable by any SciPy integrator.
+        """
+        return self.A @ self.clip(x) + self.B * input_pressure(t, self.settings)
+
+    def batch_derivative(self, t, X, signal, rs, l, c, g):
+        """
+        Derivative of runs stacked along axis 0, each with its own parameters and input signal.
+        Args:
+            t (float): Time in seconds.
+            X (np.ndarray): States of shape (N, n_states).
+            signal (dict): input_signal entries as arrays of shape (N,), see inflow.batch_signal.
+            rs, l, c, g (np.ndarray): Segment parameters of shape (N, n).
+        """
+        n = self.n
+        fi, po = X[:, :n].copy(), X[:, n:]
+        fi[:, self.root] = np.maximum(fi[:, self.root], 0.0)  # aortic valve
+
+        pi = po[:, np.maximum(self.parent, 0)]
+        pi[:, self.root] = input_pressure(t, {'input_signal': signal})
+        fo = (self.incidence @ fi.T).T
+
+        dX = np.empty_like(X)
+        dX[:, :n] = (pi - po - rs * fi) / l
+        dX[:, n:] = (fi - fo - g * po) / c
+        return dX
+
+    def signals(self, t, x, index, port):
+        """
+        Reconstruct a debugger port signal of segment `index` from states x of shape (n_states, len(t)).
+        Port names follow the debug_port_map of ArterialElement.
+        """
+        k = self.position[index]
+        xc = self.clip(x)
+        fi, po = xc[:self.n], xc[self.n:]
+        match port:
+            case 'Pi':
+                return input_pressure(t, self.settings) if k == self.root else po[self.parent[k]]
+            case 'Fo':
+                return fi[self.parent == k].sum(axis=0)
+            case '-Rs*Fi':
+                return -self.rs[k] * fi[k]
+            case '-Fi':
+                return -fi[k]
+            case '-Po':
+                return -po[k]
+            case 'int_fi':
+                return self.l[k] * x[k]
+            case 'int_po':
+                return self.c[k] * x[self.n + k]
+            case _:
+                raise ValueError(f"Unknown debug port name: {port}, available options: {DEBUG_PORTS}")
+
+
+class StateSpaceOutput():
+    """
+    Simulation output with the same attribute layout as the bdsim output object:
+    t, x, xnames, ynames and y0 ... yN for the watched debugger ports.
+    """
+    def __init__(self, t, x, xnames):
+        self.t = t
+        self.x = x
+        self.xnames = xnames
+        self.ynames = []
+
+    def add_signal(self, name, y):
+        setattr(self, f'y{len(self.ynames)}', y)
+        self.ynames.append(name)
+
+    def __repr__(self):
+        return (f"StateSpaceOutput: {len(self.t)} time steps, {len(self.xnames)} states, "
+                f"{len(self.ynames)} outputs")
+
+
+def build_output(model, t, x):
+    """
+    Wrap integrated states into a StateSpaceOutput with watched signals named like connect_segments does.
+    Args:
+        model (StateSpaceModel): Compiled state-space model.
+        t (np.ndarray): Time vector.
+        x (np.ndarray): States of shape (n_states, len(t)).
+    """
+    out = StateSpaceOutput(t, x.T, state_names(model))
+    for name, index, port_name in watched_signals(model):
+        out.add_signal(name, model.signals(t, x, index, port_name))
+    return out
+
+
+def state_names(model):
+    """
+    Names of the states, Fi of every segment followed by Po of every segment.
+    """
+    return [f'subsystem.{k}/Fi' for k in range(model.n)] + [f'subsystem.{k}/Po' for k in range(model.n)]
+
+
+def watched_signals(model):
+    """
+    Debugger outputs as (yname, segment index, port name), named like connect_segments does.
+    """
+    debugger = model.settings['debugger']
+    if not debugger['enabled']:
+        return []
+    watched = []
+    for k, index in enumerate(model.index):
+        if index not in debugger['debug_for_index']:
+            continue
+        output_ports = 2 if index != 1 else 1  # same port numbering as ArterialElement
+        for i, port_name in enumerate(debugger['debugger_port_list']):
+            watched.append((f'subsystem.{k}/out_{index}[{output_ports + i}]', index, port_name))
+    return watched
+
+
+def time_grid(settings, t0=0.0):
+    """
+    Output times k·time_step from t0 up to simulation_time, the grid of every state-space solver.
+    """
+    dt = settings['simulation']['time_step']
+    T = settings['simulation']['simulation_time']
+    t = np.arange(0.0, T + 0.5 * dt, dt)
+    return t[(t <= T) & (t >= t0 - 0.5 * dt)]
+
+
+def run_state_space(settings, model_params, model=None):
+    """
+    Build (unless given) and integrate the state-space model.
+    settings['simulation']['solver'] selects 'RK45' (default), the exact 'zoh'/'foh' discretization
+    or the implicit 'Radau'/'BDF'/'rosenbrock' solvers with valve events.
+    For RK45, settings['simulation']['kernel'] selects the right-hand side ('sparse' or 'fused').
+    The run starts from a checkpoint if settings['checkpoint'] resumes or warm-starts (see checkpoint.py).
+    Args:
+        settings (dict): Simulation settings.
+        model_params (dict): Model parameters.
+        model (StateSpaceModel, optional): Previously compiled model to reuse.
+    Returns:
+        out (StateSpaceOutput): Output with the same layout as the bdsim output.
+    """
+    if model is None:
+        model = StateSpaceModel(model_params, settings)
+
+    solver = settings['simulation'].get('solver', 'RK45')
+    if solver in ('zoh', 'foh'):
+        # Exact fixed-step discretization, see discrete.py
+        from discrete import run_discrete
+        return run_discrete(settings, model_params, model=model)
+    if solver in ('Radau', 'BDF', 'rosenbrock'):
+        # Implicit solvers with valve events, see implicit.py
+        from implicit import run_implicit
+        return run_implicit(settings, model_params, model=model)
+
+    dt = settings['simulation']['time_step']
+    t0, x0 = start_state(settings, model)
+    t_eval = time_grid(settings, t0)
+
+    # settings['simulation']['kernel'] selects the sparse A·x product or the fused kernel, see kernel.py
+    from kernel import model_rhs
+    sol = solve_ivp(model_rhs(model, settings), (t_eval[0], t_eval[-1]), x0, method='RK45', t_eval=t_eval,
+                    max_step=dt)
+    if not sol.success:
+        raise RuntimeError(f"State-space integration failed: {sol.message}")
+
+    print(f"State-space simulation of {model.n} segments finished: "
+          f"{sol.t.size} time steps, {sol.nfev} RHS evaluations.")
+    return build_output(model, sol.t, sol.y)
+
+
+def integrate_windows(settings, model, step):
+    """
+    Integrate the state-space model over the time_step grid, window by window.
+    Uses settings['simulation']['solver'] like run_state_space. With simulation_time None the
+    windows continue until the consumer stops; only the current window is held in memory.
+    A resumed run starts at the checkpoint time (see checkpoint.py).
+    Args:
+        settings (dict): Simulation settings.
+        model (StateSpaceModel): Compiled state-space model.
+        step (int): Output samples per window, e.g. store.chunk_size(settings).
+    Yields:
+        t (np.ndarray): Times of the window; consecutive windows do not repeat their boundary sample.
+        states (np.ndarray): States at t, shape (len(t), n_states).
+    """
+    solver = settings['simulation'].get('solver', 'RK45')
+    dt = settings['simulation']['time_step']
+    T = settings['simulation']['simulation_time']
+    # Index of the last output sample, on the same grid as np.arange(0, T, dt) in run_state_space
+    last = math.inf if T is None else np.count_nonzero(np.arange(0.0, T + 0.5 * dt, dt) <= T) - 1
+
+    # Solvers as in run_state_space: exact discretization (discrete.py), implicit with valve events (implicit.py)
+    # or RK45 on the kernel.py right-hand side
+    from discrete import DiscreteModel
+    from implicit import IMPLICIT_DEFAULTS, METHODS, integrate_events
+    from kernel import model_rhs
+    discrete = DiscreteModel(model, dt, solver) if solver in ('zoh', 'foh') else None
+    options = {**IMPLICIT_DEFAULTS, **settings.get('implicit', {})}
+    rhs = model_rhs(model, settings)
+
+    t0, x0 = start_state(settings, model)
+    first, k = 0, int(round(t0 / dt))
+    while k < last:
+        t_w = np.arange(k, min(k + step, last) + 1) * dt
+        k += step
+        if discrete is not None:
+            states = discrete.run(x0, input_pressure(t_w, settings))
+        elif solver in METHODS:
+            states, _ = integrate_events(model, solver, options, t_w, x0)
+        else:
+            sol = solve_ivp(rhs, (t_w[0], t_w[-1]), x0, method=solver, t_eval=t_w, max_step=dt)
+            if not sol.success:
+                raise RuntimeError(f"State-space integration failed: {sol.message}")
+            states = sol.y.T
+
+        # Windows share their boundary sample, which is yielded once
+        yield t_w[first:], states[first:]
+        x0, first = states[-1], 1
@@ -0,0 +1,274 @@
+"""
+Columnar on-disk run format
+- One .npy file per signal (t, x and every watched output y0 ... yN), readable with mmap
+- A small header.json with ynames, xnames, the SS/port mapping of the debugger DB and the settings
+- Written in chunks; the state-space engine streams chunks while it integrates
+
+A run directory 'Output/run_XXX' looks like:
+    header.json   {"n_samples", "ynames", "xnames", "signals": {"SS1": {"Pi": "y0", ...}}, "settings"}
+    t.npy         (n_samples,)
+    x.npy         (n_samples, n_states), if the output has states
+    y0.npy ...    (n_samples,) per watched output
+
+The .npy files are standard NumPy arrays. Their headers are written with fixed-width shapes,
+so the row count is filled in when the writer is closed without rewriting any data.
+
+Select with settings['output']['format'] = 'columnar' (default 'pickle').
+"""
+
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from catalog import catalog_entry, record_run
+from checkpoint import checkpoint_writer
+from filer import debug_keys
+from state_space import StateSpaceModel, integrate_windows, state_names, watched_signals
+
+CHUNK_SIZE = 4096   # rows per chunk when no settings['output']['chunk_size'] is given
+
+
+def npy_header(dtype, shape):
+    """
+    .npy version 1.0 header with fixed-width shape fields, so it can be rewritten in place.
+    """
+    dims = ', '.join(f'{n:>12d}' for n in shape)
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%s%s), }" % (
+        np.dtype(dtype).str, dims, ',' if len(shape) == 1 else '')
+    header += ' ' * (-(len(header) + 11) % 64) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class ColumnFile():
+    """
+    Append-only .npy file of rows with a fixed trailing shape
+    """
+    def __init__(self, path, row_shape=(), dtype=np.float64):
+        self.path = path
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.file = open(path, 'wb')
+        self.file.write(npy_header(self.dtype, (0,) + self.row_shape))
+
+    def append(self, chunk):
+        chunk = np.ascontiguousarray(chunk, dtype=self.dtype)
+        self.file.write(chunk.tobytes())
+        self.rows += chunk.shape[0]
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(npy_header(self.dtype, (self.rows,) + self.row_shape))
+        self.file.close()
+
+
+def claim_run_dir(prefix='run', output_dir='Output'):
+    """
+    Atomically claim the next free '<prefix>_XXX' directory in output_dir.
+    Returns (i, path).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    i = 1
+    while True:
+        path = os.path.join(output_dir, f'{prefix}_{i:03d}')
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            i += 1
+            continue
+        return i, path
+
+
+class RunWriter():
+    """
+    Chunked writer of one columnar run, use as a context manager
+    """
+    def __init__(self, run_dir, settings, ynames, xnames=None):
+        self.run_dir = run_dir
+        self.settings = settings
+        self.ynames = list(ynames)
+        self.xnames = list(xnames) if xnames else []
+        self.t = ColumnFile(os.path.join(run_dir, 't.npy'))
+        self.x = ColumnFile(os.path.join(run_dir, 'x.npy'), (len(self.xnames),)) if self.xnames else None
+        self.y = [ColumnFile(os.path.join(run_dir, f'y{i}.npy')) for i in range(len(self.ynames))]
+
+    def append(self, t, x=None, ys=()):
+        """
+        Append a chunk of samples.
+        Args:
+            t (np.ndarray): Times of the chunk.
+            x (np.ndarray, optional): States of the chunk, shape (len(t), n_states).
+            ys (list): One array of len(t) per output, in ynames order.
+        """
+        self.t.append(t)
+        if self.x is not None:
+            self.x.append(x)
+        for column, y in zip(self.y, ys):
+            column.append(y)
+
+    def close(self):
+        for column in [self.t, self.x] + self.y:
+            if column is not None:
+                column.close()
+        port_list = self.settings['debugger'].get('debugger_port_list', [])
+        signals = {}
+        for i, (ss_key, port) in enumerate(debug_keys(self.ynames, port_list)):
+            signals.setdefault(ss_key, {})[port] = f'y{i}'
+        header = {'n_samples': self.t.rows, 'ynames': self.ynames, 'xnames': self.xnames,
+                  'signals': signals, 'settings': self.settings}
+        with open(os.path.join(self.run_dir, 'header.json'), 'w', encoding='utf-8') as f:
+            json.dump(header, f, indent=4)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RunReader():
+    """
+    Memory-mapped view of a columnar run with the attribute layout of the simulation output:
+    t, x, xnames, ynames and y0 ... yN. Signals are opened on first access and read lazily.
+    """
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        with open(os.path.join(run_dir, 'header.json'), encoding='utf-8') as f:
+            self.header = json.load(f)
+        self.ynames = self.header['ynames']
+        self.xnames = self.header['xnames']
+        self.settings = self.header['settings']
+        self._columns = {}
+
+    def column(self, name):
+        """
+        Memory-mapped array of column 't', 'x' or 'y<i>'.
+        """
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.run_dir, f'{name}.npy'), mmap_mode='r')
+        return self._columns[name]
+
+    @property
+    def t(self):
+        return self.column('t')
+
+    @property
+    def x(self):
+        return self.column('x') if self.xnames else None
+
+    def __getattr__(self, name):
+        if name.startswith('y') and name[1:].isdigit() and int(name[1:]) < len(self.ynames):
+            return self.column(name)
+        raise AttributeError(name)
+
+    def signal(self, ss_key, port):
+        """
+        Memory-mapped signal of one debugger port, e.g. signal('SS13', '-Po').
+        """
+        return self.column(self.header['signals'][ss_key][port])
+
+    def db(self, ss_keys=None, ports=None):
+        """
+        Debugger DB ({'t': t, 'SS<i>': {port: y}}) of the requested segments and ports, without copying.
+        """
+        db = {'t': self.t}
+        for ss_key, columns in self.header['signals'].items():
+            if ss_keys and ss_key not in ss_keys:
+                continue
+            for port, name in columns.items():
+                if not ports or port in ports:
+                    db.setdefault(ss_key, {})[port] = self.column(name)
+        return db
+
+    def __repr__(self):
+        return (f"RunReader: {self.run_dir}, {self.header['n_samples']} time steps, "
+                f"{len(self.xnames)} states, {len(self.ynames)} outputs")
+
+
+def chunk_size(settings):
+    """
+    Rows per written chunk, settings['output']['chunk_size'] or CHUNK_SIZE.
+    """
+    return settings['output'].get('chunk_size', CHUNK_SIZE)
+
+
+def output_format(out, settings):
+    """
+    Storage format of an output: settings['output']['format'], or 'pickle' for outputs without the
+    t/ynames layout of a run (e.g. probes.ProbeOutput, whose probes have their own time vectors).
+    """
+    return settings['output'].get('format', 'pickle') if hasattr(out, 'ynames') else 'pickle'
+
+
+def write_run(out, settings, run_dir):
+    """
+    Write a simulation output object (or a RunReader) into an existing run directory, chunk by chunk.
+    """
+    xnames = getattr(out, 'xnames', None) if getattr(out, 'x', None) is not None else None
+    n, step = len(out.t), chunk_size(settings)
+    with RunWriter(run_dir, settings, out.ynames, xnames) as writer:
+        for k in range(0, n, step):
+            sl = slice(k, k + step)
+            writer.append(out.t[sl], out.x[sl] if xnames else None,
+                          [getattr(out, f'y{i}')[sl] for i in range(len(out.ynames))])
+
+
+def save_run(out, settings, output_dir='Output', wall_time=None, model_params=None):
+    """
+    Write a simulation output object (bdsim or state-space) as a columnar run, chunk by chunk,
+    and add it to the run catalog.
+    Returns the run directory.
+    """
+    _, run_dir = claim_run_dir(output_dir=output_dir)
+    write_run(out, settings, run_dir)
+    record_run(catalog_entry(os.path.basename(run_dir), settings, {'output': run_dir}, 'columnar',
+                             wall_time, model_params), output_dir)
+    print(f"Simulation complete and output saved to '{run_dir}'.")
+    return run_dir
+
+
+def stream_state_space(settings, model_params, model=None, output_dir='Output'):
+    """
+    Integrate the state-space model window by window and write every window straight to a
+    columnar run, so the full trajectory is never held in memory.
+    Uses settings['simulation']['solver'] like run_state_space.
+    Returns:
+        out (RunReader): Memory-mapped view of the written run.
+    """
+    t0 = time.perf_counter()
+    if model is None:
+        model = StateSpaceModel(model_params, settings)
+    solver = settings['simulation'].get('solver', 'RK45')
+    watched = watched_signals(model)
+    checkpoints = checkpoint_writer(settings, model)
+
+    _, run_dir = claim_run_dir(output_dir=output_dir)
+    with RunWriter(run_dir, settings, [name for name, _, _ in watched], state_names(model)) as writer:
+        for chunk_t, chunk_x in integrate_windows(settings, model, chunk_size(settings)):
+            writer.append(chunk_t, chunk_x,
+                          [model.signals(chunk_t, chunk_x.T, index, port) for _, index, port in watched])
+            if checkpoints is not None:
+                checkpoints.record(chunk_t, chunk_x)
+
+    record_run(catalog_entry(os.path.basename(run_dir), settings, {'output': run_dir}, 'columnar',
+                             time.perf_counter() - t0, model_params), output_dir)
+    print(f"Streamed state-space ({solver}) simulation of {model.n} segments to '{run_dir}': "
+          f"{writer.t.rows} time steps.")
+    out = RunReader(run_dir)
+    if checkpoints is not None:
+        out.checkpoint = checkpoints.checkpoint()
+    return out
+
+
+def load_latest_run(output_dir='Output', prefix='run'):
+    """
+    Open the columnar run with the largest index in output_dir.
+    """
+    runs = [d for d in os.listdir(output_dir) if d.startswith(f'{prefix}_') and d[len(prefix) + 1:].isdigit()]
+    if not runs:
+        raise FileNotFoundError(f"No '{prefix}_XXX' runs found in {output_dir!r}.")
+    last = max(runs, key=lambda d: int(d[len(prefix) + 1:]))
+    return RunReader(os.path.join(output_dir, last))
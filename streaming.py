@@ -0,0 +1,157 @@
+"""
+Streaming simulation for live monitoring
+- stream() advances the state-space network one window at a time and yields time-stamped blocks
+  of selected segment signals
+- astream() is the asyncio variant; the integration runs in a worker thread at most max_pending
+  blocks ahead of the consumer
+- LiveView keeps a rolling plot_all_segments-style figure up to date from the blocks
+
+Every block is a debugger-DB-like dict, so the plotting and analysis code for saved runs works on it:
+    {'t': t, 'SS13': {'-Po': y, ...}, ..., 'x_end': final state of the block}
+
+Both generators only compute the next block when the consumer asks for it, so a slow consumer
+slows down the simulation instead of letting output pile up, and memory stays constant however long
+the run is. With settings['simulation']['simulation_time'] = None the stream never ends.
+
+Example:
+    for block in stream(settings, model_params, signals=[(13, '-Po'), (1, 'Pi')]):
+        view.update(block)
+"""
+
+import asyncio
+import contextlib
+import math
+
+import numpy as np
+
+from probes import PROBE_SIGNALS, RingBuffer, probe_signal, probe_specs
+from state_space import StateSpaceModel, integrate_windows, watched_signals
+from store import chunk_size
+
+
+def stream_signals(settings, model):
+    """
+    Default streamed (segment, signal) pairs: the probes if enabled, otherwise the debugger ports.
+    """
+    specs = probe_specs(settings)
+    if specs is not None:
+        return [(spec['segment'], spec['signal']) for spec in specs]
+    return [(index, port) for _, index, port in watched_signals(model)]
+
+
+def stream(settings, model_params, signals=None, model=None, block_size=None):
+    """
+    Generator of simulation blocks on the state-space engine.
+    Args:
+        settings (dict): Simulation settings; solver, time_step and simulation_time (None: endless) are used.
+        model_params (dict): Model parameters.
+        signals (list, optional): (segment, signal) pairs, defaults to stream_signals(settings, model).
+        model (StateSpaceModel, optional): Previously compiled model to reuse.
+        block_size (int, optional): Output steps per block, defaults to settings['output']['chunk_size'].
+    Yields:
+        block (dict): {'t': t, 'SS<i>': {signal: y}, 'x_end': state at t[-1]}.
+    """
+    if model is None:
+        model = StateSpaceModel(model_params, settings)
+    if signals is None:
+        signals = stream_signals(settings, model)
+    for segment, signal in signals:
+        if segment not in model.position:
+            raise ValueError(f"Stream of unknown segment {segment}.")
+        if signal not in PROBE_SIGNALS:
+            raise ValueError(f"Unknown stream signal: {signal}, available options: {PROBE_SIGNALS}")
+
+    for t, states in integrate_windows(settings, model, block_size or chunk_size(settings)):
+        block = {'t': t}
+        for segment, signal in signals:
+            block.setdefault(f'SS{segment}', {})[signal] = probe_signal(model, t, states.T, segment, signal)
+        block['x_end'] = states[-1].copy()
+        yield block
+
+
+async def astream(settings, model_params, signals=None, model=None, block_size=None, max_pending=2):
+    """
+    Asynchronous generator of the blocks of stream(), for use in an asyncio event loop.
+    The integration runs in the default executor and waits while max_pending blocks are unconsumed.
+    An exception of the integration is raised in the consumer.
+    """
+    loop = asyncio.get_running_loop()
+    blocks = stream(settings, model_params, signals, model, block_size)
+    queue = asyncio.Queue(max_pending)
+
+    async def produce():
+        try:
+            while True:
+                block = await loop.run_in_executor(None, next, blocks, None)
+                await queue.put(block)   # backpressure: blocks here while the consumer is behind
+                if block is None:
+                    return
+        except Exception as error:   # handed to the consumer, which would otherwise wait forever
+            await queue.put(error)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (block := await queue.get()) is not None:
+            if isinstance(block, Exception):
+                raise block
+            yield block
+    finally:
+        producer.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await producer
+
+
+class LiveView():
+    """
+    Rolling matplotlib view of streamed blocks, one line per (segment, signal), like plot_all_segments
+    """
+    def __init__(self, signals, span=10.0, time_step=0.008, figsize=(10, 6), cmap_name='tab20'):
+        """
+        Args:
+            signals (list): (segment, signal) pairs to show.
+            span (float): Seconds of simulated time kept on screen.
+            time_step (float): Output time step, sizes the rolling buffers.
+        """
+        import matplotlib.pyplot as plt
+        self.plt = plt
+        self.span = span
+        self.fig, self.ax = plt.subplots(figsize=figsize)
+        cmap = plt.get_cmap(cmap_name)
+        capacity = math.ceil(span / time_step) + 1
+        self.buffers = {key: RingBuffer(capacity) for key in signals}
+        self.lines = {key: self.ax.plot([], [], label=f"SS{key[0]}:{key[1]}", color=cmap(i % cmap.N))[0]
+                      for i, key in enumerate(signals)}
+        self.ax.set_xlabel('time')
+        self.ax.legend(loc='best', fontsize='small')
+        self.ax.grid(True)
+
+    def update(self, block):
+        """
+        Append a block and redraw.
+        """
+        for (segment, signal), buffer in self.buffers.items():
+            y = block.get(f'SS{segment}', {}).get(signal)
+            if y is None:
+                continue
+            buffer.extend(block['t'], np.asarray(y))
+            self.lines[(segment, signal)].set_data(*buffer.arrays())
+        t_end = block['t'][-1]
+        self.ax.set_xlim(max(t_end - self.span, 0.0), max(t_end, self.span))
+        self.ax.relim()
+        self.ax.autoscale_view(scalex=False)
+        self.fig.canvas.draw_idle()
+        self.plt.pause(0.001)
+
+
+def run_live(settings, model_params, signals=None, span=10.0, block_size=256):
+    """
+    Stream a simulation into a LiveView until it ends or the window is closed.
+    """
+    model = StateSpaceModel(model_params, settings)
+    signals = signals or stream_signals(settings, model)
+    view = LiveView(signals, span, settings['simulation']['time_step'])
+    for block in stream(settings, model_params, signals, model, block_size):
+        if not view.plt.fignum_exists(view.fig.number):
+            break
+        view.update(block)
+    return view
@@ -0,0 +1,174 @@
+"""
+Batched parameter sweeps on the state-space engine
+- Grid over input_signal settings (frequency, amplitude, baseline) and waveforms (shape, measured file)
+- Grid over scalings of rs/l/c/rp, for all segments or per segment
+- All N grid points are integrated together as one (N, n_states) state array
+
+Sweep coordinates are given as a dict of name -> list of values, e.g.
+{
+    'frequency': [0.2, 0.4, 0.5],
+    'rs': [0.8, 1.0, 1.2],        # scale rs of every segment
+    'c:13': [0.5, 1.0],           # scale c of segment 13 only
+    'file': ['Data/inflow_a.csv', 'Data/inflow_b.csv'],   # measured inflow waveform per run (see inflow.py)
+}
+The grid is the cartesian product of all coordinates.
+"""
+
+import copy
+import itertools
+
+import numpy as np
+from scipy.integrate import solve_ivp
+
+from inflow import batch_signal
+from state_space import StateSpaceModel, build_output
+
+SIGNAL_KEYS = ('frequency', 'amplitude', 'baseline')
+WAVEFORM_KEYS = ('shape', 'file')
+PARAM_KEYS = ('rs', 'l', 'c', 'rp')
+INPUT_KEYS = SIGNAL_KEYS + WAVEFORM_KEYS
+
+
+def parse_coordinate(name):
+    """
+    Split a sweep coordinate name into (key, segment index or None).
+    """
+    key, _, index = name.partition(':')
+    if key not in INPUT_KEYS + PARAM_KEYS:
+        raise ValueError(f"Unknown sweep coordinate: {name}, "
+                         f"available options: {list(INPUT_KEYS + PARAM_KEYS)} (optionally as '<param>:<index>')")
+    if index and key in INPUT_KEYS:
+        raise ValueError(f"Input signal coordinate {key} cannot be given per segment.")
+    return key, int(index) if index else None
+
+
+def point_settings(settings, point):
+    """
+    Settings of one grid point, with its input_signal values filled in.
+    """
+    settings = copy.deepcopy(settings)
+    for name, value in point.items():
+        if name in INPUT_KEYS:
+            settings['input_signal'][name] = value
+    return settings
+
+
+def scaled_model_params(model_params, point):
+    """
+    Model parameters of one grid point, with rs/l/c/rp scalings applied.
+    """
+    model_params = copy.deepcopy(model_params)
+    column = {key: model_params['columns'].index(key) for key in PARAM_KEYS}
+    for name, value in point.items():
+        key, index = parse_coordinate(name)
+        if key in INPUT_KEYS:
+            continue
+        for row in model_params['rows']:
+            if (index is None or row[1] == index) and row[column[key]] is not None:
+                row[column[key]] *= value
+    return model_params
+
+
+class SweepResult():
+    """
+    Combined result of a sweep, indexed by sweep coordinates
+    x has shape (*shape, len(t), n_states)
+    """
+    def __init__(self, coords, t, x, model, settings, model_params):
+        self.coords = coords
+        self.shape = tuple(len(values) for values in coords.values())
+        self.t = t
+        self.x = x
+        self.model = model
+        self.settings = settings
+        self.model_params = model_params
+
+    def index(self, **point):
+        """
+        Grid index of the point given by coordinate values, e.g. index(frequency=0.4).
+        Coordinates with per-segment names ('rs:13') are passed as index(**{'rs:13': 1.2}).
+        """
+        if set(point) != set(self.coords):
+            raise ValueError(f"Expected values for all sweep coordinates {list(self.coords)}, got {list(point)}.")
+        return tuple(list(self.coords[name]).index(point[name]) for name in self.coords)
+
+    def points(self):
+        """
+        Iterate over (grid index, point dict) of every grid point.
+        """
+        for idx in np.ndindex(*self.shape):
+            yield idx, {name: values[i] for (name, values), i in zip(self.coords.items(), idx)}
+
+    def states(self, **point):
+        """
+        States of one grid point, shape (len(t), n_states).
+        """
+        return self.x[self.index(**point)]
+
+    def sel(self, **point):
+        """
+        StateSpaceOutput of one grid point, with the same layout as a single run.
+        """
+        model = StateSpaceModel(scaled_model_params(self.model_params, point),
+                                point_settings(self.settings, point))
+        return build_output(model, self.t, self.states(**point).T)
+
+    def __repr__(self):
+        return f"SweepResult: {dict(zip(self.coords, self.shape))}, {len(self.t)} time steps"
+
+
+def run_sweep(settings, model_params, coords):
+    """
+    Integrate every point of a sweep grid together on the state-space engine.
+    Args:
+        settings (dict): Base simulation settings.
+        model_params (dict): Base model parameters.
+        coords (dict): Sweep coordinates, name -> list of values.
+    Returns:
+        result (SweepResult): Combined result indexed by sweep coordinates.
+    """
+    coords = {name: list(values) for name, values in coords.items()}
+    parsed = {name: parse_coordinate(name) for name in coords}
+    model = StateSpaceModel(model_params, settings)
+
+    grid = list(itertools.product(*coords.values()))
+    N = len(grid)
+
+    # Per-run input signals (with a per-run table for tabulated waveforms) and segment parameters
+    signals = [dict(settings['input_signal']) for _ in grid]
+    scale = {key: np.ones((N, model.n)) for key in PARAM_KEYS}
+    for i, values in enumerate(grid):
+        for name, value in zip(coords, values):
+            key, index = parsed[name]
+            if key in INPUT_KEYS:
+                signals[i][key] = value
+            elif index is None:
+                scale[key][i] *= value
+            else:
+                scale[key][i, model.position[index]] *= value
+
+    signal = batch_signal(signals)
+    rs, l, c = model.rs * scale['rs'], model.l * scale['l'], model.c * scale['c']
+    g = model.g / scale['rp']
+
+    ic = settings['initial_conditions']
+    X0 = np.concatenate([ic['int_fi'] / l, ic['int_po'] / c], axis=1)
+
+    def rhs(t, y):
+        return model.batch_derivative(t, y.reshape(N, -1), signal, rs, l, c, g).ravel()
+
+    dt = settings['simulation']['time_step']
+    T = settings['simulation']['simulation_time']
+    t_eval = np.arange(0.0, T + 0.5 * dt, dt)
+    t_eval = t_eval[t_eval <= T]
+
+    sol = solve_ivp(rhs, (0.0, T), X0.ravel(), method='RK45', t_eval=t_eval, max_step=dt)
+    if not sol.success:
+        raise RuntimeError(f"Sweep integration failed: {sol.message}")
+
+    print(f"Sweep of {N} runs finished: {sol.t.size} time steps, {sol.nfev} batched RHS evaluations.")
+
+    # (N * n_states, n_t) -> (*shape, n_t, n_states)
+    x = sol.y.reshape(N, model.n_states, -1).transpose(0, 2, 1)
+    x = x.reshape(tuple(len(values) for values in coords.values()) + x.shape[1:])
+    return SweepResult(coords, sol.t, x, model, settings, model_params)
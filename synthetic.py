@@ -0,0 +1,88 @@
+"""
+Synthetic arterial tree generator
+- Branching trees of any size in the model_params.json schema (columns/rows/Connections)
+- Segment radii follow Murray's law at every bifurcation, with random asymmetry
+- rs, l and c scale with radius and length like a Poiseuille tube with a compliant wall
+- Terminal segments share a total peripheral resistance in proportion to their flow
+
+Per segment, relative to the root segment (radius ratio q, length ratio λ):
+    rs = rs_root · λ / q^4,   l = l_root · λ / q^2,   c = c_root · λ · q^3
+The root values default to the ascending aorta of Data/model_params.json.
+"""
+
+import json
+
+import numpy as np
+
+COLUMNS = ["Segment name", "Index", "rs", "l", "c", "rp", "Visco elast model", "Connections"]
+
+# Ascending aorta of Data/model_params.json, and the parallel Rp of its terminal segments
+ROOT_DEFAULTS = {'rs': 0.11, 'l': 0.27, 'c': 91.0}
+TOTAL_RP = 1.46
+
+
+def generate_tree(n_segments, branching=2, terminal_rp=TOTAL_RP, asymmetry=0.2, length_spread=0.5,
+                  root=None, seed=0):
+    """
+    Generate a branching arterial tree.
+    Args:
+        n_segments (int): Number of segments, at least 1.
+        branching (int): Children per branching segment; the last branching segment may get fewer.
+        terminal_rp (float): Total peripheral resistance of all terminal segments in parallel.
+        asymmetry (float): Spread of the flow split between children, 0 for symmetric trees.
+        length_spread (float): Log-normal spread of the segment lengths.
+        root (dict, optional): rs, l and c of the root segment, defaults to ROOT_DEFAULTS.
+        seed (int): Random seed, the same seed gives the same tree.
+    Returns:
+        model_params (dict): Tree in the model_params.json schema, segment 1 is the inflow segment.
+    """
+    if n_segments < 1 or branching < 1:
+        raise ValueError(f"Need n_segments >= 1 and branching >= 1, got {n_segments} and {branching}.")
+    rng = np.random.default_rng(seed)
+    root = {**ROOT_DEFAULTS, **(root or {})}
+
+    # Grow breadth-first: every segment branches until n_segments exist
+    radius = [1.0]
+    children = [[]]
+    k = 0
+    while len(radius) < n_segments:
+        n_children = min(branching, n_segments - len(radius))
+        # Murray's law: r_parent^3 = sum r_child^3, flow split drawn around an even split
+        split = rng.dirichlet(np.full(n_children, 1.0 / max(asymmetry, 1e-6) ** 2)) if n_children > 1 else [1.0]
+        for share in split:
+            children[k].append(len(radius))
+            radius.append(radius[k] * share ** (1.0 / 3.0))
+            children.append([])
+        k += 1
+
+    radius = np.asarray(radius)
+    length = rng.lognormal(0.0, length_spread, n_segments)
+    length[0] = 1.0
+
+    # Peripheral resistance of the terminals, parallel combination equal to terminal_rp
+    terminal = np.array([not c for c in children])
+    flow = radius ** 3 * terminal
+    rp = np.where(terminal, terminal_rp * flow.sum() / np.where(terminal, flow, 1.0), np.nan)
+
+    rows = []
+    for k in range(n_segments):
+        q, lam = radius[k], length[k]
+        rows.append([
+            f"Synthetic {k + 1}", k + 1,
+            round(float(root['rs'] * lam / q ** 4), 6),
+            round(float(root['l'] * lam / q ** 2), 6),
+            round(float(root['c'] * lam * q ** 3), 6),
+            round(float(rp[k]), 6) if terminal[k] else None,
+            "T",
+            [j + 1 for j in children[k]],
+        ])
+    return {'columns': list(COLUMNS), 'rows': rows}
+
+
+def save_model_params(model_params, path):
+    """
+    Write model parameters as JSON, one row per line like Data/model_params.json.
+    """
+    rows = ',\n'.join('    ' + json.dumps(row) for row in model_params['rows'])
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{\n  "columns": ' + json.dumps(model_params['columns']) + ',\n  "rows": [\n' + rows + '\n  ]\n}\n')
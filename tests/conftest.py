@@ -0,0 +1,32 @@
+"""
+Shared fixtures: the default network on the state-space engine with a short simulation time.
+"""
+
+import copy
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def load_json(name):
+    with open(os.path.join(ROOT, 'Data', name), encoding='utf-8') as file:
+        return json.load(file)
+
+
+@pytest.fixture
+def model_params():
+    return load_json('model_params.json')
+
+
+@pytest.fixture
+def settings(tmp_path):
+    settings = copy.deepcopy(load_json('settings.json'))
+    settings['simulation'].update({'engine': 'state_space', 'simulation_time': 0.4, 'quiet': True})
+    settings['output'].update({'save_results': False, 'chunk_size': 16})
+    settings['checkpoint'] = {'directory': str(tmp_path / 'checkpoints')}
+    return settings
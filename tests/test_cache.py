@@ -0,0 +1,50 @@
+import copy
+
+from cache import cache_key
+from checkpoint import job_path, make_checkpoint, save_checkpoint
+from state_space import StateSpaceModel
+
+
+def test_cache_key_ignores_output_section(settings, model_params):
+    other = copy.deepcopy(settings)
+    other['output']['format'] = 'columnar'
+    other['cache'] = {'enabled': True}
+    assert cache_key(other, model_params) == cache_key(settings, model_params)
+
+
+def test_cache_key_changes_with_inputs(settings, model_params):
+    key = cache_key(settings, model_params)
+    other = copy.deepcopy(settings)
+    other['input_signal']['amplitude'] += 1
+    assert cache_key(other, model_params) != key
+    params = copy.deepcopy(model_params)
+    assert cache_key(settings, params) == key
+    params['rows'][0][2] *= 1.1   # rs of segment 1
+    assert cache_key(settings, params) != key
+
+
+def test_cache_key_hashes_file_content(settings, model_params, tmp_path):
+    path = tmp_path / 'inflow.csv'
+    settings['input_signal']['file'] = str(path)
+    path.write_text('80\n120\n90\n')
+    key = cache_key(settings, model_params)
+    path.write_text('80\n125\n90\n85\n')   # same path, new measurement
+    assert cache_key(settings, model_params) != key
+
+
+def test_cache_key_hashes_start_checkpoint(settings, model_params, tmp_path):
+    model = StateSpaceModel(model_params, settings)
+    path = str(tmp_path / 'checkpoint_start.pkl')
+    save_checkpoint(make_checkpoint(settings, model, 0.2, model.x0 + 1.0), path)
+    settings['checkpoint']['warm_start'] = path
+    key = cache_key(settings, model_params)
+    save_checkpoint(make_checkpoint(settings, model, 0.2, model.x0 + 2.0), path)   # overwritten warm start
+    assert cache_key(settings, model_params) != key
+
+
+def test_cache_key_tells_resumed_from_fresh_auto_runs(settings, model_params):
+    settings['checkpoint'].update({'enabled': True, 'resume': 'auto'})
+    fresh = cache_key(settings, model_params)
+    model = StateSpaceModel(model_params, settings)
+    save_checkpoint(make_checkpoint(settings, model, 0.2, model.x0), job_path(settings, model))
+    assert cache_key(settings, model_params) != fresh
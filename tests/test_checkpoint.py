@@ -0,0 +1,43 @@
+import copy
+import os
+
+import numpy as np
+
+from checkpoint import final_checkpoint, job_path, load_checkpoint, run_checkpointed, save_checkpoint
+from state_space import StateSpaceModel, run_state_space
+
+
+def test_resume_continues_the_run(settings, model_params, tmp_path):
+    settings['simulation']['solver'] = 'foh'
+    model = StateSpaceModel(model_params, settings)
+    full = run_state_space(settings, model_params, model=model)
+
+    first = copy.deepcopy(settings)
+    first['simulation']['simulation_time'] = 0.2
+    first['checkpoint']['enabled'] = True
+    path = str(tmp_path / 'checkpoint_first.pkl')
+    out = run_state_space(first, model_params, model=model)
+    save_checkpoint(final_checkpoint(out, first, model_params, model), path)
+
+    settings['checkpoint'].update({'enabled': True, 'resume': path})
+    resumed = run_state_space(settings, model_params, model=model)
+    rows = np.searchsorted(full.t, resumed.t)
+    np.testing.assert_allclose(full.t[rows], resumed.t, atol=1e-12)
+    assert resumed.t[0] == load_checkpoint(path)['t']
+    np.testing.assert_allclose(resumed.x, np.asarray(full.x)[rows], rtol=1e-9, atol=1e-9 * np.abs(full.x).max())
+
+
+def test_periodic_checkpoints_hold_the_run_state(settings, model_params):
+    settings['simulation']['solver'] = 'foh'
+    settings['checkpoint'].update({'enabled': True, 'interval': 0.1})
+    model = StateSpaceModel(model_params, settings)
+    full = run_state_space(settings, model_params, model=model)
+    out = run_checkpointed(settings, model_params, model=model)
+    np.testing.assert_allclose(out.x, full.x, rtol=1e-12, atol=1e-12)
+
+    # The job checkpoint is left for an interrupted run to resume from; it holds the state at its time
+    assert os.path.exists(job_path(settings, model))
+    checkpoint = load_checkpoint(job_path(settings, model))
+    k = np.argmin(np.abs(full.t - checkpoint['t']))
+    np.testing.assert_allclose(checkpoint['x'], np.asarray(full.x)[k], rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(out.checkpoint['x'], np.asarray(full.x)[-1], rtol=1e-12, atol=1e-12)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+import decompose
+from decompose import run_decomposed
+from discrete import run_discrete
+from state_space import StateSpaceModel
+
+
+@pytest.mark.parametrize('coupling', ['relaxation', 'fixed'])
+def test_decomposed_matches_monolithic(settings, model_params, monkeypatch, coupling):
+    monkeypatch.setattr(decompose.os, 'cpu_count', lambda: 4)
+    settings['decompose'] = {'enabled': True, 'workers': 1, 'subtrees': 3, 'coupling': coupling, 'substeps': 8}
+    model = StateSpaceModel(model_params, settings)
+    out = run_decomposed(settings, model_params, model=model)
+    # Monolithic exact discretization on the coupling grid: only the junction interpolation differs
+    time_step = settings['simulation']['time_step']
+    settings['simulation'].update({'solver': 'foh', 'time_step': time_step / 8})
+    reference = run_discrete(settings, model_params, model=model)
+    assert out.n_subtrees > 1
+    np.testing.assert_allclose(out.t, reference.t[::8])
+    assert np.abs(out.x - reference.x[::8]).max() < 1e-3 * np.abs(reference.x).max()
+    # The junctions are solved per window, so a window takes one pass unless the valve switches within it
+    assert out.iterations.mean() < 1.5
+
+
+def test_fixed_coupling_warns_above_tolerance(settings, model_params, monkeypatch, capsys):
+    monkeypatch.setattr(decompose.os, 'cpu_count', lambda: 4)
+    settings['decompose'] = {'enabled': True, 'workers': 1, 'subtrees': 3, 'coupling': 'fixed', 'tolerance': 1e-16}
+    out = run_decomposed(settings, model_params)
+    assert out.coupling_error.max() >= 1e-16
+    assert 'fixed coupling exceeds tolerance' in capsys.readouterr().out
+
+
+def test_worker_processes_match_in_process(settings, model_params, monkeypatch):
+    monkeypatch.setattr(decompose.os, 'cpu_count', lambda: 4)
+    settings['simulation']['simulation_time'] = 0.2
+    settings['decompose'] = {'enabled': True, 'workers': 1, 'subtrees': 3}
+    serial = run_decomposed(settings, model_params)
+    settings['decompose']['workers'] = 2
+    parallel = run_decomposed(settings, model_params)
+    assert parallel.n_subtrees == serial.n_subtrees > 1
+    np.testing.assert_allclose(parallel.x, serial.x, rtol=1e-10, atol=1e-10)
+    np.testing.assert_array_equal(parallel.iterations, serial.iterations)
+
+
+def test_single_cpu_raises(settings, model_params, monkeypatch):
+    monkeypatch.setattr(decompose.os, 'cpu_count', lambda: 1)
+    settings['decompose'] = {'enabled': True, 'workers': 4}
+    with pytest.raises(ValueError, match='more than one CPU'):
+        run_decomposed(settings, model_params)
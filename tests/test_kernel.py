@@ -0,0 +1,27 @@
+import numpy as np
+
+from kernel import NetworkKernel, model_rhs
+from state_space import StateSpaceModel, run_state_space
+
+
+def test_fused_derivative_matches_sparse(settings, model_params):
+    model = StateSpaceModel(model_params, settings)
+    kernel = NetworkKernel(model)
+    rng = np.random.default_rng(0)
+    out = np.empty(model.n_states)
+    for t in (0.0, 0.3, 1.1):
+        x = rng.normal(scale=50.0, size=model.n_states)
+        for fi1 in (25.0, -25.0):   # aortic valve open and closed
+            x[model.valve] = fi1
+            expected = model.rhs(t, x)
+            np.testing.assert_allclose(kernel.rhs(t, x), expected, rtol=1e-12, atol=1e-9)
+            np.testing.assert_allclose(kernel.derivative(t, x, out), expected, rtol=1e-12, atol=1e-9)
+
+
+def test_fused_run_matches_sparse(settings, model_params):
+    model = StateSpaceModel(model_params, settings)
+    sparse = run_state_space(settings, model_params, model=model)
+    settings['simulation']['kernel'] = 'fused'
+    assert model_rhs(model, settings).__self__.__class__ is NetworkKernel
+    fused = run_state_space(settings, model_params, model=model)
+    np.testing.assert_allclose(fused.x, sparse.x, rtol=1e-9, atol=1e-9 * np.abs(sparse.x).max())
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+import main
+from main import output_db
+from metrics import MetricsTable
+
+
+def test_periodic_mode_reduces_metrics(settings, model_params):
+    settings['simulation']['mode'] = 'periodic'
+    settings['periodic'] = {'cycles': 2, 'steps_per_period': 500}
+    settings['metrics'] = {'enabled': True, 'keep_waveforms': True}
+    out = main.simulate(settings, model_params, None)
+    assert isinstance(out.metrics, MetricsTable)
+    p_mean = out.metrics.column('P_mean')
+    assert p_mean.shape[0] >= 1 and np.isfinite(p_mean).all()
+
+    settings['metrics']['keep_waveforms'] = False
+    assert isinstance(main.simulate(settings, model_params, None), MetricsTable)
+
+
+@pytest.mark.parametrize('section', ['probes', 'metrics', None])
+def test_main_runs_with_probe_and_metrics_outputs(settings, model_params, monkeypatch, tmp_path, section):
+    monkeypatch.chdir(tmp_path)   # saved outputs go to Output/ here
+    settings['output']['save_results'] = True
+    if section == 'probes':
+        settings['probes'] = {'enabled': True, 'signals': [[13, '-Po'], [1, 'Pi']]}
+    elif section == 'metrics':
+        settings['metrics'] = {'enabled': True}
+    monkeypatch.setattr(main, 'loader', lambda: (settings, model_params))
+    dbs = []
+    monkeypatch.setattr(main, 'output_db', lambda *args: dbs.append(output_db(*args)) or dbs[-1])
+    main.main()
+
+    db = dbs[0]
+    if section == 'metrics':
+        assert db is None
+    elif section == 'probes':
+        assert set(db) == {'SS13', 'SS1'} and len(db['SS13']['-Po'][0]) > 0
+    else:
+        assert len(db['t']) > 0 and '-Po' in db['SS13']
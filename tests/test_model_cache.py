@@ -0,0 +1,33 @@
+import copy
+
+from model_cache import load_state_space_model, model_key
+
+
+def test_model_key_ignores_run_sections(settings, model_params):
+    key = model_key(settings, model_params)
+    other = copy.deepcopy(settings)
+    other['simulation']['simulation_time'] = 30.0
+    other['input_signal']['amplitude'] += 5
+    for section in ('probes', 'metrics', 'profile', 'ensemble', 'decompose', 'checkpoint'):
+        other[section] = {'enabled': True}
+    assert model_key(other, model_params) == key
+
+
+def test_model_key_changes_with_model(settings, model_params):
+    key = model_key(settings, model_params)
+    params = copy.deepcopy(model_params)
+    params['rows'][0][4] *= 1.1   # c of segment 1
+    assert model_key(settings, params) != key
+    other = copy.deepcopy(settings)
+    other['initial_conditions']['int_po'] = 1.0
+    assert model_key(other, model_params) != key
+
+
+def test_cached_model_matches_built_model(settings, model_params, tmp_path):
+    settings['model_cache'] = {'enabled': True, 'directory': str(tmp_path)}
+    built, cached = load_state_space_model(settings, model_params)
+    assert not cached
+    loaded, cached = load_state_space_model(settings, model_params)
+    assert cached
+    assert (loaded.A != built.A).nnz == 0
+    assert (loaded.B == built.B).all() and (loaded.x0 == built.x0).all()
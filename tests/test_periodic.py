@@ -0,0 +1,32 @@
+import numpy as np
+
+from discrete import DiscreteModel
+from periodic import run_periodic
+from state_space import StateSpaceModel, input_pressure
+
+
+def test_periodic_orbit_repeats(settings, model_params):
+    settings['periodic'] = {'cycles': 2, 'steps_per_period': 500}
+    out = run_periodic(settings, model_params)
+    assert out.converged
+
+    # The recorded cycles start and end on the orbit
+    period = 1.0 / settings['input_signal']['frequency']
+    x = np.asarray(out.x)
+    scale = np.abs(x).max()
+    start = x[0]
+    for k in (np.argmin(np.abs(out.t - period)), -1):
+        assert np.abs(x[k] - start).max() < 1e-5 * scale
+
+
+def test_periodic_state_is_fixed_point_of_transient(settings, model_params):
+    settings['periodic'] = {'cycles': 1, 'steps_per_period': 500}
+    model = StateSpaceModel(model_params, settings)
+    x0 = np.asarray(run_periodic(settings, model_params, model=model).x)[0]
+
+    # One period of the plain exact stepping from the orbit state comes back to it
+    steps = 500
+    h = 1.0 / settings['input_signal']['frequency'] / steps
+    t = np.arange(steps + 1) * h
+    x = DiscreteModel(model, h, 'foh').run(x0, input_pressure(t, settings))
+    assert np.abs(x[-1] - x0).max() < 1e-5 * np.abs(x).max()
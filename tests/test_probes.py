@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from probes import bdsim_states, probe_signal, run_probed
+from state_space import StateSpaceModel, run_state_space, state_names
+
+
+def test_probes_match_full_run(settings, model_params):
+    settings['simulation']['solver'] = 'foh'
+    settings['probes'] = {'enabled': True, 'signals': [[13, '-Po'], [1, 'Pi'], [7, 'Fi']], 'decimation': 3}
+    model = StateSpaceModel(model_params, settings)
+    full = run_state_space(settings, model_params, model=model)
+    out = run_probed(settings, model_params, model=model)
+
+    x = np.asarray(full.x).T
+    for segment, signal in [(13, '-Po'), (1, 'Pi'), (7, 'Fi')]:
+        t, values = out.signal(segment, signal)
+        rows = np.searchsorted(full.t, t)
+        np.testing.assert_allclose(full.t[rows], t)
+        np.testing.assert_allclose(values, probe_signal(model, full.t, x, segment, signal)[rows], rtol=1e-10,
+                                   atol=1e-10)
+        assert np.allclose(np.diff(t), 3 * settings['simulation']['time_step'])
+    np.testing.assert_allclose(out.x_end, np.asarray(full.x)[-1], rtol=1e-10, atol=1e-10)
+
+
+def bdsim_output(model, states):
+    """
+    Stand-in for a bdsim output: integrator states L·Fi and C·Po named like the subsystems of connect_segments.
+    """
+    scale = np.concatenate([model.l, model.c])
+    return SimpleNamespace(t=np.arange(len(states)), x=states * scale,
+                           xnames=[f'{name}x0' for name in state_names(model)])
+
+
+def test_bdsim_states_round_trip(settings, model_params):
+    model = StateSpaceModel(model_params, settings)
+    states = np.random.default_rng(0).normal(size=(4, model.n_states))
+    np.testing.assert_allclose(bdsim_states(bdsim_output(model, states), model), states)
+
+
+def test_bdsim_states_raise_on_missing_state(settings, model_params):
+    model = StateSpaceModel(model_params, settings)
+    out = bdsim_output(model, np.ones((4, model.n_states)))
+    out.xnames[5] = 'subsystem.5/unknown'
+    with pytest.raises(ValueError, match='subsystem.5/Fi'):
+        bdsim_states(out, model)
@@ -0,0 +1,40 @@
+import numpy as np
+
+from reduction import check_reduced, full_outputs, reduce_model, run_reduced
+from state_space import StateSpaceModel
+from synthetic import generate_tree
+
+
+def test_reduced_matches_full_within_tolerance(settings, model_params):
+    settings['simulation']['simulation_time'] = 2.0
+    settings['reduction'] = {'tolerance': 1e-2}
+    model = StateSpaceModel(model_params, settings)
+    reduced = reduce_model(settings, model_params, model=model)
+    assert reduced.n_states < model.n_states
+    assert np.max(reduced.observed_error) <= 1e-2
+
+    report = check_reduced(settings, model_params, reduced, model=model)
+    assert report['within_tolerance']
+    y_full, _ = full_outputs(model, reduced.outputs, settings)
+    out = run_reduced(settings, reduced)
+    for i, output in enumerate(reduced.outputs):
+        assert np.abs(out.signal(*output) - y_full[:, i]).max() <= 1e-2 * np.abs(y_full[:, i]).max()
+
+
+def test_check_reduced_warns_above_tolerance(settings, model_params, capsys):
+    settings['simulation']['simulation_time'] = 2.0
+    reduced = reduce_model(settings, model_params, order=10)
+    report = check_reduced(settings, model_params, reduced)
+    assert not report['within_tolerance']
+    assert 'Warning' in capsys.readouterr().out
+
+
+def test_reduced_model_is_faster_on_a_larger_tree(settings):
+    settings['simulation']['simulation_time'] = 4.0
+    settings['reduction'] = {'tolerance': 1e-2}
+    model_params = generate_tree(127)
+    reduced = reduce_model(settings, model_params)
+    assert reduced.n_states < 0.7 * reduced.n_full
+    report = check_reduced(settings, model_params, reduced)
+    assert report['within_tolerance']
+    assert report['speedup'] > 1.5
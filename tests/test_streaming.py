@@ -0,0 +1,27 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from state_space import run_state_space
+from streaming import astream, stream
+
+
+def test_stream_blocks_match_full_run(settings, model_params):
+    settings['simulation']['solver'] = 'foh'
+    full = run_state_space(settings, model_params)
+    blocks = list(stream(settings, model_params, signals=[(13, 'Po')]))
+    t = np.concatenate([block['t'] for block in blocks])
+    np.testing.assert_allclose(t, full.t)
+    np.testing.assert_allclose(blocks[-1]['x_end'], np.asarray(full.x)[-1], rtol=1e-10, atol=1e-10)
+
+
+def test_astream_raises_errors_of_the_integration(settings, model_params):
+    async def consume():
+        return [block async for block in astream(settings, model_params, signals=[(999, 'Po')])]
+
+    async def run():
+        return await asyncio.wait_for(consume(), timeout=30.0)
+
+    with pytest.raises(ValueError, match='unknown segment 999'):
+        asyncio.run(run())